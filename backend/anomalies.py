@@ -0,0 +1,234 @@
+"""
+Points out tags and vendors whose spending in a month is out of their normal range, like a utility bill that doubled
+or a month with a lot more Uber than usual, so they don't have to be spotted in graph_one.
+
+Spending is summed by month for each vendor (and each split child's own tag). A tag or vendor's normal range comes
+from the months before the one being checked: the median, and the median absolute deviation (MAD) around it, which
+one big month in the history doesn't throw off the way an average and standard deviation would. Months after a tag or
+vendor first shows up count as 0 when there's nothing in them.
+
+The monthly sums are cached in the Data State table, and after an import only the months with new transactions,
+new splits or new transfer pairs are summed again. Moving saved transactions to another vendor sums everything again.
+
+Example use:
+    anomalies.find_anomalies()
+    anomalies.find_anomalies(period="2022-07", threshold=5)
+"""
+import json
+import datetime
+import warnings
+from typing import TYPE_CHECKING
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy import select
+from sqlalchemy import func
+
+from backend import archive
+from backend import queries
+from backend import database as db
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Expenses summed by period (the first period_length characters of the Date, 7 for months and 10 for days), vendor
+# and the tag a split child was given ('' for everything else), from the same ledger as the graphs and the export.
+# Transfers between accounts are left out
+spend_query = """
+    SELECT SUBSTR(l.Date, 1, {period_length}) AS Period, l.VendorUUID, COALESCE(l.Tag, '') AS Tag, -SUM(l.Amount) AS Spend
+    FROM ({ledger}) l
+    WHERE l.Amount < 0 AND NOT l.Transfer
+    GROUP BY Period, l.VendorUUID, COALESCE(l.Tag, '')
+"""
+
+# Scales a MAD to be comparable to a standard deviation
+mad_scale = 1.4826
+
+
+def sum_spend(months: list | None = None, period_length: int = 7) -> list:
+    """
+    Returns [Period, VendorUUID, Tag, Spend] rows for the given months like "2022-07", or for every month.
+    Periods are months by default, set period_length to 10 for days
+    """
+    with db.engine.connect() as conn:
+        transactions_table, children_table = archive.attach_archives(conn)
+        if months is None:
+            query = spend_query.format(ledger=queries.ledger_query(transactions_table, children_table), period_length=period_length)
+            return [list(row) for row in conn.execute(text(query))]
+
+        # One month at a time, every date in a month sorts between "2022-07" and "2022-07~" so the Date index is used
+        month_filter = "AND {row}.Date >= :month_start AND {row}.Date < :month_end"
+        query = spend_query.format(
+            ledger=queries.ledger_query(transactions_table, children_table, month_filter), period_length=period_length
+        )
+        rows = []
+        for month in months:
+            rows.extend(list(row) for row in conn.execute(text(query), {"month_start": month, "month_end": f"{month}~"}))
+        return rows
+
+
+def checked_ids() -> dict:
+    """
+    The newest transaction, split and transfer pair ids, and the rewrite version, the spending sums are stamped
+    with these. New ids only need their months summed again, a new rewrite version needs everything summed again
+    """
+    with db.engine.connect() as conn:
+        max_id = conn.execute(select(func.max(db.Transactions.id))).scalar() or 0
+        max_child_id = conn.execute(select(func.max(db.ChildTransactions.id))).scalar() or 0
+        max_pair_id = conn.execute(select(func.max(db.TransferPairs.id))).scalar() or 0
+    return {
+        "checked_id": max_id,
+        "checked_child_id": max_child_id,
+        "checked_pair_id": max_pair_id,
+        "rewrite_version": int(db.get_state("rewrite_version", "0")),
+    }
+
+
+def touched_months(checked: dict) -> set:
+    """The months the transactions, splits and transfer pairs added after the checked ids fall in"""
+    transactions = db.Transactions
+    with db.engine.connect() as conn:
+        pair_query = select(db.TransferPairs.Debit_id, db.TransferPairs.Credit_id).where(
+            db.TransferPairs.id > checked["checked_pair_id"]
+        )
+        pair_ids = [transaction_id for pair in conn.execute(pair_query) for transaction_id in pair]
+        month_query = select(func.substr(transactions.Date, 1, 7)).distinct().where(
+            (transactions.id > checked["checked_id"]) | transactions.id.in_(pair_ids)
+        )
+        months = {row[0] for row in conn.execute(month_query)}
+        child_query = select(func.substr(db.ChildTransactions.Date, 1, 7)).distinct().where(
+            db.ChildTransactions.id > checked["checked_child_id"]
+        )
+        months |= {row[0] for row in conn.execute(child_query)}
+    return months
+
+
+def update_monthly_spend(full: bool = False) -> list:
+    """
+    Brings the cached monthly sums up to date and returns them as [Month, VendorUUID, Tag, Spend] rows.
+    Only the months with transactions, splits or transfer pairs added since the last run are summed again,
+    set full to True to sum every month
+    """
+    checked = checked_ids()
+    cached = db.get_state("monthly_spend")
+    cached = json.loads(cached) if cached is not None else None
+    if full or cached is None or cached.get("rewrite_version", 0) != checked["rewrite_version"]:
+        rows = sum_spend()
+    elif all(cached[key] == value for key, value in checked.items()):
+        return cached["rows"]
+    else:
+        months = touched_months(cached)
+        rows = [row for row in cached["rows"] if row[0] not in months]
+        rows.extend(sum_spend(sorted(months)))
+
+    db.set_state("monthly_spend", json.dumps(dict(checked, rows=rows)))
+    return rows
+
+
+def baselines(spend: np.ndarray, window: int) -> tuple:
+    """
+    The normal range of every column of spend (months by tags or vendors, oldest month first) for the month after
+    the last row, from the window months before it. Returns the median, the scaled MAD and how many months it's from.
+    Missing months are NaN and don't count
+    """
+    history = spend[-window:]
+    with warnings.catch_warnings():
+        # Columns with no history at all come out as NaN, which is what they should be
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        median = np.nanmedian(history, axis=0)
+        mad = np.nanmedian(np.abs(history - median), axis=0)
+    return median, mad * mad_scale, np.sum(~np.isnan(history), axis=0)
+
+
+def score_period(spend: "pd.DataFrame", period: str, window: int, min_months: int, threshold: float, min_change: float) -> "pd.DataFrame":
+    """
+    Scores every column of spend (a month by name table) for the period against the months before it, and returns
+    the ones out of their normal range. The score is how many scaled MADs the period is from the median, the MAD
+    is never taken as less than a tenth of the median or a dollar so a bill that never changed isn't flagged for cents
+    """
+    import pandas as pd
+
+    # Every month up to the period, the ones a name has no spending in are 0 once the name has shown up
+    months = pd.period_range(spend.index.min(), period, freq="M").strftime("%Y-%m")
+    spend = spend.reindex(months)
+    started = spend.notna().cummax()
+    spend = spend.fillna(0).where(started)
+
+    values = spend.to_numpy(dtype=float)
+    current = values[-1]
+    median, scale, history_months = baselines(values[:-1], window)
+    scale = np.maximum(scale, np.maximum(np.abs(median) * 0.1, 1.0))
+    change = current - median
+    score = change / scale
+
+    flagged = (history_months >= min_months) & (np.abs(score) >= threshold) & (np.abs(change) >= min_change)
+    return pd.DataFrame(
+        {
+            "Name": spend.columns[flagged],
+            "Amount": current[flagged].round(2),
+            "Usual": median[flagged].round(2),
+            "Usual Low": np.maximum(median - threshold * scale, 0)[flagged].round(2),
+            "Usual High": (median + threshold * scale)[flagged].round(2),
+            "Change": change[flagged].round(2),
+            "Score": score[flagged].round(1),
+            "Months of History": history_months[flagged],
+        }
+    )
+
+
+def find_anomalies(
+    period: str | None = None,
+    window: int = 12,
+    min_months: int = 4,
+    threshold: float = 3.5,
+    min_change: float = 20.0,
+    full: bool = False,
+) -> "pd.DataFrame | None":
+    """
+    Returns the tags and vendors whose spending in period (like "2022-07", the newest month by default) is out of
+    the range of the window months before it, the biggest surprise first. Names need min_months of history to be
+    checked, and a month has to be threshold scaled MADs and at least min_change dollars off to count.
+    Amounts are positive dollars spent. When period is the current calendar month, only spending above the range is
+    shown, since every month looks low part way through
+    """
+    import pandas as pd
+
+    rows = update_monthly_spend(full)
+    if not rows:
+        print("There's no spending to check")
+        return None
+    monthly = pd.DataFrame(rows, columns=["Month", "VendorUUID", "Tag", "Spend"])
+
+    # The vendors' newest names and tags, a split child keeps the tag it was given
+    vendor_map = {vendor_uuid: queries.uuid_to_vendor(vendor_uuid) for vendor_uuid in monthly["VendorUUID"].unique()}
+    tag_map = {vendor_uuid: queries.uuid_to_tag(vendor_uuid) for vendor_uuid in monthly["VendorUUID"].unique()}
+    monthly["Vendor"] = monthly["VendorUUID"].map(vendor_map)
+    monthly["Tag"] = monthly["Tag"].where(monthly["Tag"] != "", monthly["VendorUUID"].map(tag_map))
+    monthly = monthly[monthly["Tag"] != "Internal Transfer"]
+
+    newest_month = monthly["Month"].max()
+    period = period or newest_month
+    if period < monthly["Month"].min():
+        print(f"There's no spending before {period} to compare it to")
+        return None
+
+    found = []
+    for kind, column in (("Tag", "Tag"), ("Vendor", "Vendor")):
+        kind_monthly = monthly if kind == "Tag" else monthly[monthly["VendorUUID"] != "No Vendor Found"]
+        spend = kind_monthly[kind_monthly["Month"] <= period].pivot_table(
+            index="Month", columns=column, values="Spend", aggfunc="sum"
+        )
+        scored = score_period(spend, period, window, min_months, threshold, min_change)
+        scored.insert(0, "Kind", kind)
+        found.append(scored)
+
+    anomaly_table = pd.concat(found, ignore_index=True)
+    # Only the month that's still going gets its low spending dropped, an old export's last month is complete
+    if period == datetime.date.today().strftime("%Y-%m"):
+        anomaly_table = anomaly_table[anomaly_table["Change"] > 0]
+    if anomaly_table.empty:
+        print(f"No unusual spending in {period}")
+        return None
+
+    anomaly_table.insert(2, "Month", period)
+    return anomaly_table.sort_values(by="Score", key=np.abs, ascending=False).reset_index(drop=True)
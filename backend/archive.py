@@ -0,0 +1,177 @@
+"""
+Moves closed years out of budget.db into their own SQLite file next to it, like budget_archive_2019.db, so the
+file imports and indexes work on only holds the recent years.
+
+Archives are attached read only when something needs the whole history. build_tran_table reads the
+"All Transactions" and "All Child Transactions" views, which add every archive to the current tables, so the graphs
+still see every year, and so do the export, anomalies, recurring charges and vendor suggestions. Everything that
+writes (imports, splits, vendor matching, audits) only touches budget.db.
+The hashes of archived transactions stay in budget.db so an old export imported again doesn't bring them back.
+The biggest archived ids are remembered too, so new transactions and splits never get an id an archive already
+uses, which would make the views, transfer pairs and splits point at two rows.
+
+Archives are never written to, so revendorize_all, reclassify_vendor and add_vendor's revendorizer leave archived
+transactions on the vendor they had when they were archived. Renaming a vendor or changing its tag still shows up
+for archived years, since names and tags are looked up by UUID. To move archived transactions to a new pattern,
+revendorize before archiving the year.
+
+Example use:
+    archive.archive_year(2019)
+    archive.archived_years()
+"""
+import os
+import re
+import glob
+from urllib.parse import quote
+
+from sqlalchemy import create_engine
+from sqlalchemy import text
+from sqlalchemy import select
+from sqlalchemy import func
+from sqlalchemy.engine import Connection
+
+from backend import database as db
+
+# The tables that move to the archive, Transfer Pairs and everything else stay in budget.db
+archived_tables = [db.Transactions.__table__, db.ChildTransactions.__table__]
+
+# Skips inserting a transaction that was already archived, INSERT OR IGNORE then counts it as a duplicate
+archived_hash_trigger = text(
+    """
+    CREATE TRIGGER IF NOT EXISTS "Transactions Skip Archived" BEFORE INSERT ON Transactions
+    WHEN EXISTS (SELECT 1 FROM "Archived Hashes" WHERE Hash = new.Hash)
+    BEGIN
+        SELECT RAISE(IGNORE);
+    END
+    """
+)
+
+
+def archive_path(year: int) -> str:
+    """Where the archive for a year of the current database lives"""
+    return f"{os.path.splitext(db.db_path)[0]}_archive_{year}.db"
+
+
+def archived_years() -> list:
+    """Returns the years that have an archive file, oldest first"""
+    prefix = f"{os.path.splitext(db.db_path)[0]}_archive_"
+    years = []
+    for path in glob.glob(f"{glob.escape(prefix)}*.db"):
+        year = path[len(prefix) : -len(".db")]
+        if re.fullmatch(r"\d{4}", year):
+            years.append(int(year))
+    return sorted(years)
+
+
+@db.writes_database
+def archive_year(year: int, vacuum: bool = False) -> int:
+    """
+    Moves every transaction from the given year, with its children, into that year's archive file and returns how
+    many were moved. Running it again for the same year moves anything imported for that year since.
+    The newest year in the ledger can't be archived. Set vacuum to True to shrink budget.db afterwards
+    """
+    with db.engine.connect() as conn:
+        newest_date = conn.execute(select(func.max(db.Transactions.Date))).scalar()
+    if newest_date is None or year >= int(newest_date[:4]):
+        print(f"{year} can't be archived, only years before the newest one in the ledger can")
+        return 0
+
+    # Make the archive with the same tables, an existing archive just gets the new rows added
+    path = archive_path(year)
+    archive_engine = create_engine(f"sqlite:///{path}")
+    db.Base.metadata.create_all(archive_engine, tables=archived_tables)
+    archive_engine.dispose()
+
+    year_filter = "Date >= :start AND Date < :end"
+    bounds = {"start": f"{year}-01-01", "end": f"{year + 1}-01-01"}
+    with db.engine.connect() as conn:
+        # An attached database can't be detached in the middle of a transaction, so the move gets its own
+        conn.execute(text("ATTACH DATABASE :path AS archive"), {"path": path})
+        try:
+            with conn.begin():
+                # Children first, found through their parent's date since that's what gets archived
+                conn.execute(
+                    text(
+                        f"""INSERT OR IGNORE INTO archive."Child Transactions" SELECT * FROM main."Child Transactions"
+                        WHERE Parent_id IN (SELECT id FROM main.Transactions WHERE {year_filter})"""
+                    ),
+                    bounds,
+                )
+                moved = conn.execute(
+                    text(f"INSERT OR IGNORE INTO archive.Transactions SELECT * FROM main.Transactions WHERE {year_filter}"),
+                    bounds,
+                ).rowcount
+                conn.execute(
+                    text(
+                        f"""INSERT OR IGNORE INTO main."Archived Hashes" (Hash, Year)
+                        SELECT Hash, :year FROM main.Transactions WHERE {year_filter}"""
+                    ),
+                    dict(bounds, year=year),
+                )
+                conn.execute(archived_hash_trigger)
+                conn.execute(
+                    text(
+                        f"""DELETE FROM main."Child Transactions"
+                        WHERE Parent_id IN (SELECT id FROM main.Transactions WHERE {year_filter})"""
+                    ),
+                    bounds,
+                )
+                conn.execute(text(f"DELETE FROM main.Transactions WHERE {year_filter}"), bounds)
+                # SQLite hands out one past the biggest id left, which could be a moved row's id
+                archived_ids = {
+                    table.name: conn.execute(text(f'SELECT max(id) FROM archive."{table.name}"')).scalar() or 0
+                    for table in archived_tables
+                }
+        finally:
+            conn.execute(text("DETACH DATABASE archive"))
+
+    if vacuum:
+        with db.engine.connect() as conn:
+            conn.execute(text("VACUUM"))
+
+    # New rows start past every id an archive holds, see database.first_id
+    for table_name, archived_id in archived_ids.items():
+        saved_id = int(db.get_state(f"{table_name} archived id", "0"))
+        db.set_state(f"{table_name} archived id", str(max(saved_id, archived_id)))
+
+    if moved:
+        db.bump_data_version()
+        # Caches stamped with the newest ids have to start over, the rows behind those ids just left
+        db.bump_rewrite_version()
+    print(f"Moved {moved} transactions from {year} to {path}")
+    return moved
+
+
+def archived_max_id(table_name: str) -> int:
+    """The biggest id of the table in any archive, 0 when there are none"""
+    years = archived_years()
+    if not years:
+        return 0
+    with db.engine.connect() as conn:
+        attach_archives(conn)
+        return max(
+            conn.execute(text(f'SELECT max(id) FROM archive_{year}."{table_name}"')).scalar() or 0 for year in years
+        )
+
+
+def attach_archives(conn: Connection) -> tuple:
+    """
+    Attaches every archive to the connection read only, and makes the temporary "All Transactions" and
+    "All Child Transactions" views over the current tables and the archives.
+    Returns the names of the tables to read the whole history from, just the current tables when there are no archives
+    """
+    years = archived_years()
+    if not years:
+        return "Transactions", "Child Transactions"
+
+    attached = {row[1] for row in conn.execute(text("PRAGMA database_list"))}
+    for year in years:
+        if f"archive_{year}" not in attached:
+            uri = f"file:{quote(os.path.abspath(archive_path(year)))}?mode=ro"
+            conn.execute(text(f"ATTACH DATABASE :uri AS archive_{year}"), {"uri": uri})
+
+    for view, table in (("All Transactions", "Transactions"), ("All Child Transactions", "Child Transactions")):
+        parts = [f'SELECT * FROM main."{table}"'] + [f'SELECT * FROM archive_{year}."{table}"' for year in years]
+        conn.execute(text(f'DROP VIEW IF EXISTS temp."{view}"'))
+        conn.execute(text(f'CREATE TEMP VIEW "{view}" AS ' + " UNION ALL ".join(parts)))
+    return "All Transactions", "All Child Transactions"
@@ -0,0 +1,209 @@
+"""
+Benchmarks for the import, splitting and graph aggregation steps. The import is timed through
+crud.import_transactions itself, broken down by its instrument timers, so it covers everything a real import does.
+Each run builds a temp SQLite database, so your budget.db is never touched, and saves its results as json
+so runs can be compared over time. Runs offline, example use:
+
+    python -m backend.benchmark --sizes 10000 100000 1000000
+    python -m backend.benchmark --compare benchmarks/old.json benchmarks/new.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import datetime
+import tempfile
+import tracemalloc
+import subprocess
+import contextlib
+
+from sqlalchemy import select
+
+from backend import database as db
+from backend import instrument
+
+default_sizes = [10_000, 100_000, 1_000_000]
+results_folder = "./benchmarks/"
+
+
+@contextlib.contextmanager
+def measure(results: dict, stage: str, rows: int, memory: bool = True):
+    """Times the stage, and if memory is True also records the peak memory python allocated during it"""
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        results[stage] = {
+            "seconds": round(seconds, 4),
+            "rows per second": round(rows / seconds) if seconds else None,
+        }
+        if memory:
+            results[stage]["peak mb"] = round(tracemalloc.get_traced_memory()[1] / 1024**2, 2)
+            tracemalloc.stop()
+
+
+def benchmark_size(num_rows: int, work_folder: str, memory: bool = True) -> dict:
+    """
+    Runs every stage once against a fresh temp database filled with num_rows of generated transactions.
+    Returns a dictionary of stage to its timing, shaped like:
+    {"import": {"seconds": 1.2, "rows per second": 100000, "peak mb": 12.3}, "import: hash": {"seconds": 0.1, ...}, ...}
+    """
+    # Point everything at a fresh database before the modules that use it are imported
+    db.use_database(os.path.join(work_folder, f"benchmark_{num_rows}.db"))
+    from backend import crud
+    from backend import queries
+    from backend import persistence
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        crud.load_vendors(crud.yml_file_path)
+        crud.generate_example_data(num_rows, account_type="Checking", save_path=work_folder)
+    bank_profiles = persistence.load_yaml("bank_profiles.yml")
+
+    results = {}
+
+    # The real import, from reading the csv through transfer pairing, the snapshot and the spend curves.
+    # Its instrument timers break it down into stages, they add a little time of their own to every row
+    instrument.enable()
+    try:
+        with measure(results, "import", num_rows, memory):
+            # get_latest_export_paths wants the folder with its trailing slash
+            crud.import_transactions(os.path.join(work_folder, ""), bank_profiles, db.engine, log_level=logging.DEBUG)
+        import_timers = instrument.summary()["timers"]
+    finally:
+        instrument.enable(False)
+    for name, stats in import_timers.items():
+        results[f"import: {name}"] = {
+            "seconds": stats["seconds"],
+            "calls": stats["calls"],
+            "rows per second": round(num_rows / stats["seconds"]) if stats["seconds"] else None,
+        }
+
+    # Split the first few transactions in two, make_children checks and inserts one parent at a time
+    with db.engine.connect() as conn:
+        parents = conn.execute(
+            select(db.Transactions.id, db.Transactions.Amount, db.Transactions.VendorUUID).limit(min(100, num_rows))
+        ).fetchall()
+    tag = queries.uuid_to_tag(parents[0][2])
+    vendor = queries.uuid_to_vendor(parents[0][2])
+    with measure(results, "split", len(parents), memory):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for parent_id, amount, _ in parents:
+                half = round(amount / 2, 2)
+                children = [(half, vendor, tag, "half"), (round(amount - half, 2), vendor, tag, "other half")]
+                crud.make_children(db.engine, parent_id, children)
+
+    from backend import graphs
+
+    with measure(results, "frame build", num_rows, memory):
+        tran_table = graphs.build_tran_table()
+
+    first_date = tran_table["Date"].min()
+    year, month = str(first_date.year), f"{first_date.month:02d}"
+    with measure(results, "graph_one aggregation", num_rows, memory):
+        graphs.graph_one_data("Month", year, month, table=tran_table)
+
+    budget_plans = persistence.load_yaml("budget_plans.yml")
+    with measure(results, "graph_three aggregation", num_rows, memory):
+        graphs.graph_three_data(year, month, next(iter(budget_plans)), budget_plans, table=tran_table)
+
+    # A whole check-in, each view on its own and then through the report engine, without drawing
+    from backend import reports
+
+    budget_plan = next(iter(budget_plans))
+    with measure(results, "check-in views separately", num_rows, memory):
+        with contextlib.redirect_stdout(io.StringIO()):
+            graphs.graph_one_data("Month", year, month, table=tran_table)
+            graphs.graph_two_data("Month", year, month, table=tran_table)
+            graphs.graph_three_data(year, month, budget_plan, budget_plans, table=tran_table)
+            graphs.graph_four_data(year, month, table=tran_table)
+            graphs.graph_five_data(year, month, table=tran_table)
+            graphs.pt_one("Vendor w/o default Tag", f"{year}-{month}")
+    with measure(results, "check-in reports", num_rows, memory):
+        with contextlib.redirect_stdout(io.StringIO()):
+            reports.run_reports(
+                reports.all_views, year, month, budget_plan=budget_plan, Salary=50000, figures=False, table=tran_table
+            )
+
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes: list = default_sizes, memory: bool = True, output_folder: str = results_folder) -> dict:
+    """
+    Benchmarks every size and saves the results to a timestamped json file in output_folder.
+    Each size gets its own temp folder, database and generated csv
+    """
+    run = {
+        "started": datetime.datetime.now().isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "memory traced": memory,
+        "sizes": {},
+    }
+    for num_rows in sizes:
+        with tempfile.TemporaryDirectory() as work_folder:
+            print(f"Benchmarking {num_rows} rows")
+            run["sizes"][str(num_rows)] = benchmark_size(num_rows, work_folder, memory)
+            for stage, stage_results in run["sizes"][str(num_rows)].items():
+                print(f"  {stage}: {stage_results}")
+
+    os.makedirs(output_folder, exist_ok=True)
+    file_name = f"benchmark_{run['started'].replace(':', '-')}.json"
+    with open(os.path.join(output_folder, file_name), "w") as results_file:
+        json.dump(run, results_file, indent=2)
+    print(f"Saved results to {os.path.join(output_folder, file_name)}")
+    return run
+
+
+def compare(old_path: str, new_path: str) -> None:
+    """Prints how much faster or slower each stage got between two saved runs"""
+    with open(old_path, "r") as old_file:
+        old = json.load(old_file)
+    with open(new_path, "r") as new_file:
+        new = json.load(new_file)
+
+    print(f"Comparing {old['commit']} ({old['started']}) to {new['commit']} ({new['started']})")
+    for num_rows, new_stages in new["sizes"].items():
+        if num_rows not in old["sizes"]:
+            continue
+        print(f"{num_rows} rows")
+        for stage, new_stage in new_stages.items():
+            old_stage = old["sizes"][num_rows].get(stage)
+            if not old_stage or not new_stage["seconds"]:
+                continue
+            speedup = old_stage["seconds"] / new_stage["seconds"]
+            print(f"  {stage}: {old_stage['seconds']}s -> {new_stage['seconds']}s ({round(speedup, 2)}x)")
+
+
+def main(argv: list | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the import, vendorizing, splitting and graph steps")
+    parser.add_argument("--sizes", type=int, nargs="+", default=default_sizes)
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, it slows every stage down")
+    parser.add_argument("--output", default=results_folder)
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run_benchmarks(args.sizes, memory=not args.no_memory, output_folder=args.output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,6 +1,31 @@
+import re
+import time
+import json
+import hashlib
+from collections import Counter
+from typing import NamedTuple
+
 from sqlalchemy import select
+from sqlalchemy import text
 
 from backend import database as db
+from backend import queries
+from backend import persistence
+
+# Regex shapes that can backtrack catastrophically, checked against the pattern text. pattern_check refuses these
+blocking_pattern_shapes = {
+    # A quantified group that has a quantifier inside, like (a+)+ or (\w*\s?)*
+    "nested quantifier": re.compile(r"\((?:[^()\\]|\\.)*(?:[+*]|\{\d*,\d*\})(?:[^()\\]|\\.)*\)(?:[+*]|\{\d*,\d*\})"),
+}
+# Shapes that are usually fine on short bank names but can get slow, only reported as warnings by the pattern checks
+warning_pattern_shapes = {
+    # A quantified alternation, like (a|ab)*, the branches can overlap and get retried
+    "quantified alternation": re.compile(r"\((?:[^()\\]|\\.)*\|(?:[^()\\]|\\.)*\)(?:[+*]|\{\d*,\d*\})"),
+    # Two wildcards in the same branch, like .*FOO.*BAR, each one rescans the rest of the name
+    "repeated wildcard": re.compile(r"\.[*+][^|]*\.[*+]"),
+}
+risky_pattern_shapes = {**blocking_pattern_shapes, **warning_pattern_shapes}
+
 
 def get_tags_for_budget_plan(budget_plan: dict) -> list:
     """
@@ -38,117 +63,390 @@ def get_budget_plan_tag_mapping(budget_plans: dict) -> dict:
     return plan_to_tag_map
 
 
-def check_no_duplicates(budget_plans: dict):
-    """Used to check that there is no duplicate tags under any category for the budget plan"""
-    # Get mapping of budget plans to all tags, regardless of category
-    plan_to_tags = get_budget_plan_tag_mapping(budget_plans)
+class CheckResult(NamedTuple):
+    """What a budget plan check found, failures maps each failing plan to what's wrong with it"""
 
-    failures = []
-    pass_check = True
+    rule: str
+    passed: bool
+    failures: dict
 
-    for plan in plan_to_tags:
-        # Get the tag list for this plan
-        tag_list = plan_to_tags[plan]
-        if len(tag_list) != len(set(tag_list)):
-            failures.append(plan)
-            pass_check = False
 
-    return pass_check, failures
+class PlanIndex(dict):
+    """The budget plans flattened by compile_plan_index, so the checks can tell it apart from the plans themselves"""
 
 
-def check_tag_list_match(budget_plans: dict):
+def compile_plan_index(budget_plans: dict) -> PlanIndex:
     """
-    Check that the list of tags used in the budget plans matches the list of tags in the database.
-    Returns a tuple containing a boolean indicating if the check passed and a list of plans that failed the check.
+    Flattens every budget plan once so the checks can use set operations instead of walking the plans again.
+
+    Shaped like:
+    {'plan': {'tags': [tag_1, ..., tag_n], 'tag_set': {tag_1, ..., tag_n}, 'percent': 100}}
     """
-    # Get a dictionary mapping budget plans to their corresponding tags
-    plan_to_tags = get_budget_plan_tag_mapping(budget_plans)
+    plan_index = PlanIndex()
+    for plan, budget_plan in budget_plans.items():
+        tags = get_tags_for_budget_plan(budget_plan)
+        plan_index[plan] = {
+            "tags": tags,
+            "tag_set": frozenset(tags),
+            "percent": sum(budget_plan[category]["percentage"] or 0 for category in budget_plan),
+        }
+    return plan_index
 
-    failures = {}
-    db_tag_list_unique = []
 
-    with db.engine.connect() as conn:
-        # Query the Vendors table for the list of tags
-        tag_query = select(db.Vendors.Tag)
-        db_tag_list = set(conn.execute(tag_query).fetchall())
+def as_plan_index(budget_plans: dict) -> PlanIndex:
+    """The checks take the budget plans like they always have, or the index check_budget_plans already built"""
+    if isinstance(budget_plans, PlanIndex):
+        return budget_plans
+    return compile_plan_index(budget_plans)
 
-        # Iterate over the list of tags and add each tag to the list of unique tags
-        for tag in db_tag_list:
-            db_tag_list_unique.append(tag[0])
 
-    # Initialize a variable to track if the check passed
-    pass_check = True
+def check_no_duplicates(budget_plans: dict) -> tuple:
+    """Used to check that there is no duplicate tags under any category for the budget plan"""
+    plan_index = as_plan_index(budget_plans)
+    failures = {}
 
-    # Iterate over the dictionary of plan to tags mappings
-    for plan in plan_to_tags:
-        # Get the tag list for this plan
-        tag_list = plan_to_tags[plan]
-        # Transactions that couldn't find a vendor, will have "No Vendor Found" marked on them
-        # remove this since the Vendor table doesn't (and shouldn't) have that as an entry
-        try:
-            tag_list.remove("No Vendor Found")
-        except ValueError:
-            pass
-        # Check if the tag list for this plan is a unique, sorted list of all the tags in the database
-        if sorted(tag_list) != sorted(list(set(db_tag_list_unique))):
-            # If the check failed, add the plan to the list of failures and set pass_check to False
-            failures[plan] = set(tag_list) ^ set(db_tag_list_unique)
-            pass_check = False
+    for plan, compiled_plan in plan_index.items():
+        # A plan with a duplicate has more tags than unique tags
+        if len(compiled_plan["tags"]) != len(compiled_plan["tag_set"]):
+            counts = Counter(compiled_plan["tags"])
+            failures[plan] = sorted(tag for tag, count in counts.items() if count > 1)
 
-    # Return a tuple containing a boolean indicating if the check passed and a list of plans that failed the check
-    return pass_check, failures
+    return not failures, failures
 
 
-def check_percentages_add_to_100(budget_plans: dict) -> tuple:
+def check_tag_list_match(budget_plans: dict) -> tuple:
     """
-    Run during main to check that each budget plan inside the budget plans yaml file have categories that add to 100%
+    Check that the list of tags used in the budget plans matches the list of tags in the database.
+    Returns a tuple containing a boolean indicating if the check passed and a dictionary of plans that failed the check,
+    with the tags that are only in one or the other.
     """
-    # initialize variables
-    pass_check = True
-    failures = []
+    plan_index = as_plan_index(budget_plans)
+    with db.engine.connect() as conn:
+        # Query the Vendors table for the unique list of tags
+        tag_query = select(db.Vendors.Tag).distinct()
+        db_tag_set = {row[0] for row in conn.execute(tag_query)}
 
-    # iterate over budget plans
-    for plan in budget_plans:
-        percent = 0
-        budget_plan = budget_plans[plan]
+    failures = {}
 
-        # iterate over categories in budget plan
-        for category_name in budget_plan:
-            percent += budget_plan[category_name]["percentage"]
+    for plan, compiled_plan in plan_index.items():
+        # Transactions that couldn't find a vendor, will have "No Vendor Found" marked on them
+        # leave this out since the Vendor table doesn't (and shouldn't) have that as an entry
+        tag_set = compiled_plan["tag_set"] - {"No Vendor Found"}
+        mismatched = tag_set ^ db_tag_set
+        if mismatched:
+            failures[plan] = sorted(mismatched)
 
-        # if percentages don't add up to 100, set pass_check to False and append plan to failures list
-        if percent != 100:
-            pass_check = False
-            failures.append(plan)
+    return not failures, failures
 
-    # return tuple of pass_check and failures
-    return pass_check, failures
+
+def check_percentages_add_to_100(budget_plans: dict) -> tuple:
+    """
+    Run during main to check that each budget plan inside the budget plans yaml file have categories that add to 100%
+    """
+    plan_index = as_plan_index(budget_plans)
+    failures = {
+        plan: compiled_plan["percent"]
+        for plan, compiled_plan in plan_index.items()
+        if compiled_plan["percent"] != 100
+    }
+    return not failures, failures
 
 
 def check_budget_plans(budget_plans: dict, check_list: list) -> dict:
     """
     Function used to apply other check functions run during main. These make sure several different things look good
+    Returns a dictionary of rule to CheckResult
     """
+    # Flatten the plans once for every check
+    plan_index = compile_plan_index(budget_plans)
+
     # Initialize an empty dictionary to store the results of the check functions
     check_results = {}
 
+    # Iterate over the check_list
+    for check, rule in check_list:
+        # Call the function in the check tuple with the plan index as an argument and store the result
+        passed, failures = check(plan_index)
+        check_results[rule] = CheckResult(rule, passed, failures)
+
+    print_check_results(check_results)
+
+    # Return the check_results dictionary
+    return check_results
+
+
+def print_check_results(check_results: dict) -> None:
     print("Below are checks that are run against your budget plan")
 
-    # Iterate over the check_list
-    for check in check_list:
-        # Call the function in the check tuple with budget_plans as an argument and store the result in result
-        result, fail_dict = check[0](budget_plans)
-        # Get the rule description from the check tuple
-        rule = check[1]
-        # If the result of the check function is True, print a message indicating that all budget plans passed the check
-        if result:
-            print(f"{rule}: All PASSED")
-        # If the result of the check function is False, print a message indicating that some budget plans failed the check
-        # and add the fail_list to the check_results dictionary using the rule as the key
+    for result in check_results.values():
+        # If the check passed, print a message indicating that all budget plans passed the check
+        if result.passed:
+            print(f"{result.rule}: All PASSED")
+        # Otherwise print the plans that failed and why
         else:
-            print(f"{rule}: FAILING:", end=" ")
-            fail_list_str = [f"{k}: {v}" for k, v in fail_dict.items()]
+            print(f"{result.rule}: FAILING:", end=" ")
+            fail_list_str = [f"{k}: {v}" for k, v in result.failures.items()]
             print(", ".join(fail_list_str))
 
-    # Return the check_results dictionary
-    return check_results
\ No newline at end of file
+
+def run_budget_plan_checks(plan_file_path: str, check_list: list) -> dict:
+    """
+    Used during main so the budget plan checks only run when something they depend on changed.
+    Results are cached by the hash of the budget plans file and the version of the Vendors table,
+    if neither changed since the last run, the cached results are printed without even parsing the file.
+    Returns a dictionary of rule to CheckResult
+    """
+    with open(plan_file_path, "rb") as plan_file:
+        plan_file_hash = hashlib.md5(plan_file.read()).hexdigest()
+    rules = [rule for _, rule in check_list]
+    cache_key = f"{plan_file_hash}:{queries.vendor_table_version()}:{rules}"
+
+    # Use the cached results if nothing changed
+    cached = db.get_state("budget_plan_checks")
+    if cached is not None:
+        cached = json.loads(cached)
+        if cached["key"] == cache_key:
+            check_results = {result[0]: CheckResult(*result) for result in cached["results"]}
+            print_check_results(check_results)
+            return check_results
+
+    budget_plans = persistence.load_yaml(plan_file_path)
+    check_results = check_budget_plans(budget_plans, check_list)
+
+    db.set_state(
+        "budget_plan_checks",
+        json.dumps({"key": cache_key, "results": [list(result) for result in check_results.values()]}),
+    )
+    return check_results
+
+
+# Every ledger problem audit_ledger looks for, as one UNION ALL so the database does it in a single statement.
+# Each part returns the check name, the table, the row id, and a detail about what's wrong
+ledger_audit_query = text(
+    """
+    SELECT 'children do not sum to parent', 'Transactions', t.id,
+           'parent ' || t.Amount || ', children ' || ROUND(c.total, 2)
+    FROM Transactions t
+    JOIN (
+        SELECT Parent_id, SUM(Amount) AS total
+        FROM "Child Transactions"
+        GROUP BY Parent_id
+    ) c ON c.Parent_id = t.id
+    WHERE ROUND(c.total - t.Amount, 2) != 0
+
+    UNION ALL
+    SELECT 'orphaned children', 'Child Transactions', c.id, 'parent id ' || c.Parent_id
+    FROM "Child Transactions" c
+    LEFT JOIN Transactions t ON t.id = c.Parent_id
+    WHERE t.id IS NULL
+
+    UNION ALL
+    SELECT 'Has Child without children', 'Transactions', t.id, t.Name
+    FROM Transactions t
+    WHERE t."Has Child" = 'True'
+    AND NOT EXISTS (SELECT 1 FROM "Child Transactions" c WHERE c.Parent_id = t.id)
+
+    UNION ALL
+    SELECT 'unknown vendor UUID', 'Transactions', t.id, t.VendorUUID
+    FROM Transactions t
+    WHERE t.VendorUUID IS NOT 'No Vendor Found'
+    AND NOT EXISTS (SELECT 1 FROM Vendors v WHERE v.UUID = t.VendorUUID)
+
+    UNION ALL
+    SELECT 'unknown vendor UUID', 'Child Transactions', c.id, c.VendorUUID
+    FROM "Child Transactions" c
+    WHERE c.VendorUUID IS NOT 'No Vendor Found'
+    AND NOT EXISTS (SELECT 1 FROM Vendors v WHERE v.UUID = c.VendorUUID)
+
+    UNION ALL
+    SELECT 'unknown child tag', 'Child Transactions', c.id, c.Tag
+    FROM "Child Transactions" c
+    WHERE NOT EXISTS (SELECT 1 FROM Vendors v WHERE v.Tag = c.Tag)
+    """
+)
+ledger_audit_checks = [
+    "children do not sum to parent",
+    "orphaned children",
+    "Has Child without children",
+    "unknown vendor UUID",
+    "unknown child tag",
+]
+
+
+def pattern_check(pattern: str) -> bool | str:
+    """
+    Use this before saving a vendor pattern so that a pattern that doesn't compile
+    or could backtrack forever doesn't make it into the Vendors table and stall an import.
+    Return True if the pattern looks fine, or a string with an error message if it doesn't.
+    Only nested quantifiers like (a+)+ are refused, ordinary patterns like .*AMAZON.* go through and
+    check_vendor_patterns warns about the shapes that are only sometimes slow
+    """
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        return f"Pattern {pattern} is not valid regex: {e}"
+
+    # Look for any of the risky shapes in the pattern
+    shapes = [shape for shape, shape_regex in blocking_pattern_shapes.items() if shape_regex.search(pattern)]
+    if shapes:
+        return f"Pattern {pattern} could backtrack badly ({', '.join(shapes)}), try to simplify it"
+
+    return True
+
+
+def analyze_vendor_patterns(slow_seconds: float = 0.001) -> dict:
+    """
+    Compiles every vendor pattern, flags the ones with risky shapes (nested quantifiers are flags,
+    the shapes that are only sometimes slow are warnings), and times each pattern against
+    every distinct transaction name we've seen. In the same pass, finds names that more than one vendor
+    matches (vendorizer silently uses the first one) and vendors that don't match anything.
+    A pattern is flagged as slow if it takes longer than slow_seconds per name on average.
+
+    Shaped like:
+    {
+        "patterns": {UUID: {"Vendor": ..., "Pattern": ..., "matches": 12, "seconds": 0.002, "flags": [...], "warnings": [...]}},
+        "invalid": {Vendor: error},
+        "overlaps": {Name: [Vendor_1, Vendor_2]},
+        "unused": [Vendor_1, ...],
+        "names": 1234,
+    }
+    """
+    with db.engine.connect() as conn:
+        # Pick the newest pattern for each UUID, the same way vendorizer does
+        vendor_query = select(db.Vendors.UUID, db.Vendors.Vendor, db.Vendors.Pattern)
+        vendors = {}
+        for vendor in conn.execute(vendor_query):
+            vendors[vendor["UUID"]] = {"Vendor": vendor["Vendor"], "Pattern": vendor["Pattern"]}
+
+        # The historical corpus is every distinct name, from parents and children
+        name_query = select(db.Transactions.Name).union(select(db.ChildTransactions.Name))
+        names = [row[0] for row in conn.execute(name_query) if row[0] is not None]
+
+    report = {"patterns": {}, "invalid": {}, "overlaps": {}, "unused": [], "names": len(names)}
+
+    # Compile everything up front, anything that doesn't compile can't be timed
+    compiled = []
+    for vendor_uuid, vendor in vendors.items():
+        try:
+            regex = re.compile(vendor["Pattern"])
+        except (re.error, TypeError) as e:
+            report["invalid"][vendor["Vendor"]] = str(e)
+            continue
+        flags = [shape for shape, shape_regex in blocking_pattern_shapes.items() if shape_regex.search(vendor["Pattern"])]
+        shape_warnings = [shape for shape, shape_regex in warning_pattern_shapes.items() if shape_regex.search(vendor["Pattern"])]
+        report["patterns"][vendor_uuid] = {**vendor, "matches": 0, "seconds": 0.0, "flags": flags, "warnings": shape_warnings}
+        compiled.append((vendor_uuid, regex.search, report["patterns"][vendor_uuid]))
+
+    # Single pass over the names, every pattern is tried and timed on each name
+    clock = time.perf_counter
+    for name in names:
+        matched_by = []
+        for vendor_uuid, search, stats in compiled:
+            start = clock()
+            found = search(name)
+            stats["seconds"] += clock() - start
+            if found:
+                stats["matches"] += 1
+                matched_by.append(stats["Vendor"])
+        if len(matched_by) > 1:
+            report["overlaps"][name] = matched_by
+
+    for stats in report["patterns"].values():
+        if stats["matches"] == 0:
+            report["unused"].append(stats["Vendor"])
+        if names and stats["seconds"] / len(names) > slow_seconds:
+            stats["flags"].append("slow")
+
+    return report
+
+
+def check_vendor_patterns(report: dict | None = None) -> tuple:
+    """
+    Run during main (with analyze_patterns=True) to print what analyze_vendor_patterns found.
+    Returns a tuple of pass_check and a dictionary of the problems found.
+    Warnings are printed but don't fail the check
+    """
+    if report is None:
+        report = analyze_vendor_patterns()
+
+    failures = {}
+    flagged = {
+        stats["Vendor"]: stats["flags"] for stats in report["patterns"].values() if stats["flags"]
+    }
+    if report["invalid"]:
+        failures["invalid"] = report["invalid"]
+    if flagged:
+        failures["flagged"] = flagged
+    if report["overlaps"]:
+        failures["overlaps"] = report["overlaps"]
+    if report["unused"]:
+        failures["unused"] = report["unused"]
+
+    print(f"Below are checks that are run against your {len(report['patterns'])} vendor patterns and {report['names']} names")
+
+    warned = {
+        stats["Vendor"]: stats["warnings"] for stats in report["patterns"].values() if stats.get("warnings")
+    }
+    if warned:
+        print(f"Vendor patterns warning, these shapes can get slow on long names: {warned}")
+
+    # Show the slowest patterns so they're easy to find
+    slowest = sorted(report["patterns"].values(), key=lambda stats: stats["seconds"], reverse=True)[:5]
+    for stats in slowest:
+        print(f"{stats['Vendor']} ({stats['Pattern']}): {round(stats['seconds'] * 1000, 2)} ms, {stats['matches']} names matched")
+
+    if not failures:
+        print("Vendor patterns: All PASSED")
+        return True, failures
+
+    for problem, details in failures.items():
+        print(f"Vendor patterns {problem}: {details}")
+    return False, failures
+
+
+def audit_ledger(sample_size: int = 20) -> dict:
+    """
+    Checks the ledger itself for problems, all in the database with one query instead of row by row in python:
+    children that don't add up to their parent, children whose parent is gone, parents marked "Has Child" that
+    don't have any, vendor UUIDs that aren't in the Vendors table, and child tags that aren't an official tag.
+    Only the first sample_size rows of each problem are kept, but every one is counted.
+
+    Shaped like:
+    {
+        "children do not sum to parent": {"count": 2, "sample": [("Transactions", 7, "parent -8.77, children -7.77"), ...]},
+        ...
+        "seconds": 0.4,
+    }
+    """
+    report = {check: {"count": 0, "sample": []} for check in ledger_audit_checks}
+
+    start = time.perf_counter()
+    with db.engine.connect() as conn:
+        # Stream the rows so a really broken ledger doesn't all end up in memory
+        for check, table, row_id, detail in conn.execute(ledger_audit_query):
+            report[check]["count"] += 1
+            if len(report[check]["sample"]) < sample_size:
+                report[check]["sample"].append((table, row_id, detail))
+    report["seconds"] = time.perf_counter() - start
+
+    return report
+
+
+def check_ledger(report: dict | None = None) -> tuple:
+    """
+    Prints what audit_ledger found.
+    Returns a tuple of pass_check and a dictionary of the checks that found problems
+    """
+    if report is None:
+        report = audit_ledger()
+
+    failures = {check: report[check] for check in ledger_audit_checks if report[check]["count"]}
+
+    print(f"Below are checks that are run against your ledger, took {round(report['seconds'], 2)} seconds")
+    for check in ledger_audit_checks:
+        if report[check]["count"] == 0:
+            print(f"{check}: All PASSED")
+        else:
+            print(f"{check}: FAILING: {report[check]['count']} rows, for example {report[check]['sample'][:5]}")
+
+    return not failures, failures
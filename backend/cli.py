@@ -0,0 +1,234 @@
+"""
+Command line entry point, so things like a nightly import can run without the notebook.
+Everything heavy (pandas, the graphs) is only imported by the commands that need it, plotly never is.
+
+Example use, from the folder with budget.db and the yaml files:
+    python -m backend import
+    python -m backend import --dry-run
+    python -m backend revendorize --all
+    python -m backend transfers --window 5 --full
+    python -m backend suggest --top 20
+    python -m backend archive 2019 2020 --vacuum
+    python -m backend anomalies --period 2022-07
+    python -m backend projection --plan 60/25/15_rule --salary 60000
+    python -m backend audit
+    python -m backend report --year 2022 --month 01 --plan 60/25/15_rule
+    python -m backend export ledger.csv --start 2022-01-01 --end 2023-01-01
+    python -m backend export ledger.parquet --plan 60/25/15_rule
+"""
+import sys
+import logging
+import argparse
+
+
+def import_command(args) -> int:
+    from backend import crud
+    from backend import persistence
+
+    crud.get_session()
+    crud.load_vendors(args.vendors)
+    bank_profiles = persistence.load_yaml(args.bank_profiles)
+    report = crud.import_transactions(
+        args.folder, bank_profiles, crud.db.engine, log_level=getattr(logging, args.log_level), dry_run=args.dry_run
+    )
+    return 1 if report.errors else 0
+
+
+def revendorize_command(args) -> int:
+    from backend import crud
+
+    crud.get_session()
+    crud.load_vendors(args.vendors)
+    crud.revendorize_all(crud.db.engine, only_unmatched=not args.all)
+    return 0
+
+
+def transfers_command(args) -> int:
+    from backend import crud
+    from backend import transfers
+
+    crud.get_session()
+    if args.full:
+        transfers.unpair_all(crud.db.engine)
+    pairs = transfers.pair_transfers(crud.db.engine, window_days=args.window, full=args.full)
+    if pairs:
+        print(f"Paired {pairs} transfers between accounts")
+    else:
+        print("No new transfers between accounts")
+    return 0
+
+
+def archive_command(args) -> int:
+    from backend import crud
+    from backend import archive
+
+    crud.get_session()
+    for year in args.years:
+        archive.archive_year(year, vacuum=args.vacuum)
+    return 0
+
+
+def suggest_command(args) -> int:
+    from backend import crud
+    from backend import suggest
+
+    crud.get_session()
+    suggestions = suggest.suggest_vendors(min_transactions=args.min_transactions)
+    if suggestions is not None:
+        print(suggestions.head(args.top).to_string(index=False))
+    return 0
+
+
+def anomalies_command(args) -> int:
+    from backend import crud
+    from backend import anomalies
+
+    crud.get_session()
+    anomaly_table = anomalies.find_anomalies(period=args.period, threshold=args.threshold, full=args.full)
+    if anomaly_table is not None:
+        print(anomaly_table.to_string(index=False))
+    return 0
+
+
+def projection_command(args) -> int:
+    from backend import crud
+    from backend import projection
+
+    crud.get_session()
+    projection_table = projection.project_month(
+        args.salary, args.plan, month=args.month, day=args.day, budget_plans_path=args.budget_plans
+    )
+    if projection_table is None:
+        return 0
+    print(projection_table.to_string(index=False))
+    return 1 if projection_table["Likely Over"].any() else 0
+
+
+def audit_command(args) -> int:
+    from backend import crud
+    from backend import checks
+
+    crud.get_session()
+    passed, _ = checks.check_ledger(checks.audit_ledger(sample_size=args.sample_size))
+    return 0 if passed else 1
+
+
+def report_command(args) -> int:
+    from backend import crud
+    from backend import graphs
+    from backend import persistence
+
+    crud.get_session()
+    expense_table_tags = graphs.graph_one_data(args.group_by, args.year, args.month)
+    if expense_table_tags is None:
+        print("No expenses for that period")
+        return 0
+    tag_table = expense_table_tags.pivot_table(index="Tag", columns=args.group_by, values="Amount", fill_value=0)
+    # to_string so pandas doesn't cut the middle rows and columns out
+    print(tag_table.round(2).to_string())
+
+    if args.plan:
+        budget_plans = persistence.load_yaml(args.budget_plans)
+        three_data = graphs.graph_three_data(args.year, args.month, args.plan, budget_plans)
+        if three_data is not None:
+            print(f"Spending by category for {args.year}-{args.month}, using the {args.plan}")
+            for category, amount in three_data[2].items():
+                print(f"{category}: {round(amount, 2)}")
+    return 0
+
+
+def export_command(args) -> int:
+    from backend import crud
+    from backend import export
+
+    crud.get_session()
+    export.export_ledger(
+        args.output,
+        start=args.start,
+        end=args.end,
+        budget_plan=args.plan,
+        budget_plans_path=args.budget_plans,
+        file_format=args.format,
+        chunk_size=args.chunk_size,
+    )
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m backend", description="Budget commands that don't need the notebook")
+    parser.add_argument("--db", help="SQLite file to use instead of ./budget.db")
+    parser.add_argument("--vendors", default="./vendors.yml")
+    parser.add_argument("--bank-profiles", default="bank_profiles.yml")
+    parser.add_argument("--budget-plans", default="budget_plans.yml")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="import new bank exports")
+    import_parser.add_argument("--folder", default="./banking_csvs/")
+    import_parser.add_argument(
+        "--log-level", default="INFO", type=str.upper, choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+    )
+    import_parser.add_argument("--dry-run", action="store_true", help="show what would be imported without saving anything")
+    import_parser.set_defaults(func=import_command)
+
+    revendorize_parser = commands.add_parser("revendorize", help="re-match transactions to the vendor patterns")
+    revendorize_parser.add_argument("--all", action="store_true", help="re-match every transaction, not just unmatched ones")
+    revendorize_parser.set_defaults(func=revendorize_command)
+
+    transfers_parser = commands.add_parser("transfers", help="pair up transfers between your accounts")
+    transfers_parser.add_argument("--window", type=int, default=3, help="most days apart the two sides can be")
+    transfers_parser.add_argument("--full", action="store_true", help="throw away the pairs and look through everything")
+    transfers_parser.set_defaults(func=transfers_command)
+
+    archive_parser = commands.add_parser("archive", help="move closed years into their own read only files")
+    archive_parser.add_argument("years", nargs="+", type=int)
+    archive_parser.add_argument("--vacuum", action="store_true", help="shrink budget.db after moving the years out")
+    archive_parser.set_defaults(func=archive_command)
+
+    suggest_parser = commands.add_parser("suggest", help="suggest vendors for unmatched transactions, biggest spend first")
+    suggest_parser.add_argument("--top", type=int, default=20)
+    suggest_parser.add_argument("--min-transactions", type=int, default=1)
+    suggest_parser.set_defaults(func=suggest_command)
+
+    anomalies_parser = commands.add_parser("anomalies", help="show tags and vendors with unusual spending in a month")
+    anomalies_parser.add_argument("--period", help="month to check, like 2022-07, the newest one by default")
+    anomalies_parser.add_argument("--threshold", type=float, default=3.5, help="how far from normal counts as unusual")
+    anomalies_parser.add_argument("--full", action="store_true", help="sum every month again instead of just the new ones")
+    anomalies_parser.set_defaults(func=anomalies_command)
+
+    projection_parser = commands.add_parser("projection", help="project each category's spending at the end of the month")
+    projection_parser.add_argument("--plan", required=True, help="budget plan to group the spending by")
+    projection_parser.add_argument("--salary", type=int, required=True, help="yearly salary the plan's limits come from")
+    projection_parser.add_argument("--month", help="month to project, like 2022-07, the newest one by default")
+    projection_parser.add_argument("--day", type=int, help="day of the month to project from, today by default")
+    projection_parser.set_defaults(func=projection_command)
+
+    audit_parser = commands.add_parser("audit", help="check the ledger for problems")
+    audit_parser.add_argument("--sample-size", type=int, default=20)
+    audit_parser.set_defaults(func=audit_command)
+
+    report_parser = commands.add_parser("report", help="print expenses by tag, and by category with --plan")
+    report_parser.add_argument("--year", required=True)
+    report_parser.add_argument("--month", required=True)
+    report_parser.add_argument("--group-by", default="Month", choices=["Month", "Quarter"])
+    report_parser.add_argument("--plan", help="budget plan to group the month's expenses by")
+    report_parser.set_defaults(func=report_command)
+
+    export_parser = commands.add_parser("export", help="export the categorized ledger")
+    export_parser.add_argument("output")
+    export_parser.add_argument("--start", help="first date to include, like 2022-01-01")
+    export_parser.add_argument("--end", help="first date to leave out, like 2023-01-01")
+    export_parser.add_argument("--plan", help="budget plan to add each transaction's category from")
+    export_parser.add_argument("--format", choices=["csv", "parquet"], help="picked from the output's extension by default")
+    export_parser.add_argument("--chunk-size", type=int, default=50_000, help="rows read and written at a time")
+    export_parser.set_defaults(func=export_command)
+
+    return parser
+
+
+def main(argv: list | None = None) -> None:
+    args = build_parser().parse_args(argv)
+    if args.db:
+        from backend import database as db
+
+        db.use_database(args.db)
+    sys.exit(args.func(args))
@@ -5,29 +5,91 @@ import datetime
 import time
 import os
 import uuid
-import random
+import logging
+from dataclasses import dataclass
+from dataclasses import field
 from pathlib import Path
 from typing import Optional
 from typing import List
 from typing import Dict
 from typing import Tuple
+from typing import TYPE_CHECKING
 
-from sqlalchemy import create_engine
 from sqlalchemy import exc
+from sqlalchemy import text
 from sqlalchemy import select
 from sqlalchemy import insert
 from sqlalchemy import update
 from sqlalchemy.engine.base import Engine
-import pandas as pd
-import yaml
+from sqlalchemy.orm import Session
 
 from backend import database as db
 from backend import queries
 from backend import checks
+from backend import persistence
+from backend import instrument
+from backend import transfers
+
+# pandas and numpy are slow to import and only a few functions need them, so they're imported in those functions
+if TYPE_CHECKING:
+    import pandas as pd
 
 folder_path = "./banking_csvs/"
 yml_file_path = "./vendors.yml"
-session = db.init_db()
+
+# Show the import summary in the notebook, unless logging has already been set up
+logger = logging.getLogger(__name__)
+if not logging.getLogger().handlers and not logger.handlers:
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(log_handler)
+    logger.setLevel(logging.INFO)
+
+# The database session is made the first time something asks for it, not when crud is imported
+sessions = {}
+
+
+def get_session() -> Session:
+    """Returns the session for the current database, creating the tables the first time"""
+    if db.engine not in sessions:
+        sessions[db.engine] = db.init_db()
+    return sessions[db.engine]
+
+
+def __getattr__(name: str):
+    # Keeps crud.session, crud.engine, crud.pd and crud.np working in the notebook
+    if name == "session":
+        return get_session()
+    if name == "engine":
+        return db.engine
+    if name == "pd":
+        import pandas as pd
+
+        return pd
+    if name == "np":
+        import numpy as np
+
+        return np
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def refresh_snapshot() -> None:
+    """
+    Rewrites the graphs' snapshot on disk after an import or revendorize_all, so the next notebook start is quick.
+    Smaller writes like make_children and add_vendor leave it stale, get_tran_table rebuilds it the next time it's read
+    """
+    from backend import snapshot
+
+    with instrument.timer("snapshot"):
+        snapshot.update_snapshot()
+
+
+def refresh_spend_curves() -> None:
+    """Sums the days of the months an import touched into the running totals the month end projections read"""
+    from backend import projection
+
+    with instrument.timer("spend curves"):
+        projection.update_spend_curves()
 
 
 def is_bank(first_row: List[str], profile_columns: Dict) -> bool:
@@ -41,7 +103,7 @@ def is_bank(first_row: List[str], profile_columns: Dict) -> bool:
         col_name = profile_columns[key]["name"]
 
         # Check if the value in the given row for the current column matches the expected column name
-        if first_row[col_index] != col_name:
+        if col_index >= len(first_row) or first_row[col_index] != col_name:
             return False
 
     # If all columns match the expected names, return True
@@ -109,56 +171,273 @@ def process_date(bank_profile: dict, date: str) -> str:
     return dt.isoformat()
 
 
+@dataclass
+class FileImportReport:
+    """What happened to one bank export during import_transactions"""
+
+    file_name: str
+    bank_name: Optional[str] = None
+    inserted: int = 0
+    duplicates: int = 0
+    unvendorized: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    duplicate_sample: List[str] = field(default_factory=list)
+    first_date: Optional[str] = None
+    last_date: Optional[str] = None
+
+
+@dataclass
+class ImportReport:
+    """What import_transactions did, with a FileImportReport for each file it looked at"""
+
+    files: List[FileImportReport] = field(default_factory=list)
+    seconds: float = 0.0
+    dry_run: bool = False
+    transfers_paired: int = 0
+
+    @property
+    def inserted(self) -> int:
+        return sum(file_report.inserted for file_report in self.files)
+
+    @property
+    def duplicates(self) -> int:
+        return sum(file_report.duplicates for file_report in self.files)
+
+    @property
+    def unvendorized(self) -> int:
+        return sum(file_report.unvendorized for file_report in self.files)
+
+    @property
+    def errors(self) -> int:
+        return sum(file_report.errors for file_report in self.files)
+
+    def summary(self) -> str:
+        return (
+            f"{'Previewed' if self.dry_run else 'Imported'} {len(self.files)} files in {round(self.seconds, 2)}s: "
+            f"{self.inserted} new transactions, {self.duplicates} duplicates, {self.unvendorized} with no vendor found, "
+            f"{self.errors} errors"
+            + ("" if self.dry_run else f", {self.transfers_paired} transfers paired")
+        )
+
+
+def read_export(file_path: str, bank_profiles: dict, file_report: FileImportReport):
+    """
+    Yields (Date, Transaction, Name, Memo, Amount) for each row of a bank export, normalized the same way for
+    importing and previewing. Rows that can't be read are counted as errors on the file report, and the report
+    gets the bank and the span of dates. Nothing is yielded if no bank profile matches the file
+    """
+    with open(file_path, newline="") as csvfile:
+        reader = csv.reader(csvfile, delimiter=",", quotechar='"')
+        # Detect the bank
+        row_1 = next(reader, [])
+        bank_profile = detect_bank(row_1, bank_profiles)
+        # Handle the case where bank_profile is None
+        if bank_profile is None:
+            file_report.errors += 1
+            logger.warning(f"Error: No bank profile detected for {file_path}")
+            return
+        file_report.bank_name = bank_profile["bank_name"]
+        logger.debug(f"Detected {bank_profile['bank_name']}.")
+        col_map = bank_profile["columns"]
+
+        for row in reader:
+            instrument.count("rows")
+            try:
+                with instrument.timer("normalize"):
+                    Date = process_date(bank_profile, row[col_map["date"]["index"]])
+                    Transaction = row[col_map["transaction"]["index"]]
+                    Name = row[col_map["name"]["index"]]
+                    Memo = row[col_map["memo"]["index"]]
+                    Amount = clean_money(row[col_map["amount"]["index"]], bank_profile)
+            except (IndexError, ValueError) as e:
+                file_report.errors += 1
+                logger.debug(f"Skipped row {row} in {file_report.file_name}: {e}")
+                continue
+            if file_report.first_date is None or Date < file_report.first_date:
+                file_report.first_date = Date
+            if file_report.last_date is None or Date > file_report.last_date:
+                file_report.last_date = Date
+            yield Date, Transaction, Name, Memo, Amount
+
+
+@db.writes_database
 def import_transactions(
-    storage_folder_path: str, bank_profiles: dict, engine: Engine
-) -> None:
+    storage_folder_path: str,
+    bank_profiles: dict,
+    engine: Engine,
+    log_level: int = logging.INFO,
+    duplicate_sample_size: int = 20,
+    file_paths: Optional[List[str]] = None,
+    dry_run: bool = False,
+) -> ImportReport:
     """
     Use this to import transactions.
-    Imports all default information about transactions from new transaction imports from a bank
-    """
-    bank_profile = None
-    for file_path in get_latest_export_paths(storage_folder_path):
-        with open(file_path, newline="") as csvfile:
-            reader = csv.reader(csvfile, delimiter=",", quotechar='"')
-            # Detect the bank
-            row_1 = next(reader)
-            bank_profile = detect_bank(row_1, bank_profiles)
-            # Handle the case where bank_profile is None
-            if bank_profile is None:
-                continue
-            print(f"Detected {bank_profile['bank_name']}.")
-            col_map = bank_profile["columns"]
-            import_new_expense_imports(file_path, engine)
-            for row in reader:
-                Date = process_date(bank_profile, row[col_map["date"]["index"]])
-                Transaction = row[col_map["transaction"]["index"]]
-                Name = row[col_map["name"]["index"]]
-                Memo = row[col_map["memo"]["index"]]
-                Amount = clean_money(row[col_map["amount"]["index"]], bank_profile)
-                Hash = hash_transaction(Date, Transaction, Name, Memo, Amount)
-                VendorUUID = queries.vendorizer(Name)
-                row = insert(db.Transactions).values(
-                    Date=Date,
-                    Transaction=Transaction,
-                    Name=Name,
-                    Memo=Memo,
-                    Amount=Amount,
-                    VendorUUID=VendorUUID,
-                    Hash=Hash,
+    Imports all default information about transactions from new transaction imports from a bank.
+    Returns an ImportReport with the counts for each file, and logs a single summary line at log_level.
+    Only the first duplicate_sample_size duplicate hashes of each file are kept on the report.
+    Pass file_paths to import those files, even ones imported before (like a file that grew), instead of the new ones.
+    Set dry_run to True to get the same report without saving anything, see preview_import
+    """
+    start = time.perf_counter()
+    if file_paths is None:
+        with instrument.timer("file discovery"):
+            file_paths = get_latest_export_paths(storage_folder_path)
+    if dry_run:
+        return preview_import(file_paths, bank_profiles, engine, log_level)
+
+    report = ImportReport()
+
+    # Load the vendor patterns once for the whole import
+    patterns = queries.vendor_patterns()
+    insert_query = insert(db.Transactions).prefix_with("OR IGNORE")
+    # Archived years took their ids with them, the first new row has to start past them
+    next_id = db.first_id(db.Transactions)
+
+    for file_path in file_paths:
+        instrument.count("files")
+        file_report = FileImportReport(file_name=file_path.rsplit("/", maxsplit=1)[-1])
+        report.files.append(file_report)
+        file_start = time.perf_counter()
+
+        # Everything in the file goes in as one transaction
+        with engine.begin() as conn:
+            for Date, Transaction, Name, Memo, Amount in read_export(file_path, bank_profiles, file_report):
+                with instrument.timer("hash"):
+                    Hash = hash_transaction(Date, Transaction, Name, Memo, Amount)
+                with instrument.timer("vendor matching"):
+                    VendorUUID = queries.match_vendor(Name, patterns)
+                values = {
+                    "Date": Date,
+                    "Transaction": Transaction,
+                    "Name": Name,
+                    "Memo": Memo,
+                    "Amount": Amount,
+                    "VendorUUID": VendorUUID,
+                    "Hash": Hash,
+                    "Source": file_report.file_name,
+                }
+                if next_id is not None:
+                    values["id"] = next_id
+                with instrument.timer("db insert"):
+                    inserted = conn.execute(insert_query, values).rowcount
+                # The insert is ignored if the hash is already there
+                if inserted:
+                    next_id = None
+                    file_report.inserted += 1
+                    if VendorUUID == "No Vendor Found":
+                        file_report.unvendorized += 1
+                else:
+                    file_report.duplicates += 1
+                    if len(file_report.duplicate_sample) < duplicate_sample_size:
+                        file_report.duplicate_sample.append(Hash)
+        if file_report.bank_name is None:
+            continue
+
+        # Only remember the file once its transactions are saved
+        import_new_expense_imports(file_path, engine)
+        file_report.seconds = time.perf_counter() - file_start
+        logger.debug(f"Successfully imported all transactions from {file_report.file_name}")
+
+    # Let anything cached from the transactions know they changed
+    if report.inserted:
+        db.bump_data_version()
+        # Card payments and other moves between accounts show up in two exports, pair them so they aren't counted twice
+        with instrument.timer("transfer pairing"):
+            report.transfers_paired = transfers.pair_transfers(engine)
+        refresh_snapshot()
+        refresh_spend_curves()
+
+    instrument.count("inserted", report.inserted)
+    instrument.count("duplicates", report.duplicates)
+    instrument.count("unvendorized", report.unvendorized)
+    report.seconds = time.perf_counter() - start
+    logger.log(log_level, report.summary())
+    return report
+
+
+# Hashes of the files being previewed, in file then row order. Temp tables only live on the connection that made them
+preview_table = text(
+    'CREATE TEMP TABLE IF NOT EXISTS "Import Preview" (File INTEGER, Hash TEXT, VendorUUID TEXT)'
+)
+preview_insert = text('INSERT INTO temp."Import Preview" (File, Hash, VendorUUID) VALUES (:File, :Hash, :VendorUUID)')
+# Made after the rows are in, that's quicker than keeping it up to date during the inserts
+preview_index = text('CREATE INDEX IF NOT EXISTS temp."Import Preview Hash" ON "Import Preview" (Hash)')
+
+# A row would be inserted if its hash isn't saved or archived yet and no earlier row in the batch has it,
+# the same as INSERT OR IGNORE one row at a time. Every lookup goes through a Hash index
+preview_query = text(
+    """
+    SELECT File,
+        SUM(New),
+        SUM(NOT New),
+        SUM(New AND VendorUUID = 'No Vendor Found')
+    FROM (
+        SELECT p.File, p.VendorUUID,
+            NOT EXISTS (SELECT 1 FROM temp."Import Preview" e WHERE e.Hash = p.Hash AND e.rowid < p.rowid)
+            AND NOT EXISTS (SELECT 1 FROM main.Transactions t WHERE t.Hash = p.Hash)
+            AND NOT EXISTS (SELECT 1 FROM main."Archived Hashes" a WHERE a.Hash = p.Hash) AS New
+        FROM temp."Import Preview" p
+    )
+    GROUP BY File
+    """
+)
+
+
+def preview_import(
+    file_paths: List[str], bank_profiles: dict, engine: Engine, log_level: int = logging.INFO
+) -> ImportReport:
+    """
+    Use this to see what import_transactions would do with some files before it does it.
+    The files are read, normalized and hashed the same way, and their hashes are checked against the saved ones
+    in a temporary table, so nothing is written to Transactions or Expense Imports. Returns an ImportReport
+    with dry_run set, where inserted is how many transactions are new. Each file's dates are logged at log_level
+    """
+    report = ImportReport(dry_run=True)
+    start = time.perf_counter()
+    patterns = queries.vendor_patterns()
+    # Statements repeat the same names a lot, so each name is only matched once
+    vendor_matches = {}
+
+    with engine.connect() as conn:
+        conn.execute(preview_table)
+        conn.execute(text('DELETE FROM temp."Import Preview"'))
+        for position, file_path in enumerate(file_paths):
+            file_report = FileImportReport(file_name=file_path.rsplit("/", maxsplit=1)[-1])
+            report.files.append(file_report)
+            file_start = time.perf_counter()
+            preview_rows = []
+            for Date, Transaction, Name, Memo, Amount in read_export(file_path, bank_profiles, file_report):
+                if Name not in vendor_matches:
+                    vendor_matches[Name] = queries.match_vendor(Name, patterns)
+                preview_rows.append(
+                    {
+                        "File": position,
+                        "Hash": hash_transaction(Date, Transaction, Name, Memo, Amount),
+                        "VendorUUID": vendor_matches[Name],
+                    }
                 )
-                with engine.connect() as conn:
-                    try:
-                        conn.execute(row)
-                    except exc.IntegrityError:
-                        session.rollback()
-                        print(f"{Hash} is a duplicate expense")
-        if bank_profile is None:
-            # Handle the case where no bank profile was detected
-            print(f"Error: No bank profile detected for {file_path}")
-            return None
-        else:
-            name = file_path.rsplit("/", maxsplit=1)[-1]
-            print(f"Successfully imported all transactions from {name}")
+            if preview_rows:
+                conn.execute(preview_insert, preview_rows)
+            file_report.seconds = time.perf_counter() - file_start
+
+        conn.execute(preview_index)
+        for position, new, duplicates, unvendorized in conn.execute(preview_query):
+            file_report = report.files[position]
+            file_report.inserted, file_report.duplicates, file_report.unvendorized = new, duplicates, unvendorized
+        conn.execute(text('DROP TABLE temp."Import Preview"'))
+
+    for file_report in report.files:
+        if file_report.bank_name is not None:
+            logger.log(
+                log_level,
+                f"{file_report.file_name}: {file_report.bank_name} from {file_report.first_date} to {file_report.last_date}, "
+                f"{file_report.inserted} new, {file_report.duplicates} duplicates, "
+                f"{file_report.unvendorized} with no vendor found",
+            )
+    report.seconds = time.perf_counter() - start
+    logger.log(log_level, report.summary())
+    return report
 
 
 def import_new_expense_imports(file_path: str, engine: Engine) -> None:
@@ -167,12 +446,15 @@ def import_new_expense_imports(file_path: str, engine: Engine) -> None:
     Imports the file names of new transaction imports from a bank.
     """
     name = file_path.rsplit("/", maxsplit=1)[-1]
-    expense_import = insert(db.ExpenseImports).values(Filename=name)
+    # A file that was imported before and grew is already on the list
+    expense_import = insert(db.ExpenseImports).prefix_with("OR IGNORE").values(Filename=name)
     with engine.connect() as conn:
         conn.execute(expense_import)
-        print(f"Added {name} to list of known files")
+        logger.debug(f"Added {name} to list of known files")
 
 
+@db.writes_database
+@instrument.timed("split")
 def make_children(
     engine: Engine, id: int, rows: List[Tuple[float, str, str, str]]
 ) -> None:
@@ -189,6 +471,8 @@ def make_children(
     with engine.connect() as conn:
         # Check that the given rows satisfy the amount and tag checks
         if (queries.amount_check(rows, id)) and (queries.tag_check(rows)) == True:
+            # Archived years took their children's ids with them, the first new child has to start past them
+            next_id = db.first_id(db.ChildTransactions)
             # If they do, iterate over the rows
             for row in rows:
                 # Get the parent transaction's information
@@ -200,12 +484,12 @@ def make_children(
                         db.Transactions.Memo,
                     )
                 ).where(db.Transactions.id == id)
-                parent_columns = pd.read_sql(parent_query, conn)
+                parent_columns = conn.execute(parent_query).fetchone()
                 parent_id = id
-                date = parent_columns["Date"].values[0]  # type: ignore
-                transaction = parent_columns["Transaction"].values[0]  # type: ignore
-                name = parent_columns["Name"].values[0]  # type: ignore
-                memo = parent_columns["Memo"].values[0]  # type: ignore
+                date = parent_columns["Date"]
+                transaction = parent_columns["Transaction"]
+                name = parent_columns["Name"]
+                memo = parent_columns["Memo"]
 
                 # Get the information for the current row
                 amount = row[0]
@@ -229,13 +513,16 @@ def make_children(
                     Tag=tag,
                     Initialized=current_time,
                 )
+                if next_id is not None:
+                    row = row.values(id=next_id)
 
                 # Try to execute the query
                 try:
                     conn.execute(row)
+                    next_id = None
                     print("You have beautiful baby expenses")
                 except exc.IntegrityError:
-                    session.rollback()
+                    get_session().rollback()
                     print("Did not make children")
                 else:
                     # If the query is successful, update the parent transaction to indicate that it has children
@@ -245,6 +532,7 @@ def make_children(
                         .values(Has_Child="True")
                     )
                     conn.execute(label_parent)
+            db.bump_data_version()
         else:
             # If the checks fail, return the output of amount_check and tag_check
             print(
@@ -322,12 +610,13 @@ def get_latest_export_paths(storage_folder_path: str) -> list:
     if len(new_files) >= 1:
         [new_file_paths.append(storage_folder_path + file) for file in new_files]
     else:
-        print("no new bank files to import")
+        logger.debug("no new bank files to import")
 
     # Return the list of new file paths
     return new_file_paths
 
 
+@db.writes_database
 def add_vendor(
     vendors: List[Dict[str, str]], engine: Engine, session, yml_file_path: str
 ) -> None:
@@ -376,6 +665,12 @@ def add_vendor(
                     vendor["UUID"] = str(uuid.uuid4())
                     UUID_generated = True
 
+                # Make sure the pattern compiles and won't stall an import
+                if "Pattern" in vendor:
+                    pattern_ok = checks.pattern_check(vendor["Pattern"])
+                    if pattern_ok != True:
+                        raise ValueError(pattern_ok)
+
                 # Get the current time
                 current_time = datetime.datetime.now().isoformat()
 
@@ -414,6 +709,7 @@ def add_vendor(
             revendorizer(vendor)
 
 
+@db.writes_database
 def revendorizer(vendor: dict) -> None:
     # Update transactions with "No Vendor Found" with the new vendor's information
     with db.engine.connect() as conn:
@@ -435,11 +731,56 @@ def revendorizer(vendor: dict) -> None:
                     .values(VendorUUID=vendor["UUID"])
                 )
                 conn.execute(update_vendor_query)
+    db.bump_data_version()
+    db.bump_rewrite_version()
+
+
+@db.writes_database
+@instrument.timed("revendorize")
+def revendorize_all(engine: Engine, only_unmatched: bool = True) -> dict:
+    """
+    Re-matches transactions against the current vendor patterns, one distinct name at a time.
+    By default only "No Vendor Found" transactions are looked at, set only_unmatched to False to re-match everything,
+    which is what you want after editing patterns by hand in vendors.yml. Archived years aren't re-matched, see archive.py.
+    Returns how many names and transactions moved, shaped like {"names changed": 3, "rows changed": 10}
+    """
+    patterns = queries.vendor_patterns()
+    delta = {"names changed": 0, "rows changed": 0}
+
+    with engine.begin() as conn:
+        # Work off the distinct name and vendor pairs instead of every transaction row
+        name_query = select(db.Transactions.Name, db.Transactions.VendorUUID).distinct()
+        if only_unmatched:
+            name_query = name_query.where(db.Transactions.VendorUUID == "No Vendor Found")
+
+        for name, current_uuid in conn.execute(name_query).fetchall():
+            if name is None:
+                continue
+            vendor_uuid = queries.match_vendor(name, patterns)
+            if vendor_uuid == current_uuid:
+                continue
+            update_query = (
+                update(db.Transactions)
+                .where(db.Transactions.Name == name)
+                .where(db.Transactions.VendorUUID == current_uuid)
+                .values(VendorUUID=vendor_uuid)
+            )
+            delta["names changed"] += 1
+            delta["rows changed"] += conn.execute(update_query).rowcount
+
+    if delta["rows changed"]:
+        db.bump_data_version()
+        db.bump_rewrite_version()
+        refresh_snapshot()
 
+    print(f"Revendorized {delta['rows changed']} transactions across {delta['names changed']} names")
+    return delta
 
+
+@db.writes_database
 def update_vendor(
     engine: Engine,
-    session: session,
+    session: Session,
     yml_file_path: str,
     UUID: str,
     new_vendor_name: Optional[str] = None,
@@ -450,14 +791,22 @@ def update_vendor(
     This is useful if you mistype or need to update a pattern
     """
 
+    # Make sure the new pattern compiles and won't stall an import
+    if new_pattern:
+        pattern_ok = checks.pattern_check(new_pattern)
+        if pattern_ok != True:
+            print(pattern_ok)
+            return
+
     # Start a transaction block
     with session.begin():
         with engine.connect() as conn:
-            # Query for the UUID of the vendor with the given ID
-            query = select([db.Vendors.UUID]).where(db.Vendors.UUID == UUID)
+            # Query for the UUID and current pattern of the vendor with the given ID
+            query = select([db.Vendors.UUID, db.Vendors.Pattern]).where(db.Vendors.UUID == UUID)
             result = conn.execute(query).fetchone()
             if result:
                 UUID = result[0]
+                old_pattern = result[1]
             else:
                 print(f"Vendor with UUID {UUID} not found in the database")
                 return
@@ -500,22 +849,83 @@ def update_vendor(
             # If both operations are successful, commit the transaction
             session.commit()
 
+    # Re-apply the vendor to the transactions the old or new pattern touches
+    if new_pattern and new_pattern != old_pattern:
+        reclassify_vendor(engine, UUID, old_pattern, new_pattern)
 
-def add_vendor_yaml_file(yml_file_path: str, vendors: List[Dict[str, str]]):
+
+@db.writes_database
+def reclassify_vendor(engine: Engine, UUID: str, old_pattern: str, new_pattern: str) -> dict:
     """
-    This is used to make sure that *if* you ever needed to delete your database, you're vendors would live on
+    Used by update_vendor so that changing a pattern doesn't need a rebuild of every transaction.
+    Only the distinct names matching the old or new pattern are looked at, and every transaction with one of those
+    names is re-matched, whichever vendor it's on now. Archived years aren't, see archive.py.
+    Returns the delta, shaped like:
+    {"names affected": 3, "rows gained": 10, "rows lost": 2, "rows moved": {"<UUID>": 2}}
+    rows moved counts the rows that went to each vendor other than this one
     """
-    # Check if the YAML file exists
-    if not os.path.exists(yml_file_path):
-        # If the files does not exist, create an empty list of entries
-        yaml_entries = []
-    else:
-        # If the file exists, read the existing entries from the YAML file
-        with open(yml_file_path, "r") as yaml_file:
-            yaml_entries = yaml.safe_load(yaml_file)
+    old_regex = re.compile(old_pattern) if old_pattern else None
+    new_regex = re.compile(new_pattern)
+
+    # Load the patterns once, update_vendor has already saved the new pattern so this is the current order
+    patterns = queries.vendor_patterns()
+
+    delta = {"names affected": 0, "rows gained": 0, "rows lost": 0, "rows moved": {}}
+
+    with engine.connect() as conn:
+        # Work off the distinct names and the vendors they're on now, instead of every transaction row
+        pair_query = select(db.Transactions.Name, db.Transactions.VendorUUID).distinct()
+        pairs = [tuple(row) for row in conn.execute(pair_query) if row[0] is not None]
+
+        # Only the names the old or new pattern matches can change vendor
+        affected_pairs = [
+            (name, previous_uuid)
+            for name, previous_uuid in pairs
+            if new_regex.search(name) or (old_regex and old_regex.search(name))
+        ]
+        delta["names affected"] = len({name for name, _ in affected_pairs})
+
+        vendor_uuids = {}
+        for name, previous_uuid in affected_pairs:
+            if name not in vendor_uuids:
+                vendor_uuids[name] = queries.match_vendor(name, patterns)
+            vendor_uuid = vendor_uuids[name]
+            if previous_uuid == vendor_uuid:
+                continue
+            update_query = (
+                update(db.Transactions)
+                .where(db.Transactions.Name == name)
+                .where(db.Transactions.VendorUUID == previous_uuid)
+                .values(VendorUUID=vendor_uuid)
+            )
+            rowcount = conn.execute(update_query).rowcount
+            if not rowcount:
+                continue
+            # Keep track of where the rows went
+            if vendor_uuid == UUID:
+                delta["rows gained"] += rowcount
+            else:
+                delta["rows moved"][vendor_uuid] = delta["rows moved"].get(vendor_uuid, 0) + rowcount
+                if previous_uuid == UUID:
+                    delta["rows lost"] += rowcount
 
-    # Initialize yaml_entries as an empty list if it does not exist
-    yaml_entries = yaml_entries or []
+    if delta["rows gained"] or delta["rows moved"]:
+        db.bump_data_version()
+        db.bump_rewrite_version()
+
+    print(
+        f"Reclassified {delta['names affected']} names for vendor with UUID {UUID}: "
+        f"{delta['rows gained']} transactions gained, {delta['rows lost']} transactions lost"
+    )
+    return delta
+
+
+def add_vendor_yaml_file(yml_file_path: str, vendors: List[Dict[str, str]]):
+    """
+    This is used to make sure that *if* you ever needed to delete your database, you're vendors would live on.
+    The new vendors are appended to the vendors.yml journal, which gets folded into vendors.yml every so often
+    """
+    changes = []
 
     # Iterate over the input vendors
     for vendor in vendors:
@@ -528,12 +938,11 @@ def add_vendor_yaml_file(yml_file_path: str, vendors: List[Dict[str, str]]):
             "Initialized": vendor["Initialized"],
         }
 
-        # Add the vendor to the list of vendors
-        yaml_entries.append(yaml_entry)
+        # Add the vendor to the list of changes
+        changes.append({"op": "add", "vendor": yaml_entry})
 
-    # Write the vendors to the YAML file
-    with open(yml_file_path, "w") as yaml_file:
-        yaml.dump(yaml_entries, yaml_file, default_flow_style=False)
+    # Write the vendors to the journal
+    persistence.append_journal(yml_file_path, changes)
 
 
 def update_vendor_yaml_file(
@@ -546,135 +955,248 @@ def update_vendor_yaml_file(
     Updates the vendor name and/or pattern for the vendor with the given pattern in the YAML file at the given file path
     This makes sure that if you update a vendor it's applied here so that if you need to delete the db, these changes are saved
     """
-    # Load the YAML file
-    with open(yml_file_path, "r") as f:
-        data = yaml.safe_load(f)
+    change = {"op": "update", "UUID": UUID}
 
-    # Check that data is a list
-    if isinstance(data, list):
-        # Find the entry with the given UUID
-        for entry in data:
-            if entry["UUID"] == UUID:
-                # Update the vendor name if provided
-                if new_vendor_name:
-                    entry["Vendor"] = new_vendor_name
-                # Update the pattern if provided
-                if new_pattern:
-                    entry["Pattern"] = new_pattern
-                break
-    else:
-        print(f"Invalid data format: data must be a list of vendor entries")
-        return
+    # Update the vendor name if provided
+    if new_vendor_name:
+        change["Vendor"] = new_vendor_name
+    # Update the pattern if provided
+    if new_pattern:
+        change["Pattern"] = new_pattern
 
-    # Write the updated data back to the YAML file
-    with open(yml_file_path, "w") as f:
-        yaml.dump(data, f)
+    # Write the update to the journal
+    persistence.append_journal(yml_file_path, [change])
     print(f"Vendor with pattern {UUID} has been updated in file {yml_file_path}")
 
 
-def load_vendors(vendors) -> None:
-    """Initializes a database with patterns to match expenses to vendors"""
+@db.writes_database
+def load_vendors(yml_file_path: str) -> None:
+    """
+    Initializes a database with patterns to match expenses to vendors.
+    Skips parsing vendors.yml altogether if it hasn't changed since the last time it was loaded
+    """
+    file_hash = persistence.vendor_file_hash(yml_file_path)
+    if db.get_state("vendor_file_hash") == file_hash:
+        print("Vendors are loaded")
+        return
+
+    vendors = persistence.read_vendor_file(yml_file_path)
+
+    # Vendors that are already in the database are skipped
     with db.engine.connect() as conn:
-        try:
-            conn.execute(insert(db.Vendors), vendors)
-        except exc.IntegrityError:
-            session.rollback()
-            print("Vendors are loaded")
+        if vendors:
+            result = conn.execute(insert(db.Vendors).prefix_with("OR IGNORE"), vendors)
+            print(f"Vendors are loaded, {max(result.rowcount, 0)} new")
+
+    db.set_state("vendor_file_hash", file_hash)
+
+
+def example_names_from_patterns(vendors: list) -> list:
+    """
+    Used by generate_example_data to come up with transaction names that the vendor patterns actually match.
+    Takes the first alternative of each pattern and strips out the regex characters, anything that doesn't
+    match its own pattern afterwards is skipped
+    """
+    names = []
+    for vendor in vendors:
+        pattern = vendor.get("Pattern")
+        if not pattern:
+            continue
+        candidate = re.sub(r"[\^$\\()\[\]{}?*+]", "", pattern.split("|")[0]).strip()
+        if len(candidate) >= 3 and re.search(pattern, candidate):
+            names.append(candidate)
+    return names
 
 
 def generate_example_data(
-    num_rows: int, account_type: str = None, save_path: str = "banking_csvs/"
-) -> pd.DataFrame:
+    num_rows: int,
+    account_type: str = None,
+    save_path: str = "banking_csvs/",
+    bank: str = "us_bank",
+    seed: int = 42,
+    start_date: str = "2022-01-01",
+    days: int = 365,
+    num_files: int = 1,
+    overlap: float = 0.05,
+    bank_profiles_path: str = "bank_profiles.yml",
+) -> "pd.DataFrame":
     """
-    This is used in case someone would like to generate test data before
+    This is used in case someone would like to generate test data before importing their own.
+    Writes num_rows transactions spread over the given number of days, in the column layout and date format
+    of the given profile in bank_profiles.yml, so it can be imported like any real export.
+    Names are built from the vendor patterns (plus some that won't match a vendor), with a few vendors being
+    much more common than the rest, and some monthly recurring charges like a real statement.
+    If num_files is more than 1, the rows are split across that many files that overlap each other by
+    the overlap fraction, so the duplicate detection has something to do.
+    The same seed always generates the same data
     """
-    # List of names
-    names = [
-        "COSTCO",
-        "TOM THUMB",
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    bank_profile = persistence.load_yaml(bank_profiles_path)[bank]
+
+    # Names the vendor patterns will match, plus some that won't
+    names = example_names_from_patterns(persistence.read_vendor_file(yml_file_path))
+    names += [
         "SCOOTER'S COFFEE",
         "VELVET TACO",
         "NANDOS",
         "Coffee Shop",
         "ATM withdrawl",
-        "CVS",
         "CASH APP",
-        "Taco Deli",
         "WHATABURG",
         "GEICO",
     ]
-    data = []
-    month = 1
-    day = 1
-    for i in range(num_rows):
-        if day > 28:
-            month += 1
-            day = 1
-        date = "2022-{:02d}-{:02d}".format(
-            month, day
-        )  # Generate a date in the format "YYYY-MM-DD"
-        transaction = random.choice(
-            ["Debit", "Credit"]
-        )  # Choose a random transaction type
-        name = random.choice(names)  # Choose a random name from the list of names
-        memo = "this is test data"  # Set the memo to a fixed string
-        amount = round(
-            random.uniform(-1000, 0), 2
-        )  # Generate a random amount between -1000 and 1000
-        data.append(
-            {
-                "Date": date,
-                "Transaction": transaction,
-                "Name": name,
-                "Memo": memo,
-                "Amount": amount,
-            }
-        )
-        day += 1
-    test_data = pd.DataFrame(data)
+    names = np.array(sorted(set(names)), dtype=object)
+
+    # A few vendors get most of the transactions, the rest show up every so often
+    weights = 1 / np.arange(1, len(names) + 1) ** 1.1
+    weights = rng.permutation(weights)
+    weights /= weights.sum()
+
+    # Every vendor has a typical amount, each transaction is spread around it
+    typical_amounts = rng.lognormal(mean=3.5, sigma=1.0, size=len(names))
+
+    # Pick a handful of vendors to be recurring charges, same day and same amount every month
+    num_recurring = min(5, len(names))
+    recurring_names = rng.choice(len(names), size=num_recurring, replace=False)
+    months = max(days // 30, 1)
+    recurring_rows = min(num_recurring * months, num_rows // 10)
+    recurring_vendor = np.resize(recurring_names, recurring_rows)
+    recurring_day = np.resize(rng.integers(0, 28, size=num_recurring), recurring_rows)
+    recurring_offsets = (np.arange(recurring_rows) // num_recurring) * 30 + recurring_day
+    recurring_amounts = -np.round(typical_amounts[recurring_vendor], 2)
+
+    # Everything else is random
+    random_rows = num_rows - recurring_rows
+    random_vendor = rng.choice(len(names), size=random_rows, p=weights)
+    random_offsets = rng.integers(0, days, size=random_rows)
+    random_amounts = -np.round(
+        typical_amounts[random_vendor] * rng.lognormal(mean=0, sigma=0.3, size=random_rows), 2
+    )
+
+    # Around 5% of random transactions are money coming in, like refunds
+    credits = rng.random(random_rows) < 0.05
+    random_amounts[credits] *= -1
+
+    vendor_index = np.concatenate([recurring_vendor, random_vendor])
+    day_offsets = np.concatenate([recurring_offsets, random_offsets]) % days
+    amounts = np.concatenate([recurring_amounts, random_amounts])
+
+    # Sort by date like a bank export
+    order = np.argsort(day_offsets, kind="stable")
+    vendor_index = vendor_index[order]
+    day_offsets = day_offsets[order]
+    amounts = amounts[order]
+
+    # Format each distinct day once then spread it out, formatting millions of dates one by one is slow
+    unique_offsets, inverse = np.unique(day_offsets, return_inverse=True)
+    unique_dates = pd.to_datetime(start_date) + pd.to_timedelta(unique_offsets, unit="D")
+    date_format = bank_profile["columns"]["date"]["date_format"]
+    dates = unique_dates.strftime(date_format).to_numpy(dtype=object)[inverse]
+
+    test_data = pd.DataFrame(
+        {
+            "Date": dates,
+            "Transaction": np.where(amounts < 0, "Debit", "Credit"),
+            "Name": names[vendor_index],
+            "Memo": "this is test data",
+            "Amount": amounts,
+        }
+    )
+
+    # Lay the columns out the way this bank does, flipping the amounts back if the importer flips them
+    col_map = bank_profile["columns"]
+    width = max(col_map[key]["index"] for key in col_map) + 1
+    header = [f"Extra {i}" for i in range(width)]
+    export = {}
+    for key, column in zip(["date", "transaction", "name", "memo", "amount"], test_data.columns):
+        header[col_map[key]["index"]] = col_map[key]["name"]
+        export[col_map[key]["name"]] = test_data[column]
+    if bank_profile["flip_values"] == True:
+        export[col_map["amount"]["name"]] = -test_data["Amount"]
+    export = pd.DataFrame(export, columns=header).fillna("")
 
     # Choose a random account type if none was specified
     if account_type is None:
-        account_type = random.choice(["Checking", "Credit Card"])
+        account_type = rng.choice(["Checking", "Credit Card"])
 
     # Generate a filename for the CSV file using the current date and time and the specified account type
     now = datetime.datetime.now()
-    filename = f"TEST DATA: {account_type} - {now.strftime('%Y-%m-%d %H-%M-%S')}.csv"
-
-    # Save the data to default unless otherwise specified
-    if save_path == "banking_csvs/":
-        # Save the file to the specified location if a save path was provided
-        test_data.to_csv(f"{save_path}/{filename}", index=False)
-    else:
-        # Otherwise, save the file to the current working directory
-        test_data.to_csv(filename, index=False)
+    filename = f"TEST DATA: {bank_profile['bank_name']} {account_type} - {now.strftime('%Y-%m-%d %H-%M-%S')}"
+
+    # Split the rows into files that overlap each other a bit
+    chunk_size = -(-num_rows // num_files)
+    overlap_rows = int(chunk_size * overlap) if num_files > 1 else 0
+    for file_number in range(num_files):
+        start = max(file_number * chunk_size - overlap_rows, 0)
+        end = min((file_number + 1) * chunk_size, num_rows)
+        suffix = f" part {file_number + 1}" if num_files > 1 else ""
+        export.iloc[start:end].to_csv(
+            os.path.join(save_path, f"{filename}{suffix}.csv"), index=False
+        )
 
     return test_data
 
 
-def main():
-    folder_path = "./banking_csvs/"
-    engine = create_engine("sqlite:///budget.db")
-
-    # Load bank profiles
-    with open("bank_profiles.yml", "r") as bp:
-        bank_profiles = yaml.safe_load(bp)
-
-    # Load budget plans
-    with open("budget_plans.yml", "r") as budp:
-        budget_plans = yaml.safe_load(budp)
-
-    # Load vendors
-    with open("vendors.yml", "r") as budp:
-        vendors = yaml.safe_load(budp)
-
-    load_vendors(vendors)
-    import_transactions(folder_path, bank_profiles, engine)
-
-    check_list = [
-        (checks.check_no_duplicates, "Has no duplicates"),
-        (checks.check_percentages_add_to_100, "Category percents add to 100"),
-        (checks.check_tag_list_match, "All avaliable tags used"),
-    ]
-
-    checks.check_budget_plans(budget_plans, check_list)
+def main(
+    analyze_patterns: bool = False,
+    audit: bool = False,
+    instrument_run: bool = False,
+    import_log_level: int = logging.INFO,
+):
+    """
+    Loads the yaml files, imports any new bank exports and runs the checks.
+    Set analyze_patterns to True to also time and cross check every vendor pattern against your transaction names
+    Set audit to True to also check the ledger for things like children that don't add up to their parent
+    Set instrument_run to True to print where the time went when it's done. For a full profile of one run,
+    use instrument.profile_run(crud.main) instead
+    The import summary line is logged at import_log_level
+    """
+    if instrument_run:
+        instrument.enable()
+
+    # Instrumentation is turned back off even if something in main fails
+    try:
+        with instrument.timer("main"):
+            folder_path = "./banking_csvs/"
+            engine = db.engine
+
+            # Make sure the tables are there
+            get_session()
+
+            # Load bank profiles
+            with instrument.timer("yaml"):
+                bank_profiles = persistence.load_yaml("bank_profiles.yml")
+
+            # Load vendors
+            with instrument.timer("load_vendors"):
+                load_vendors(yml_file_path)
+
+            with instrument.timer("import"):
+                import_transactions(folder_path, bank_profiles, engine, log_level=import_log_level)
+
+            check_list = [
+                (checks.check_no_duplicates, "Has no duplicates"),
+                (checks.check_percentages_add_to_100, "Category percents add to 100"),
+                (checks.check_tag_list_match, "All avaliable tags used"),
+            ]
+
+            # Only runs the checks if the budget plans or vendors changed since last time
+            with instrument.timer("checks"):
+                checks.run_budget_plan_checks("budget_plans.yml", check_list)
+
+            if analyze_patterns:
+                with instrument.timer("pattern analysis"):
+                    checks.check_vendor_patterns()
+
+            if audit:
+                with instrument.timer("audit"):
+                    checks.check_ledger()
+
+        if instrument_run:
+            return instrument.print_summary()
+    finally:
+        if instrument_run:
+            instrument.enable(False)
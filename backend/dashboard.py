@@ -0,0 +1,252 @@
+"""
+A widget version of the Periodic Check-in. Pick the year, month, budget plan and tag from dropdowns instead of
+editing graph_three's arguments and rerunning the cell.
+
+The expenses are summed by month and tag once, and kept until the data or vendors change. Every change to a control
+is answered from those sums, and the two figures are FigureWidgets that get their bars swapped in place
+instead of being drawn again. Controls wait a moment after the last change before updating, so clicking through
+months doesn't queue up an update for every one.
+
+Example use, as the last line of a cell:
+    from backend import dashboard
+    dashboard.dashboard(Salary=Salary)
+"""
+import io
+import html
+import traceback
+import threading
+import contextlib
+
+import yaml
+import pandas as pd
+import ipywidgets as widgets
+import plotly.graph_objects as go
+
+from backend import graphs
+from backend import queries
+from backend import snapshot
+
+# The sums the dashboard answers from, rebuilt when the stamp changes
+aggregates = {}
+# The columns the dashboard keeps of each expense, the rest of the snapshot isn't loaded
+row_columns = ["id", "Date", "Name", "Amount", "VendorUUID", "Year", "Month", "Tag"]
+
+
+def build_aggregates(table: pd.DataFrame) -> dict:
+    """
+    Sums the expenses by month and tag, and remembers which rows belong to each month and tag
+    so the biggest expenses for one can be found without looking at the rest of the ledger
+    """
+    expenses = table[(table["Tag"] != "Internal Transfer") & (table["Amount"] < 0)]
+    expenses = expenses[row_columns].reset_index(drop=True)
+    month_tags = expenses.groupby(["Month", "Tag"]).Amount.sum()
+    return {
+        # Month by tag, the trend figure reads whole rows of this
+        "trend": month_tags.unstack("Tag", fill_value=0).sort_index(),
+        "month_tags": {month: tags.droplevel("Month") for month, tags in month_tags.groupby(level="Month")},
+        "row_positions": expenses.groupby(["Month", "Tag"]).indices,
+        "rows": expenses,
+        "vendors": {},
+    }
+
+
+def get_aggregates() -> dict:
+    """Returns the sums, building them the first time and again after the transactions or vendors change"""
+    stamp = snapshot.current_stamp()
+    if aggregates.get("stamp") != stamp:
+        aggregates.clear()
+        aggregates.update(build_aggregates(graphs.get_tran_table(row_columns)))
+        aggregates["stamp"] = stamp
+    return aggregates
+
+
+def vendor_name(vendor_uuid: str) -> str:
+    # Looked up once per vendor for as long as the sums are kept
+    vendors = aggregates["vendors"]
+    if vendor_uuid not in vendors:
+        vendors[vendor_uuid] = queries.uuid_to_vendor(vendor_uuid)
+    return vendors[vendor_uuid]
+
+
+def month_view(month: str, budget_plans: dict, budget_plan: str, filter_tag: str, head: int = 15) -> dict | None:
+    """
+    Everything the dashboard shows for a month, worked out from the cached sums. Returns None if there
+    are no expenses that month. The tag sums come back with the same Category and Required columns graph_three adds
+    """
+    current = get_aggregates()
+    if month not in current["month_tags"]:
+        return None
+
+    tag_table = current["month_tags"][month].rename_axis("Tag").reset_index()
+    tag_table["Category"] = tag_table["Tag"].map(graphs.category_map(budget_plans[budget_plan])).fillna("Failed to categorize")
+    required_map = {category: budget_plans[budget_plan][category]["required"] for category in budget_plans[budget_plan]}
+    tag_table["Required"] = tag_table["Category"].map(required_map).fillna(False)
+
+    # The biggest expenses for the tag this month, the same columns pt_one has
+    positions = current["row_positions"].get((month, filter_tag), [])
+    top_rows = current["rows"].take(positions).nsmallest(head, "Amount")
+    top_rows.insert(0, "Vendor", top_rows["VendorUUID"].map(vendor_name))
+
+    return {
+        "tags": tag_table,
+        "categories": tag_table.groupby("Category")["Amount"].sum().to_dict(),
+        "top": top_rows[["Vendor", "Name", "id", "Date", "Amount", "Year"]].set_index(["Vendor", "Name", "id", "Date"]),
+    }
+
+
+def debounce(wait: float):
+    """Calls the function wait seconds after the last call to it, earlier calls that are still waiting are dropped"""
+
+    def decorator(function):
+        timer = None
+
+        def debounced(*args, **kwargs):
+            nonlocal timer
+            if timer is not None:
+                timer.cancel()
+            timer = threading.Timer(wait, function, args, kwargs)
+            timer.start()
+
+        return debounced
+
+    return decorator
+
+
+def set_bars(figure: go.FigureWidget, names: list, bars: dict) -> None:
+    """
+    Swaps the bars of a FigureWidget in place, one trace for each name. bars maps a name to its (x, y),
+    names that aren't in bars are emptied. The traces are only made again when the names change
+    """
+    with figure.batch_update():
+        if [trace.name for trace in figure.data] != list(names):
+            figure.data = []
+            for name in names:
+                figure.add_bar(name=name, x=[], y=[])
+        for trace in figure.data:
+            trace.x, trace.y = bars.get(trace.name, ([], []))
+
+
+def dashboard(
+    Salary: int,
+    filter_year: str | None = None,
+    filter_month: str | None = None,
+    budget_plan: str | None = None,
+    filter_tag: str = "Vendor w/o default Tag",
+    head: int = 15,
+    width: int = 1200,
+    height: int = 500,
+    wait: float = 0.3,
+):
+    """
+    Example use: dashboard(Salary=Salary)
+    Shows the category graph and overview from graph_three, the last twelve months by tag like graph_one, and the
+    biggest expenses for a tag like pt_one, all for the picked month. Starts on the newest month unless
+    filter_year and filter_month are given. wait is how many seconds after the last change the dashboard updates
+    """
+    with open("budget_plans.yml", "r") as budp:
+        budget_plans = yaml.safe_load(budp)
+
+    current = get_aggregates()
+    months = list(current["trend"].index)
+    if not months:
+        print("The dataframe is empty. Nothing to populate the dashboard with")
+        return None
+    newest_year, newest_month = months[-1].split("-")
+    tags = sorted(current["trend"].columns)
+
+    year_picker = widgets.Dropdown(
+        description="Year", options=sorted({month[:4] for month in months}), value=filter_year or newest_year
+    )
+    month_picker = widgets.Dropdown(
+        description="Month", options=[f"{number:02d}" for number in range(1, 13)], value=f"{int(filter_month or newest_month):02d}"
+    )
+    plan_picker = widgets.Dropdown(
+        description="Plan", options=list(budget_plans), value=budget_plan or next(iter(budget_plans))
+    )
+    tag_picker = widgets.Dropdown(
+        description="Tag", options=tags, value=filter_tag if filter_tag in tags else tags[0]
+    )
+    invert_box = widgets.Checkbox(description="Invert", value=False)
+
+    category_figure = go.FigureWidget(
+        layout=dict(barmode="relative", width=width, height=height, xaxis_title="Category", yaxis_title="Amount")
+    )
+    trend_figure = go.FigureWidget(
+        layout=dict(barmode="relative", width=width, height=height, xaxis_title="Month", yaxis_title="Amount")
+    )
+    summary = widgets.HTML()
+    top_table = widgets.HTML()
+    # Anything update raises shows up here, the debounced updates run on a Timer thread where it would be lost
+    errors = widgets.Output()
+    update_lock = threading.Lock()
+
+    def redraw():
+        month = f"{year_picker.value}-{month_picker.value}"
+        sign = -1 if invert_box.value else 1
+        view = month_view(month, budget_plans, plan_picker.value, tag_picker.value, head)
+        # The sums might have been rebuilt since the controls were made
+        trend = get_aggregates()["trend"]
+        trend_tags = sorted(trend.columns)
+
+        # The twelve months up to the picked one, months with no expenses get nothing
+        trend_months = pd.period_range(end=month, periods=12, freq="M").strftime("%Y-%m")
+        trend_window = trend.reindex(trend_months, fill_value=0) * sign
+        set_bars(
+            trend_figure,
+            trend_tags,
+            {tag: (list(trend_months), trend_window[tag].tolist()) for tag in trend_tags},
+        )
+        trend_figure.layout.title = f"Expenses by tag for the twelve months up to {month}"
+
+        if view is None:
+            set_bars(category_figure, trend_tags, {})
+            category_figure.layout.title = f"No expenses in {month}"
+            summary.value = "<pre>The dataframe is empty. Nothing to populate chart with</pre>"
+            top_table.value = ""
+            return
+
+        tag_table = view["tags"]
+        set_bars(
+            category_figure,
+            trend_tags,
+            {row.Tag: ([row.Category], [row.Amount * sign]) for row in tag_table.itertuples()},
+        )
+        category_figure.layout.title = f"Expenses for {month}, grouped by category. Using the {plan_picker.value}"
+
+        # The same overview graph_three prints, the tag sums add up to the same totals as the transactions
+        printed = io.StringIO()
+        with contextlib.redirect_stdout(printed):
+            graphs.graph_three_summary((tag_table, tag_table, view["categories"]), budget_plans, plan_picker.value, Salary)
+        summary.value = f"<pre>{html.escape(printed.getvalue())}</pre>"
+
+        if view["top"].empty:
+            top_table.value = f"<pre>No {html.escape(tag_picker.value)} expenses in {month}</pre>"
+        else:
+            top_table.value = view["top"].to_html()
+
+    def update(change=None):
+        # One update at a time, a slow one finishing after a newer one would leave the old month up
+        with update_lock:
+            errors.outputs = ()
+            try:
+                redraw()
+            except Exception:
+                errors.append_stderr(traceback.format_exc())
+
+    debounced_update = debounce(wait)(update)
+    for control in (year_picker, month_picker, plan_picker, tag_picker, invert_box):
+        control.observe(debounced_update, names="value")
+    # Draw the starting month right away, only the changes after wait
+    update()
+
+    return widgets.VBox(
+        [
+            widgets.HBox([year_picker, month_picker, plan_picker]),
+            category_figure,
+            summary,
+            trend_figure,
+            widgets.HBox([tag_picker, invert_box]),
+            top_table,
+            errors,
+        ]
+    )
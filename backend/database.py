@@ -1,3 +1,6 @@
+import functools
+import threading
+
 from sqlalchemy import create_engine
 from sqlalchemy import Column
 from sqlalchemy import String
@@ -6,31 +9,53 @@ from sqlalchemy import Float
 from sqlalchemy import ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import select
+from sqlalchemy import func
+from sqlalchemy import cast
+from sqlalchemy import text
+from sqlalchemy import exc
 
 db_path = "./budget.db"
 engine = create_engine("sqlite:///budget.db")
 Base = declarative_base()
 
+# Only one thing writes to the database at a time, like the folder watcher's background imports and the notebook.
+# It's reentrant, so a write that calls another one (an import pairs transfers) doesn't wait on itself
+write_lock = threading.RLock()
+
+
+def writes_database(func):
+    """Used on the functions that write to the database, so they take turns through write_lock"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with write_lock:
+            return func(*args, **kwargs)
+
+    return wrapper
+
 
 class Transactions(Base):
     __tablename__ = "Transactions"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    Date = Column(String)
+    Date = Column(String, index=True)
     Transaction = Column(String)
-    Name = Column(String)
+    Name = Column(String, index=True)
     Memo = Column(String)
     Amount = Column(Float)
     VendorUUID = Column(String)
     Has_Child = Column("Has Child", String)
     Hash = Column(String, unique=True)
+    Source = Column(String)
 
 
 class ChildTransactions(Base):
     __tablename__ = "Child Transactions"
 
     id = Column(Integer, primary_key=True)
-    Parent_id = Column(Integer, ForeignKey("Transactions.id"))
+    Parent_id = Column(Integer, ForeignKey("Transactions.id"), index=True)
     Date = Column(String)
     Transaction = Column(String)
     Name = Column(String)
@@ -68,7 +93,7 @@ class Vendors(Base):
     Vendor = Column(String, unique=True)
     Pattern = Column(String)
     Tag = Column(String)
-    UUID = Column(String)
+    UUID = Column(String, index=True)
     Initialized = Column(String)
 
 
@@ -79,8 +104,184 @@ class ExpenseImports(Base):
     Filename = Column(String, unique=True)
 
 
+class TransferPairs(Base):
+    __tablename__ = "Transfer Pairs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    Debit_id = Column(Integer, ForeignKey("Transactions.id"), unique=True)
+    Credit_id = Column(Integer, ForeignKey("Transactions.id"), unique=True)
+    Amount = Column(Float)
+    Days_Apart = Column("Days Apart", Integer)
+    Initialized = Column(String)
+
+
+class ArchivedHashes(Base):
+    __tablename__ = "Archived Hashes"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    Hash = Column(String, unique=True)
+    Year = Column(Integer)
+
+
+class DataState(Base):
+    __tablename__ = "Data State"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    Key = Column(String, unique=True)
+    Value = Column(String)
+
+
+def get_state(key: str, default: str | None = None) -> str | None:
+    """
+    Used to remember small bits of state between runs, like the hash of the last vendors.yml that was loaded
+    """
+    with engine.connect() as conn:
+        result = conn.execute(select(DataState.Value).where(DataState.Key == key)).fetchone()
+    if result is None:
+        return default
+    return result[0]
+
+
+def set_state(key: str, value: str) -> None:
+    """Saves a bit of state between runs, overwriting whatever was there for that key"""
+    upsert = sqlite_insert(DataState).values(Key=key, Value=value)
+    upsert = upsert.on_conflict_do_update(index_elements=[DataState.Key], set_={"Value": value})
+    with engine.connect() as conn:
+        conn.execute(upsert)
+
+
+def data_version() -> int:
+    """
+    Number that goes up every time transactions are added or change vendor.
+    Anything cached from the transactions, like the graphs' tran_table, is rebuilt once this changes
+    """
+    return int(get_state("data_version", "0"))
+
+
+def bump_data_version() -> int:
+    """Called by anything that writes to the transactions, so cached tables know to refresh"""
+    upsert = sqlite_insert(DataState).values(Key="data_version", Value="1")
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[DataState.Key], set_={"Value": cast(cast(DataState.Value, Integer) + 1, String)}
+    )
+    with engine.connect() as conn:
+        conn.execute(upsert)
+    return data_version()
+
+
+def bump_rewrite_version() -> None:
+    """
+    Called by anything that changes transactions already saved, like moving them to another vendor or throwing away
+    transfer pairs, as opposed to adding new ones. Caches that only sum the newly added ids start over once this changes
+    """
+    upsert = sqlite_insert(DataState).values(Key="rewrite_version", Value="1")
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[DataState.Key], set_={"Value": cast(cast(DataState.Value, Integer) + 1, String)}
+    )
+    with engine.connect() as conn:
+        conn.execute(upsert)
+
+
+def first_id(table) -> int | None:
+    """
+    The id the next row of table has to get so it doesn't reuse the id of a row archive_year moved out, or None when
+    SQLite's own next id, one past the biggest id left, is already past them. Rows after that one follow on from it
+    """
+    key = f"{table.__tablename__} archived id"
+    archived_id = get_state(key)
+    if archived_id is None:
+        # Archives made before archive_year remembered their biggest id get looked at once
+        from backend import archive
+
+        archived_id = str(archive.archived_max_id(table.__tablename__))
+        set_state(key, archived_id)
+    archived_id = int(archived_id)
+    with engine.connect() as conn:
+        max_id = conn.execute(select(func.max(table.id))).scalar() or 0
+    return archived_id + 1 if archived_id > max_id else None
+
+
+def use_database(path: str):
+    """
+    Points everything at a different SQLite file, like a temp database for the benchmarks.
+    Creates the tables if they aren't there yet and returns a new session for it
+    """
+    global db_path, engine
+    db_path = path
+    engine = create_engine(f"sqlite:///{path}")
+    return init_db()
+
+
+# Columns added after people already had a budget.db, create_all won't add them to a table that exists
+added_columns = [
+    ("Transactions", "Source", "VARCHAR"),
+]
+
+
+def add_missing_columns() -> None:
+    """Adds any of the added_columns an older database doesn't have yet, they start out empty"""
+    with engine.begin() as conn:
+        for table, column, column_type in added_columns:
+            existing = {row[1] for row in conn.execute(text(f'PRAGMA table_info("{table}")'))}
+            if column not in existing:
+                conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {column_type}'))
+
+
+# Full text index over the Name and Memo of every transaction and child transaction, kept in sync by triggers.
+# Transactions use their id as the rowid, child transactions use their id made negative
+search_table = "Transaction Search"
+search_index_statements = [
+    f"""CREATE VIRTUAL TABLE "{search_table}" USING fts5(Name, Memo, tokenize = 'unicode61')""",
+    f"""INSERT INTO "{search_table}" (rowid, Name, Memo) SELECT id, Name, Memo FROM Transactions""",
+    f'''INSERT INTO "{search_table}" (rowid, Name, Memo) SELECT -id, Name, Memo FROM "Child Transactions"''',
+    f"""CREATE TRIGGER "Transactions Search Insert" AFTER INSERT ON Transactions BEGIN
+        INSERT INTO "{search_table}" (rowid, Name, Memo) VALUES (new.id, new.Name, new.Memo);
+    END""",
+    f"""CREATE TRIGGER "Transactions Search Delete" AFTER DELETE ON Transactions BEGIN
+        DELETE FROM "{search_table}" WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER "Transactions Search Update" AFTER UPDATE OF Name, Memo ON Transactions BEGIN
+        UPDATE "{search_table}" SET Name = new.Name, Memo = new.Memo WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER "Child Transactions Search Insert" AFTER INSERT ON "Child Transactions" BEGIN
+        INSERT INTO "{search_table}" (rowid, Name, Memo) VALUES (-new.id, new.Name, new.Memo);
+    END""",
+    f"""CREATE TRIGGER "Child Transactions Search Delete" AFTER DELETE ON "Child Transactions" BEGIN
+        DELETE FROM "{search_table}" WHERE rowid = -old.id;
+    END""",
+    f"""CREATE TRIGGER "Child Transactions Search Update" AFTER UPDATE OF Name, Memo ON "Child Transactions" BEGIN
+        UPDATE "{search_table}" SET Name = new.Name, Memo = new.Memo WHERE rowid = -old.id;
+    END""",
+]
+
+
+def init_search_index() -> bool:
+    """
+    Creates the full text index and its triggers the first time, filling it with the transactions already there.
+    Returns False if this SQLite wasn't built with FTS5, everything else still works without it
+    """
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": search_table}
+        ).fetchone()
+        if exists:
+            return True
+        try:
+            for statement in search_index_statements:
+                conn.execute(text(statement))
+        except exc.OperationalError:
+            return False
+    return True
+
+
 def init_db():
     Base.metadata.create_all(engine)
+    add_missing_columns()
+    # create_all skips tables that already exist, so make sure indexes added later also get built
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    init_search_index()
     Session = sessionmaker(bind=engine)
     session = Session()
     return session
@@ -0,0 +1,167 @@
+"""
+Writes the categorized ledger out for people and tools that don't use the notebook, like an accountant or a warehouse.
+Rows are read from SQLite a chunk at a time and written as they come, so memory use stays the same however big
+the ledger gets. CSV files get each chunk appended, Parquet files get each chunk as its own row group.
+
+The ledger here is what the money really went to. Split parents are left out for their children, vendor names and
+tags are the vendors' newest ones, a child keeps the tag it was split with, and transfers between your own accounts
+are tagged "Internal Transfer". Give a budget plan to add the Category each tag falls under.
+
+Example use:
+    export.export_ledger("ledger.csv", start="2022-01-01", end="2023-01-01", budget_plan="60/25/15_rule")
+    export.export_ledger("ledger.parquet")
+"""
+import os
+import tempfile
+import importlib.util
+
+import pandas as pd
+from sqlalchemy import text
+
+from backend import archive
+from backend import graphs
+from backend import queries
+from backend import database as db
+from backend import persistence
+
+# The ledger in date order so the file reads like a statement, see queries.ledger_rows_query for what's counted
+export_query = """
+    WITH latest_vendors AS ({latest_vendors}),
+    ledger AS ({ledger})
+    SELECT l.id, l.Parent_id, l.Date, l.Name, l.Memo, l.Amount,
+        COALESCE(v.Vendor, 'No Vendor Found') AS Vendor, {tag} AS Tag, l.Transfer, l.Source
+    FROM ledger l
+    LEFT JOIN latest_vendors v ON v.UUID = l.VendorUUID
+    ORDER BY l.Date, l.Parent_id, l.id
+"""
+
+export_formats = {".csv": "csv", ".parquet": "parquet", ".pq": "parquet"}
+# Parquet types for the columns that aren't text
+parquet_types = {"id": "int64", "Parent_id": "int64", "Date": "timestamp[ns]", "Amount": "double", "Transfer": "bool"}
+
+
+def date_filter(column: str, start: str | None, end: str | None) -> str:
+    # start is included and end is left out, like the cli's --start and --end
+    filters = ""
+    if start:
+        filters += f" AND {column} >= :start"
+    if end:
+        filters += f" AND {column} < :end"
+    return filters
+
+
+def ledger_chunks(start: str | None = None, end: str | None = None, budget_plan: dict | None = None, chunk_size: int = 50_000):
+    """
+    Yields the ledger as DataFrames of up to chunk_size rows, in date order. Only one chunk is held at a time,
+    SQLite hands the rows over as they're asked for. budget_plan is the plan itself, from budget_plans.yml
+    """
+    tag_categories = graphs.category_map(budget_plan) if budget_plan is not None else None
+    with db.engine.connect() as conn:
+        # Years moved to archives are read through views that put them back together with the current tables
+        transactions_table, children_table = archive.attach_archives(conn)
+        query = export_query.format(
+            latest_vendors=queries.latest_vendors_query,
+            ledger=queries.ledger_query(transactions_table, children_table, date_filter("{row}.Date", start, end)),
+            tag=queries.ledger_tag,
+        )
+        result = conn.execution_options(stream_results=True).execute(text(query), {"start": start, "end": end})
+        columns = list(result.keys())
+        empty = True
+        for rows in result.partitions(chunk_size):
+            empty = False
+            yield format_chunk(pd.DataFrame.from_records(rows, columns=columns), tag_categories)
+        # An empty export still gets its header
+        if empty:
+            yield format_chunk(pd.DataFrame(columns=columns), tag_categories)
+
+
+def format_chunk(chunk: pd.DataFrame, tag_categories: dict | None) -> pd.DataFrame:
+    chunk["Parent_id"] = chunk["Parent_id"].astype("Int64")
+    chunk["Transfer"] = chunk["Transfer"].astype(bool)
+    if tag_categories is not None:
+        chunk["Category"] = chunk["Tag"].map(tag_categories).fillna("Failed to categorize")
+    return chunk
+
+
+def write_csv(chunks, file_path: str) -> int:
+    rows = 0
+    with open(file_path, "w", newline="") as csv_file:
+        for chunk in chunks:
+            chunk.to_csv(csv_file, header=rows == 0, index=False)
+            rows += len(chunk)
+    return rows
+
+
+def write_parquet(chunks, file_path: str) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            if writer is None:
+                # The types are set up front, so a column that's all empty in one chunk doesn't change type
+                schema = pa.schema(
+                    [(column, pa.type_for_alias(parquet_types.get(column, "string"))) for column in chunk.columns]
+                )
+                writer = pq.ParquetWriter(file_path, schema)
+            chunk["Date"] = pd.to_datetime(chunk["Date"])
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def export_ledger(
+    output: str,
+    start: str | None = None,
+    end: str | None = None,
+    budget_plan: str | None = None,
+    budget_plans_path: str = "budget_plans.yml",
+    file_format: str | None = None,
+    chunk_size: int = 50_000,
+) -> int:
+    """
+    Writes the ledger from start (included) to end (left out) to output and returns how many rows were written.
+    file_format is "csv" or "parquet", by default it's picked from output's extension and falls back to csv.
+    The file is written next to output and moved over it at the end, so a failed export never leaves half a file.
+    Parquet needs pyarrow, which isn't installed with the rest of the requirements
+    """
+    file_format = file_format or export_formats.get(os.path.splitext(output)[1].lower(), "csv")
+    if file_format not in export_formats.values():
+        print(f"Can't export to {file_format}, pick from csv or parquet")
+        return 0
+    if file_format == "parquet":
+        if importlib.util.find_spec("pyarrow") is None:
+            print("Exporting to parquet needs pyarrow, install it with pip install pyarrow")
+            return 0
+
+    plan = None
+    if budget_plan is not None:
+        budget_plans = persistence.load_yaml(budget_plans_path)
+        if budget_plan not in budget_plans:
+            print(f"{budget_plan} isn't in {budget_plans_path}")
+            return 0
+        plan = budget_plans[budget_plan]
+
+    folder = os.path.dirname(os.path.abspath(output))
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix=".", suffix=".tmp")
+    os.close(fd)
+    try:
+        chunks = ledger_chunks(start, end, plan, chunk_size)
+        if file_format == "parquet":
+            rows = write_parquet(chunks, temp_path)
+        else:
+            rows = write_csv(chunks, temp_path)
+        # mkstemp makes the file 0600, the export should get the same mode as any other new file
+        os.chmod(temp_path, persistence.new_file_mode())
+        os.replace(temp_path, output)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    print(f"Exported {rows} transactions to {output}")
+    return rows
@@ -1,13 +1,21 @@
+import io
+import os
 import calendar
+import functools
+import contextlib
 import yaml
 from typing import Optional
+from collections import OrderedDict
 
-import plotly.express as px
 import pandas as pd
 from sqlalchemy import select
+from sqlalchemy import text
 
 from backend import database as db
+from backend import archive
 from backend import queries
+from backend import snapshot
+from backend import instrument
 
 
 def calculate_sum(dictionary, salary):
@@ -57,59 +65,183 @@ def category_max_spend(budget_plan: dict, Salary: int) -> dict | None:
     return categories_max_spend_dict
 
 
-with db.engine.connect() as conn:
-    # Pull Transactions table
-    pandas_query = select(db.Transactions)
-    tran_table = pd.read_sql(pandas_query, conn)
-    # This part looks for transactions that have children transactions, removes them, and the concatenates the children rows on
-    tran_table = tran_table[tran_table["Has Child"] != None]
-    tran_table["Tag"] = tran_table["VendorUUID"].apply(queries.uuid_to_tag)
-    columns = [
-        db.ChildTransactions.id,
-        db.ChildTransactions.Date,
-        db.ChildTransactions.Transaction,
-        db.ChildTransactions.Name,
-        db.ChildTransactions.Memo,
-        db.ChildTransactions.Amount,
-        db.ChildTransactions.VendorUUID,
-    ]
-    child_query = select(columns).select_from(db.ChildTransactions)
-    child_table = pd.read_sql(child_query, db.engine)
-    child_table["Tag"] = child_table["VendorUUID"].apply(queries.uuid_to_tag)
-    tran_table = pd.concat([tran_table, child_table], ignore_index=True)
+@instrument.timed("frame build")
+def build_tran_table(engine=None) -> pd.DataFrame:
+    """
+    Builds the table all the graphs work off of, the ledger from queries.ledger_rows_query with split parents
+    swapped for their children, a Tag for each row, and columns for the Year, Month and Quarter
+    """
+    engine = engine or db.engine
+    with engine.connect() as conn:
+        # Years moved to archives are read through views that put them back together with the current tables
+        transactions_table, children_table = archive.attach_archives(conn)
+        tran_table = pd.read_sql(text(queries.ledger_query(transactions_table, children_table)), conn)
+    # A split child keeps the tag it was given, everything else gets its vendor's tag, looked up once per vendor
+    tag_map = {vendor_uuid: queries.uuid_to_tag(vendor_uuid) for vendor_uuid in tran_table["VendorUUID"].unique()}
+    tran_table["Tag"] = tran_table["Tag"].fillna(tran_table["VendorUUID"].map(tag_map))
+    # Both sides of a transfer between your own accounts count as an "Internal Transfer", whatever their vendor
+    tran_table["Transfer"] = tran_table["Transfer"].astype(bool)
+    tran_table.loc[tran_table["Transfer"], "Tag"] = "Internal Transfer"
     # Add columns for time
     tran_table["Date"] = pd.to_datetime(tran_table["Date"], infer_datetime_format=True)
     tran_table["Year"] = pd.DatetimeIndex(tran_table["Date"]).year
     tran_table["Month"] = tran_table["Date"].dt.to_period("M").dt.strftime("%Y-%m")
     tran_table["Quarter"] = tran_table["Date"].dt.to_period("Q").dt.strftime("%Y-%q")
-    
-    # Pull Vendors, also do vendor_list in a cell in the notebook to get a list of vendors
-    vendor_query = select(db.Vendors)
-    vendor_list = pd.read_sql(vendor_query, conn).sort_values(by="Vendor")
+    return tran_table
 
-    # Do tag_list in a cell in the notebook to get a list of tags
-    tag_array = vendor_list['Tag'].unique()
-    tag_list = pd.DataFrame(tag_array, columns = ['Tags']).sort_values(by='Tags')
 
+# The tables below are built the first time something asks for them, not when graphs is imported
+tables = {}
 
-def graph_one(
-    group_by: str, filter_year: str, filter_month: str, width: int, height: int, invert: bool = False
-):
+
+def refresh_tables() -> None:
+    """Throws away the cached tables if the transactions changed since they were built, like after an import"""
+    version = db.data_version()
+    if tables.get("data_version") != version:
+        tables.clear()
+        tables["data_version"] = version
+
+
+def get_tran_table(columns: list | None = None) -> pd.DataFrame:
     """
-    Example use: graph_one(group_by='Month', filter_year='2022', filter_month='01', height=500, width=1200)
-    This is used for just seeing a grouping of tagged expenses by either month or quarter, starting from the filtered year and month
+    Returns the table all the graphs work off of, building it the first time and after the data changes.
+    Pass columns to only load those from the snapshot, like reports.base_columns
     """
-    # Create a filter for the transactions dataframe
+    refresh_tables()
+    key = "tran_table" if columns is None else ("tran_table", tuple(columns))
+    if key not in tables:
+        if "tran_table" in tables:
+            # Already have every column
+            tables[key] = tables["tran_table"][list(columns)]
+            return tables[key]
+        # The snapshot on disk is much quicker to load than rebuilding from SQLite, when it's up to date
+        tran_table = snapshot.load_snapshot(columns)
+        if tran_table is None:
+            stamp = snapshot.current_stamp()
+            tran_table = build_tran_table()
+            snapshot.write_snapshot(tran_table, stamp)
+            tables["tran_table"] = tran_table
+            if columns is not None:
+                tran_table = tran_table[list(columns)]
+        tables[key] = tran_table
+    return tables[key]
+
+
+def get_vendor_list() -> pd.DataFrame:
+    """Pull Vendors, also do vendor_list in a cell in the notebook to get a list of vendors"""
+    refresh_tables()
+    if "vendor_list" not in tables:
+        with db.engine.connect() as conn:
+            vendor_query = select(db.Vendors)
+            tables["vendor_list"] = pd.read_sql(vendor_query, conn).sort_values(by="Vendor")
+    return tables["vendor_list"]
+
+
+def get_tag_list() -> pd.DataFrame:
+    """Do tag_list in a cell in the notebook to get a list of tags"""
+    refresh_tables()
+    if "tag_list" not in tables:
+        tag_array = get_vendor_list()['Tag'].unique()
+        tables["tag_list"] = pd.DataFrame(tag_array, columns = ['Tags']).sort_values(by='Tags')
+    return tables["tag_list"]
+
+
+def __getattr__(name: str):
+    # Keeps graphs.tran_table, graphs.vendor_list and graphs.tag_list working in the notebook
+    if name == "tran_table":
+        return get_tran_table()
+    if name == "vendor_list":
+        return get_vendor_list()
+    if name == "tag_list":
+        return get_tag_list()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Figures already drawn, keyed by the graph, its arguments and the data it was drawn from. Oldest ones get dropped
+figures = OrderedDict()
+max_figures = 32
+
+
+def cached_figure(*file_paths: str):
+    """
+    Used on the graph functions, which build and return their figure. The figure and anything the graph printed
+    are kept, so running a cell again with the same arguments just shows them again. A figure is redrawn once the
+    transactions or vendors change, or any of file_paths (like budget_plans.yml) is saved
+    """
+
+    def decorator(graph_function):
+        @functools.wraps(graph_function)
+        def wrapper(*args, **kwargs):
+            file_stamps = tuple(os.path.getmtime(path) if os.path.exists(path) else None for path in file_paths)
+            key = (graph_function.__name__, args, tuple(sorted(kwargs.items())), snapshot.current_stamp(), file_stamps)
+            if key in figures:
+                figures.move_to_end(key)
+                expense_graph, printed = figures[key]
+            else:
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output):
+                    expense_graph = graph_function(*args, **kwargs)
+                printed = output.getvalue()
+                figures[key] = (expense_graph, printed)
+                if len(figures) > max_figures:
+                    figures.popitem(last=False)
+            print(printed, end="")
+            if expense_graph is not None:
+                expense_graph.show()
+
+        return wrapper
+
+    return decorator
+
+
+def top_n(table: pd.DataFrame, column: str, top: int | None, value: str = "Amount") -> pd.DataFrame:
+    """
+    Keeps the top values of column by total absolute value and folds the rest into "Other",
+    so a graph has a few dozen bars instead of one for every vendor in the year. top=None keeps everything
+    """
+    if top is None or table[column].nunique() <= top:
+        return table
+    keep = table.groupby(column)[value].sum().abs().nlargest(top).index
+    table = table.copy()
+    table[column] = table[column].where(table[column].isin(keep), "Other")
+    return table
+
+
+def add_vendor_names(table: pd.DataFrame) -> pd.DataFrame:
+    # Look up each vendor once, instead of once per row. Tables that already have their vendors are left alone
+    if "Vendor" in table.columns:
+        return table
+    table = table.copy()
+    vendor_map = {vendor_uuid: queries.uuid_to_vendor(vendor_uuid) for vendor_uuid in table["VendorUUID"].unique()}
+    table["Vendor"] = table["VendorUUID"].map(vendor_map)
+    return table
+
+
+def expense_filter(table: pd.DataFrame, start: str, end: str | None = None) -> pd.Series:
+    """The rows every graph starts from, expenses that aren't internal transfers from start (and up to end, inclusive)"""
     tran_table_filter = (
-        (tran_table["Tag"] != "Internal Transfer")  # exclude "Internal Transfer" transactions
-        & (tran_table["Date"] >= f"{filter_year}-{filter_month}-01")  # include transactions with a Date >= the specified year and month
-        & (tran_table["Amount"] < int(0))  # include transactions with negative Amounts
+        (table["Tag"] != "Internal Transfer")  # exclude "Internal Transfer" transactions
+        & (table["Date"] >= start)  # include transactions with a Date >= the specified year and month
+        & (table["Amount"] < int(0))  # include transactions with negative Amounts
     )
-    
+    if end is not None:
+        tran_table_filter &= table["Date"] <= end
+    return tran_table_filter
+
+
+def graph_one_data(
+    group_by: str, filter_year: str, filter_month: str, invert: bool = False, table: pd.DataFrame | None = None
+) -> pd.DataFrame | None:
+    """
+    The numbers behind graph_one, the tagged expenses summed by group_by and Tag starting from the filtered year and month.
+    Returns None if there's nothing to show
+    """
+    if table is None:
+        table = get_tran_table()
+
     # Apply the filter to the transactions dataframe to create a new dataframe
-    new_tran_table = tran_table[tran_table_filter]
+    new_tran_table = table[expense_filter(table, f"{filter_year}-{filter_month}-01")]
     if new_tran_table.empty:
-        print("The dataframe is empty. Nothing to populate chart with")
         return None
     # Group the new dataframe by the specified group_by column and the "Tag" column
     # and sum the "Amount" column to create a new dataframe
@@ -121,12 +253,19 @@ def graph_one(
     if invert:
         expense_table_tags["Amount"] *= -1
 
+    return expense_table_tags
+
+
+def graph_one_figure(expense_table_tags: pd.DataFrame, group_by: str, width: int, height: int):
+    # plotly is slow to import, so it only gets imported once a graph is drawn
+    import plotly.express as px
+
     # Create a bar graph using the new dataframe
     # with the specified group_by column on the x-axis,
     # the "Amount" column on the y-axis,
     # and the "Tag" column for the color of the bars
     # with the specified width and height
-    expense_graph = px.bar(
+    return px.bar(
         expense_table_tags,
         x=group_by,
         y="Amount",
@@ -134,38 +273,62 @@ def graph_one(
         width=width,
         height=height,
     )
-    expense_graph.show()
 
-def graph_two(
+
+@cached_figure()
+def graph_one(
     group_by: str, filter_year: str, filter_month: str, width: int, height: int, invert: bool = False
 ):
     """
-    This graph is very similar to graph_one, but will show a line for each individual expense
+    Example use: graph_one(group_by='Month', filter_year='2022', filter_month='01', height=500, width=1200)
+    This is used for just seeing a grouping of tagged expenses by either month or quarter, starting from the filtered year and month
     """
+    expense_table_tags = graph_one_data(group_by, filter_year, filter_month, invert)
+    if expense_table_tags is None:
+        print("The dataframe is empty. Nothing to populate chart with")
+        return None
+    return graph_one_figure(expense_table_tags, group_by, width, height)
+
+
+def graph_two_data(
+    group_by: str,
+    filter_year: str,
+    filter_month: str,
+    invert: bool = False,
+    top: int | None = 15,
+    table: pd.DataFrame | None = None,
+) -> pd.DataFrame | None:
+    """
+    The numbers behind graph_two, the expenses summed by group_by, Tag and Vendor starting from the filtered year and month,
+    with the vendors past the top ones summed into "Other". Returns None if there's nothing to show
+    """
+    if table is None:
+        table = get_tran_table()
+
     # Filter the transaction table to exclude internal transfers and transactions from before the specified year and month
-    tran_table_filter = (
-        (tran_table["Tag"] != "Internal Transfer")
-        & (tran_table["Date"] >= f"{filter_year}-{filter_month}-01")
-        & (tran_table["Amount"] < int(0))
-    )
-    new_tran_table = tran_table[tran_table_filter]
-    
+    new_tran_table = table[expense_filter(table, f"{filter_year}-{filter_month}-01")]
     if new_tran_table.empty:
-        print("The dataframe is empty. Nothing to populate chart with")
         return None
-    
-    new_tran_table["Vendor"] = new_tran_table["VendorUUID"].apply(queries.uuid_to_vendor)
-        
+
+    new_tran_table = top_n(add_vendor_names(new_tran_table), "Vendor", top)
+
     # Group the transactions by the specified group, tag, and vendor and sum their amounts
     expense_table_vendors = new_tran_table.groupby(
         [group_by, "Tag", "Vendor"], as_index=False
     ).Amount.sum()
-    
+
     if invert:
         expense_table_vendors["Amount"] *= -1
-    
+
+    return expense_table_vendors
+
+
+def graph_two_figure(expense_table_vendors: pd.DataFrame, group_by: str, width: int, height: int):
+    # plotly is slow to import, so it only gets imported once a graph is drawn
+    import plotly.express as px
+
     # Create a bar graph of the grouped transactions
-    expense_graph = px.bar(
+    return px.bar(
         expense_table_vendors,
         x=group_by,
         y="Amount",
@@ -174,47 +337,73 @@ def graph_two(
         width=width,
         height=height,
     )
-    expense_graph.show()
 
 
-def graph_three(
-    filter_year: str, filter_month: str, width: int, height: int, budget_plan: str, Salary: int, invert: bool = False
+@cached_figure()
+def graph_two(
+    group_by: str, filter_year: str, filter_month: str, width: int, height: int, invert: bool = False, top: int | None = 15
 ):
     """
-    The graph for this is basically a level up from graph one, where using the budget_plans file, groups your tags into categories.
-    It also gives overview information about other things like your monthly income, spending, the amount left after that,
-    how much you still need to spend on required expenses, like savings, and how much you have left after that.
+    This graph is very similar to graph_one, but will show a line for each individual expense.
+    Only the top vendors get their own line, the rest are summed into "Other"
     """
-    # Load budget plans from budget_plans.yml
-    with open("budget_plans.yml", "r") as budp:
-        budget_plans = yaml.safe_load(budp)
+    expense_table_vendors = graph_two_data(group_by, filter_year, filter_month, invert, top)
+    if expense_table_vendors is None:
+        print("The dataframe is empty. Nothing to populate chart with")
+        return None
+    return graph_two_figure(expense_table_vendors, group_by, width, height)
+
+
+def category_map(budget_plan: dict) -> dict:
+    """Tag to category for a budget plan, the first category listing a tag gets it, same as category_from_tag"""
+    tag_categories = {}
+    for category in budget_plan:
+        for tag in budget_plan[category]["tags"] or []:
+            tag_categories.setdefault(tag, category)
+    return tag_categories
+
+
+def graph_three_data(
+    filter_year: str, filter_month: str, budget_plan: str, budget_plans: dict, table: pd.DataFrame | None = None
+) -> tuple | None:
+    """
+    The numbers behind graph_three, the month's expenses with their Category and Required columns from the budget plan,
+    the expenses summed by Category and Tag, and a dictionary of category to the sum of its expenses.
+    Returns None if there's nothing to show
+    """
+    if table is None:
+        table = get_tran_table()
 
     # Filter transactions that are not internal transfers and are from the specified year and month
-    tran_table_filter = (
-        (tran_table["Tag"] != "Internal Transfer")
-        & (tran_table["Date"] >= f"{filter_year}-{filter_month}-01")
-        & (tran_table["Date"] <= f"{filter_year}-{filter_month}-{calendar.monthrange(int(filter_year), int(filter_month))[1]}")
-        & (tran_table["Amount"] < int(0))
+    last_day = calendar.monthrange(int(filter_year), int(filter_month))[1]
+    tran_table_filter = expense_filter(
+        table, f"{filter_year}-{filter_month}-01", f"{filter_year}-{filter_month}-{last_day}"
     )
-    # Run query filter
-    new_tran_table = tran_table[tran_table_filter]
+    # Run query filter, copied since Category and Required get added to it
+    new_tran_table = table[tran_table_filter].copy()
     
     if new_tran_table.empty:
-        print("The dataframe is empty. Nothing to populate chart with")
         return None
         
-    # Add a new column "Category" to the new transaction table by applying the category_from_tag function to each row
-    new_tran_table["Category"] = new_tran_table.apply(lambda row: category_from_tag(budget_plans[budget_plan], row), axis=1)
+    # Add a new column "Category" to the new transaction table, from each tag's category in the budget plan
+    new_tran_table["Category"] = new_tran_table["Tag"].map(category_map(budget_plans[budget_plan])).fillna("Failed to categorize")
     # Add a new column "Required" to the new transaction table by checking whether the category has a true value for required in the dictionary
-    new_tran_table["Required"] = new_tran_table.apply(
-        lambda row: budget_plans[budget_plan][row["Category"]]["required"] if row["Category"] in budget_plans[budget_plan] else False, axis=1
-    )
+    required_map = {category: budget_plans[budget_plan][category]["required"] for category in budget_plans[budget_plan]}
+    new_tran_table["Required"] = new_tran_table["Category"].map(required_map).fillna(False)
     # Group the transactions by their Category and Tag, and sum up their amounts
     expense_table_vendors = new_tran_table.groupby(["Category", "Tag"], as_index=False).Amount.sum()
     
     
     # Group the transactions by their category and sum up their amounts
     expense_table_categories_sum = new_tran_table.groupby("Category")["Amount"].sum().to_dict()
+
+    return new_tran_table, expense_table_vendors, expense_table_categories_sum
+
+
+def graph_three_summary(three_data: tuple, budget_plans: dict, budget_plan: str, Salary: int) -> None:
+    """Prints the overview that goes with graph_three, income, spending, and how each category of the budget plan is doing"""
+    new_tran_table, expense_table_vendors, expense_table_categories_sum = three_data
+
     # Get the total sum of all expenses from all categories
     total_expenses = sum(expense_table_categories_sum.values())
     # Get the sum of all rows that equal required on the new transaction table
@@ -251,12 +440,17 @@ Left and not allocated to required: {round((((Salary/12)+total_expenses) - (requ
                 print(f"{category} Category: This is set as a free spending category, you have {amount_left} left to spend")
             elif (budget_plans[budget_plan][category]['type'] == 'free_spend') & (amount_left < 0):
                 print(f"{category} Category: This is set as a free spending category, you have {amount_left} left to spend")
-                
+
+
+def graph_three_figure(expense_table_vendors: pd.DataFrame, budget_plan: str, width: int, height: int, invert: bool = False):
+    # plotly is slow to import, so it only gets imported once a graph is drawn
+    import plotly.express as px
+
     if invert:
-        expense_table_vendors["Amount"] *= -1
+        expense_table_vendors = expense_table_vendors.assign(Amount=expense_table_vendors["Amount"] * -1)
     
     # Create a bar chart using plotly express, with the x-axis being the Category, the y-axis being the Amount, and the color being the Tag
-    expense_graph = px.bar(
+    return px.bar(
         expense_table_vendors,
         x="Category",
         y="Amount",
@@ -267,45 +461,69 @@ Left and not allocated to required: {round((((Salary/12)+total_expenses) - (requ
         title=f'Expenses for the month, grouped by category. Using the {budget_plan}',
     )
 
-    # Show the bar chart
-    expense_graph.show()
-    
-    
-def graph_four(
-    filter_year: str, filter_month: str, width: int, height: int, invert: bool = False
+
+@cached_figure("budget_plans.yml")
+def graph_three(
+    filter_year: str, filter_month: str, width: int, height: int, budget_plan: str, Salary: int, invert: bool = False
 ):
     """
-    Sum grouped by tag for a given year
+    The graph for this is basically a level up from graph one, where using the budget_plans file, groups your tags into categories.
+    It also gives overview information about other things like your monthly income, spending, the amount left after that,
+    how much you still need to spend on required expenses, like savings, and how much you have left after that.
     """
-    
+    # Load budget plans from budget_plans.yml
+    with open("budget_plans.yml", "r") as budp:
+        budget_plans = yaml.safe_load(budp)
+
+    three_data = graph_three_data(filter_year, filter_month, budget_plan, budget_plans)
+    if three_data is None:
+        print("The dataframe is empty. Nothing to populate chart with")
+        return None
+
+    graph_three_summary(three_data, budget_plans, budget_plan, Salary)
+    return graph_three_figure(three_data[1], budget_plan, width, height, invert)
+
+
+def graph_four_data(
+    filter_year: str,
+    filter_month: str,
+    invert: bool = False,
+    top: int | None = 15,
+    table: pd.DataFrame | None = None,
+) -> pd.DataFrame | None:
+    """
+    The numbers behind graph_four, a year of expenses from the filtered year and month summed by Tag and Vendor,
+    with the vendors past the top ones summed into "Other". Returns None if there's nothing to show
+    """
+    if table is None:
+        table = get_tran_table()
+
     eoy = str(int(filter_year)+1)
 
-    
     # Filter the transaction table to exclude internal transfers and transactions from before the specified year and month
-    tran_table_filter = (
-        (tran_table["Tag"] != "Internal Transfer")
-        & (tran_table["Date"] >= f"{filter_year}-{filter_month}-01")
-        & (tran_table["Date"] <= f"{eoy}-{filter_month}-01")
-        & (tran_table["Amount"] < int(0))
-    )
-    new_tran_table = tran_table[tran_table_filter]
-    
+    new_tran_table = table[expense_filter(table, f"{filter_year}-{filter_month}-01", f"{eoy}-{filter_month}-01")]
     if new_tran_table.empty:
-        print("The dataframe is empty. Nothing to populate chart with")
         return None
-    
-    new_tran_table["Vendor"] = new_tran_table["VendorUUID"].apply(queries.uuid_to_vendor)
-        
+
+    new_tran_table = top_n(add_vendor_names(new_tran_table), "Vendor", top)
+
     # Group the transactions by the specified group, tag, and vendor and sum their amounts
     expense_table_vendors = new_tran_table.groupby(
         ["Tag", "Vendor"], as_index=False
     ).Amount.sum().sort_values(by="Amount")
-    
+
     if invert:
         expense_table_vendors["Amount"] *= -1
-    
+
+    return expense_table_vendors
+
+
+def graph_four_figure(expense_table_vendors: pd.DataFrame, width: int, height: int):
+    # plotly is slow to import, so it only gets imported once a graph is drawn
+    import plotly.express as px
+
     # Create a bar graph of the grouped transactions
-    expense_graph = px.bar(
+    return px.bar(
         expense_table_vendors,
         x="Tag",
         y="Amount",
@@ -314,47 +532,114 @@ def graph_four(
         width=width,
         height=height,
     )
-    expense_graph.show()
-    
-    
-def graph_five(
-    filter_year: str, filter_month: str, width: int, height: int, invert: bool = False
+
+
+@cached_figure()
+def graph_four(
+    filter_year: str, filter_month: str, width: int, height: int, invert: bool = False, top: int | None = 15
 ):
     """
-    Example use: graph_one(group_by='Month', filter_year='2022', filter_month='01', height=500, width=1200)
-    This is used for just seeing a grouping of tagged expenses by either month or quarter, starting from the filtered year and month
+    Sum grouped by tag for a given year, the top vendors get their own color and the rest are summed into "Other"
     """
-    
+    expense_table_vendors = graph_four_data(filter_year, filter_month, invert, top)
+    if expense_table_vendors is None:
+        print("The dataframe is empty. Nothing to populate chart with")
+        return None
+    return graph_four_figure(expense_table_vendors, width, height)
+
+
+@cached_figure()
+def graph_recurring(width: int, height: int, active_only: bool = True, top: int | None = 30):
+    """
+    Example use: graph_recurring(width=1200, height=500)
+    Subscriptions and recurring bills by what they cost a year, colored by how often they charge.
+    Hover for the latest amount, the last and next charge, and any price changes. Past the top ones, they're summed into "Other"
+    """
+    # plotly is slow to import, so it only gets imported once a graph is drawn
+    import plotly.express as px
+    from backend import recurring
+
+    recurring_table = recurring.recurring_charges(active_only=active_only)
+    if recurring_table is None or recurring_table.empty:
+        print("The dataframe is empty. Nothing to populate chart with")
+        return None
+
+    recurring_table["Label"] = recurring_table["Vendor"].where(
+        recurring_table["Vendor"] != "No Vendor Found", recurring_table["Series"].str.title()
+    )
+    recurring_table["Price Changes"] = recurring_table["Price Changes"].map(len)
+    recurring_table = top_n(recurring_table, "Label", top, value="Annual Cost")
+    recurring_table = recurring_table.groupby(["Label", "Cadence"], as_index=False, sort=False).agg(
+        {
+            "Annual Cost": "sum",
+            "Name": "first",
+            "Amount": "sum",
+            "Last Charge": "max",
+            "Next Expected": "min",
+            "Price Changes": "sum",
+        }
+    )
+
+    # Create a bar graph with a bar for each recurring series
+    expense_graph = px.bar(
+        recurring_table,
+        x="Label",
+        y="Annual Cost",
+        color="Cadence",
+        hover_data=["Name", "Amount", "Last Charge", "Next Expected", "Price Changes"],
+        width=width,
+        height=height,
+        title="Recurring charges by what they cost a year",
+    )
+    return expense_graph
+
+
+def graph_five_data(
+    filter_year: str,
+    filter_month: str,
+    invert: bool = False,
+    top: int | None = 15,
+    table: pd.DataFrame | None = None,
+) -> pd.DataFrame | None:
+    """
+    The numbers behind graph_five, a year of expenses from vendors without a useful default tag summed by Vendor and Name,
+    with the vendors past the top ones summed into "Other". Returns None if there's nothing to show
+    """
+    if table is None:
+        table = get_tran_table()
+
     eoy = str(int(filter_year)+1)
-    
+
     # Create a filter for the transactions dataframe
-    tran_table_filter = (
-        (tran_table["Tag"] != "Internal Transfer")
-        & (tran_table["Tag"] == "Vendor w/o default Tag")
-        & (tran_table["Date"] >= f"{filter_year}-{filter_month}-01")
-        & (tran_table["Date"] <= f"{eoy}-{filter_month}-01")
-        & (tran_table["Amount"] < int(0))
+    tran_table_filter = expense_filter(table, f"{filter_year}-{filter_month}-01", f"{eoy}-{filter_month}-01") & (
+        table["Tag"] == "Vendor w/o default Tag"
     )
-    
+
     # Apply the filter to the transactions dataframe to create a new dataframe
-    new_tran_table = tran_table[tran_table_filter]
+    new_tran_table = table[tran_table_filter].copy()
     if new_tran_table.empty:
-        print("The dataframe is empty. Nothing to populate chart with")
         return None
-    
-    new_tran_table["Vendor"] = new_tran_table["VendorUUID"].apply(queries.uuid_to_vendor)
+
+    new_tran_table = top_n(add_vendor_names(new_tran_table), "Vendor", top)
+    # The names under "Other" would just be more bars nobody can read
+    new_tran_table.loc[new_tran_table["Vendor"] == "Other", "Name"] = "Other"
 
     # Invert the amount if the invert option is set to True
     if invert:
         new_tran_table["Amount"] *= -1
-        
-    # Group the new dataframe
-    expense_table_vendors = new_tran_table.groupby(
-        ["Vendor", "Amount", "Name"], as_index=False
+
+    # Group the new dataframe, one piece of a vendor's bar for each name
+    return new_tran_table.groupby(
+        ["Vendor", "Name"], as_index=False
     ).Amount.sum().sort_values(by="Amount", ascending=False)
-    
+
+
+def graph_five_figure(expense_table_vendors: pd.DataFrame, width: int, height: int):
+    # plotly is slow to import, so it only gets imported once a graph is drawn
+    import plotly.express as px
+
     # Create a bar graph using the new dataframe
-    expense_graph = px.bar(
+    return px.bar(
         expense_table_vendors,
         x="Vendor",
         y="Amount",
@@ -363,36 +648,63 @@ def graph_five(
         width=width,
         height=height,
     )
-    expense_graph.show()
 
 
-def pt_one(filter_tag: str, filter_month: Optional[int] = None, head: Optional[int] = 15):
-    """This sorts by amount so you'll most use this to look at things like the highest expenses for vendors without tags"""
-    
+@cached_figure()
+def graph_five(
+    filter_year: str, filter_month: str, width: int, height: int, invert: bool = False, top: int | None = 15
+):
+    """
+    Example use: graph_five(filter_year='2022', filter_month='01', height=500, width=1200)
+    The vendors that don't have a useful default tag, like Amazon or Venmo, for the year starting from the filtered year and month.
+    Each bar is split by the transaction names, past the top vendors they're summed into "Other"
+    """
+    expense_table_vendors = graph_five_data(filter_year, filter_month, invert, top)
+    if expense_table_vendors is None:
+        print("The dataframe is empty. Nothing to populate chart with")
+        return None
+    return graph_five_figure(expense_table_vendors, width, height)
+
+
+# The biggest expenses for a tag, with the vendor's newest name and tag joined in. SQLite keeps only the top :head rows
+# while it sorts. Counted from the same ledger as tran_table, split parents are swapped for their children
+pt_one_query = """
+    WITH latest_vendors AS ({latest_vendors}),
+    ledger AS ({ledger})
+    SELECT COALESCE(v.Vendor, 'No Vendor Found') AS Vendor, l.Name, l.id, l.Date, l.Amount,
+        CAST(SUBSTR(l.Date, 1, 4) AS INTEGER) AS Year
+    FROM ledger l
+    LEFT JOIN latest_vendors v ON v.UUID = l.VendorUUID
+    WHERE l.Amount < 0 AND {tag} = :tag
+    ORDER BY l.Amount, Vendor, l.Name, l.id
+    LIMIT :head
+"""
+
+
+def pt_one(filter_tag: str, filter_month: Optional[str] = None, head: Optional[int] = 15):
+    """
+    This sorts by amount so you'll most use this to look at things like the highest expenses for vendors without tags.
+    filter_month looks like "2022-03". Only the head rows ever leave the database
+    """
+    params = {"tag": filter_tag, "head": -1 if head is None else head}
+    month_filter = ""
     if filter_month != None:
-        # Create filter from signature, and also only look at negative numbers
-        filter_tran_table = (
-            (tran_table["Month"] == filter_month)
-            & (tran_table["Tag"] == filter_tag)
-            & (tran_table["Amount"] < int(0))
-        )
-    else:
-        # Create filter from signature, and also only look at negative numbers
-        filter_tran_table = (
-            (tran_table["Tag"] == filter_tag)
-            & (tran_table["Amount"] < int(0))
+        # Every date in the month sorts between "2022-03" and "2022-03~", so the Date index can be used
+        month_filter = "AND {row}.Date >= :month_start AND {row}.Date < :month_end"
+        params.update(month_start=str(filter_month), month_end=f"{filter_month}~")
+
+    with db.engine.connect() as conn:
+        transactions_table, children_table = archive.attach_archives(conn)
+        query = pt_one_query.format(
+            latest_vendors=queries.latest_vendors_query,
+            ledger=queries.ledger_query(transactions_table, children_table, month_filter),
+            tag=queries.ledger_tag,
         )
-        
-    
-    # Apply the filter
-    new_tran_table = tran_table[filter_tran_table]
-    
+        new_tran_table = pd.read_sql(text(query), conn, params=params)
+
     if new_tran_table.empty:
         print("The dataframe is empty. Nothing to populate pivot table with")
         return None
-    
-    # Use the `uuid_to_vendor()` function to convert the VendorUUID column to the Vendor column
-    new_tran_table["Vendor"] = new_tran_table["VendorUUID"].apply(queries.uuid_to_vendor)
-    
-    newer_tran_table = pd.pivot_table(new_tran_table, index=["Vendor", "Name", "id", "Date"])
-    return newer_tran_table.sort_values(by="Amount").head(head)
+
+    new_tran_table["Date"] = pd.to_datetime(new_tran_table["Date"], infer_datetime_format=True)
+    return new_tran_table.set_index(["Vendor", "Name", "id", "Date"])
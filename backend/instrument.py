@@ -0,0 +1,181 @@
+"""
+Lightweight timers and counters for finding out where the time goes in crud.main.
+Everything here does nothing until enable() is called, so it can stay wrapped around the hot code.
+While enabled, every SQL statement any engine runs is timed on the "db statements" timer, that's the database time
+in the summary and everything else in main is python time. Rows that are fetched after a statement runs count as python.
+
+Example use:
+    instrument.enable()
+    crud.main()
+    instrument.print_summary()
+"""
+import io
+import time
+import pstats
+import cProfile
+import functools
+import tracemalloc
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+enabled = False
+timings = {}
+counters = {}
+
+
+class NullTimer:
+    """Handed out by timer() while instrumentation is off, so timing a block costs next to nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class Timer:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        stats = timings.setdefault(self.name, [0.0, 0])
+        stats[0] += seconds
+        stats[1] += 1
+        return False
+
+
+null_timer = NullTimer()
+
+
+# The timer every SQL statement adds to while instrumentation is on
+db_timer = "db statements"
+
+
+def before_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("instrument_starts", []).append(time.perf_counter())
+
+
+def after_statement(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("instrument_starts")
+    if starts:
+        stats = timings.setdefault(db_timer, [0.0, 0])
+        stats[0] += time.perf_counter() - starts.pop()
+        stats[1] += 1
+
+
+def enable(on: bool = True) -> None:
+    """Turns the timers and counters on (or off) and clears anything recorded before"""
+    global enabled
+    if on and not enabled:
+        event.listen(Engine, "before_cursor_execute", before_statement)
+        event.listen(Engine, "after_cursor_execute", after_statement)
+    elif enabled and not on:
+        event.remove(Engine, "before_cursor_execute", before_statement)
+        event.remove(Engine, "after_cursor_execute", after_statement)
+    enabled = on
+    reset()
+
+
+def reset() -> None:
+    timings.clear()
+    counters.clear()
+
+
+def timer(name: str):
+    """Context manager that adds the time spent in the block to the named timer"""
+    if not enabled:
+        return null_timer
+    return Timer(name)
+
+
+def count(name: str, amount: int = 1) -> None:
+    """Adds amount to the named counter"""
+    if enabled:
+        counters[name] = counters.get(name, 0) + amount
+
+
+def timed(name: str):
+    """Decorator version of timer, for timing every call of a hot function"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with Timer(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def summary(total_timer: str = "main") -> dict:
+    """
+    Structured summary of everything recorded since enable(), shaped like:
+    {
+        "timers": {"import": {"seconds": 1.2, "calls": 1}, ...},
+        "counters": {"rows": 1000, "duplicates": 10, ...},
+        "rows per second": 830,
+        "db seconds": 0.8,
+        "python seconds": 0.4,
+    }
+    """
+    timers = {name: {"seconds": round(stats[0], 4), "calls": stats[1]} for name, stats in timings.items()}
+    total = timings.get(total_timer, [0.0, 0])[0]
+    db_seconds = timings.get(db_timer, [0.0, 0])[0]
+    import_seconds = timings.get("import", [0.0, 0])[0]
+
+    return {
+        "timers": timers,
+        "counters": dict(counters),
+        "rows per second": round(counters.get("rows", 0) / import_seconds) if import_seconds else None,
+        "db seconds": round(db_seconds, 4),
+        "python seconds": round(max(total - db_seconds, 0), 4),
+    }
+
+
+def print_summary(total_timer: str = "main") -> dict:
+    run_summary = summary(total_timer)
+    print("Timings:")
+    for name, stats in sorted(run_summary["timers"].items(), key=lambda item: item[1]["seconds"], reverse=True):
+        print(f"  {name}: {stats['seconds']}s over {stats['calls']} calls")
+    print(f"Counters: {run_summary['counters']}")
+    print(
+        f"Rows per second: {run_summary['rows per second']}, DB time: {run_summary['db seconds']}s, "
+        f"Python time: {run_summary['python seconds']}s"
+    )
+    return run_summary
+
+
+def profile_run(func, *args, mode: str = "cprofile", top: int = 25, **kwargs):
+    """
+    Runs func once with a profiler on and prints what it found, mode is either "cprofile" for where the time went
+    or "tracemalloc" for where the memory went. Returns whatever func returned
+    """
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        result = profiler.runcall(func, *args, **kwargs)
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(top)
+        print(stream.getvalue())
+    elif mode == "tracemalloc":
+        tracemalloc.start()
+        try:
+            result = func(*args, **kwargs)
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        print(f"Current memory: {round(current / 1024**2, 2)} MB, peak: {round(peak / 1024**2, 2)} MB")
+        for stat in snapshot.statistics("lineno")[:top]:
+            print(stat)
+    else:
+        raise ValueError(f"Unknown profile mode {mode}, use cprofile or tracemalloc")
+    return result
@@ -0,0 +1,164 @@
+import os
+import json
+import hashlib
+import tempfile
+
+import yaml
+
+# Use the libyaml C loader and dumper when PyYAML was built with them, they're a lot faster
+try:
+    from yaml import CSafeLoader as SafeLoader
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader
+    from yaml import SafeDumper
+
+# Changes to vendors.yml go to this file next to it until there are enough of them to compact
+journal_suffix = ".journal"
+compact_every = 50
+
+
+def load_yaml(file_path: str):
+    """Loads a yaml file, like the bank profiles, budget plans or vendors"""
+    with open(file_path, "r") as yaml_file:
+        return yaml.load(yaml_file, Loader=SafeLoader)
+
+
+def new_file_mode() -> int:
+    """The mode a plain open() would give a new file, mkstemp always makes them 0600"""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def keep_file_mode(temp_path: str, file_path: str) -> None:
+    """
+    Gives a temp file about to be renamed over file_path the mode file_path has now,
+    or the mode a new file would get if there isn't one yet
+    """
+    try:
+        mode = os.stat(file_path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = new_file_mode()
+    os.chmod(temp_path, mode)
+
+
+def dump_yaml(data, file_path: str) -> None:
+    """
+    Writes the data to the yaml file atomically. The data is written to a temp file in the same folder
+    then renamed over the old file, so a crash part way through never leaves a half written file behind.
+    The new file keeps the old one's permissions
+    """
+    folder = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as temp_file:
+            yaml.dump(data, temp_file, Dumper=SafeDumper, default_flow_style=False)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        keep_file_mode(temp_path, file_path)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def journal_path(yml_file_path: str) -> str:
+    return yml_file_path + journal_suffix
+
+
+def append_journal(yml_file_path: str, changes: list) -> None:
+    """
+    Appends vendor changes to the journal instead of rewriting all of vendors.yml.
+    Each change is one json line, shaped like one of these:
+    {"op": "add", "vendor": {"UUID": ..., "Vendor": ..., "Pattern": ..., "Tag": ..., "Initialized": ...}}
+    {"op": "update", "UUID": ..., "Vendor": ..., "Pattern": ...}
+    Once the journal has compact_every changes in it, it gets folded back into vendors.yml
+    """
+    with open(journal_path(yml_file_path), "a") as journal:
+        for change in changes:
+            journal.write(json.dumps(change) + "\n")
+        journal.flush()
+        os.fsync(journal.fileno())
+
+    if count_journal(yml_file_path) >= compact_every:
+        compact_vendor_file(yml_file_path)
+
+
+def read_journal(yml_file_path: str) -> list:
+    """Returns the changes in the journal, a line that didn't finish writing before a crash is skipped"""
+    changes = []
+    if not os.path.exists(journal_path(yml_file_path)):
+        return changes
+    with open(journal_path(yml_file_path), "r") as journal:
+        for line in journal:
+            try:
+                changes.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return changes
+
+
+def count_journal(yml_file_path: str) -> int:
+    if not os.path.exists(journal_path(yml_file_path)):
+        return 0
+    with open(journal_path(yml_file_path), "rb") as journal:
+        return sum(1 for _ in journal)
+
+
+def apply_changes(vendors: list, changes: list) -> list:
+    """
+    Replays journal changes on top of the vendors loaded from vendors.yml. Replaying twice gives the same list,
+    an add that's already there is skipped, so a crash between compacting and removing the journal doesn't duplicate vendors
+    """
+    # Each vendor entry is its UUID and when it was added, same as the rows in the Vendors table
+    added = {(entry.get("UUID"), entry.get("Initialized")) for entry in vendors}
+    for change in changes:
+        if change["op"] == "add":
+            key = (change["vendor"].get("UUID"), change["vendor"].get("Initialized"))
+            if key not in added:
+                added.add(key)
+                vendors.append(change["vendor"])
+        elif change["op"] == "update":
+            # Find the entry with the given UUID
+            for entry in vendors:
+                if entry["UUID"] == change["UUID"]:
+                    # Update the vendor name and/or pattern if provided
+                    if change.get("Vendor"):
+                        entry["Vendor"] = change["Vendor"]
+                    if change.get("Pattern"):
+                        entry["Pattern"] = change["Pattern"]
+                    break
+    return vendors
+
+
+def read_vendor_file(yml_file_path: str) -> list:
+    """Returns the full list of vendors, vendors.yml with the journal replayed on top"""
+    vendors = []
+    if os.path.exists(yml_file_path):
+        vendors = load_yaml(yml_file_path) or []
+    if not isinstance(vendors, list):
+        raise ValueError(f"Invalid data format: {yml_file_path} must be a list of vendor entries")
+    return apply_changes(vendors, read_journal(yml_file_path))
+
+
+def compact_vendor_file(yml_file_path: str) -> None:
+    """Folds the journal back into vendors.yml, then removes the journal"""
+    vendors = read_vendor_file(yml_file_path)
+    dump_yaml(vendors, yml_file_path)
+    if os.path.exists(journal_path(yml_file_path)):
+        os.remove(journal_path(yml_file_path))
+
+
+def vendor_file_hash(yml_file_path: str) -> str:
+    """
+    Hash of vendors.yml and its journal, without parsing either of them.
+    Used so load_vendors can tell if anything changed since the last time it ran
+    """
+    file_hash = hashlib.md5()
+    for path in (yml_file_path, journal_path(yml_file_path)):
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                file_hash.update(f.read())
+        file_hash.update(b"\0")
+    return file_hash.hexdigest()
@@ -0,0 +1,261 @@
+"""
+Projects where each budget category will end the month from what's been spent so far, so a hard_limit category
+that's heading over can be caught while there's still time to slow down, instead of in graph_three after the fact.
+
+A month's projection is what's been spent up to the day, plus what usually gets spent in the rest of the month,
+scaled by how fast this month is going next to the usual pace by that day. Rent on the 1st and a phone bill on the
+20th are in the usual shape of a month, so an early rent payment doesn't make the rest of the month look expensive.
+Without enough history the projection falls back to the plain burn rate, spent so far over the days gone by.
+
+The daily spending is kept as running totals, one for each month, vendor and split child's tag, in a .npz file
+next to the database, like budget_spend_curves.npz. Any day of any month is answered straight from those, and
+imports only sum the months they touched again. Delete the file any time, it gets rebuilt the next time it's needed.
+
+Example use:
+    projection.project_month(Salary=Salary, budget_plan="60/25/15_rule")
+    projection.project_month(Salary=Salary, budget_plan="60/25/15_rule", month="2022-07", day=12)
+"""
+import os
+import calendar
+import datetime
+import tempfile
+import warnings
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from backend import queries
+from backend import anomalies
+from backend import persistence
+from backend import database as db
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Each month's running totals have a slot for every day, the days after a short month's end hold its total
+month_days = 31
+# How far the month's pace can stretch or shrink the usual rest of the month
+min_pace = 0.5
+max_pace = 2.0
+
+
+def curves_path() -> str:
+    return f"{os.path.splitext(db.db_path)[0]}_spend_curves.npz"
+
+
+def read_curves() -> dict | None:
+    try:
+        with np.load(curves_path(), allow_pickle=False) as saved:
+            return {name: saved[name] for name in saved.files}
+    except (OSError, ValueError):
+        return None
+
+
+def write_curves(curves: dict) -> None:
+    # Written next to the old file and moved over it, so a half written file is never read
+    path = curves_path()
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".", suffix=".npz")
+    try:
+        with os.fdopen(fd, "wb") as curves_file:
+            np.savez(curves_file, **curves)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def add_months(curves: dict | None, rows: list, months: set) -> dict:
+    """
+    Returns curves with the running totals of the months swapped for ones built from rows, [Day, VendorUUID, Tag, Spend]
+    rows that cover those months. Months and vendor/tag keys that are new get added, the rest are copied over
+    """
+    old_months = list(curves["months"]) if curves is not None else []
+    old_keys = list(zip(curves["vendors"], curves["tags"])) if curves is not None else []
+    months = months | {row[0][:7] for row in rows}
+    all_months = sorted(set(old_months) | months)
+    month_positions = {month: position for position, month in enumerate(all_months)}
+
+    key_positions = {key: position for position, key in enumerate(old_keys)}
+    for row in rows:
+        key_positions.setdefault((row[1], row[2]), len(key_positions))
+    keys = list(key_positions)
+
+    cumulative = np.zeros((len(all_months), len(keys), month_days))
+    if old_months:
+        kept = [position for position, month in enumerate(old_months) if month not in months]
+        cumulative[[month_positions[old_months[position]] for position in kept], : len(old_keys)] = curves["cumulative"][kept]
+
+    # Spending by day for the swapped months, then running totals along the days
+    replaced = sorted(months)
+    replaced_positions = {month: position for position, month in enumerate(replaced)}
+    daily = np.zeros((len(replaced), len(keys), month_days))
+    if rows:
+        np.add.at(
+            daily,
+            (
+                [replaced_positions[row[0][:7]] for row in rows],
+                [key_positions[(row[1], row[2])] for row in rows],
+                [int(row[0][8:10]) - 1 for row in rows],
+            ),
+            [row[3] for row in rows],
+        )
+    cumulative[[month_positions[month] for month in replaced]] = np.cumsum(daily, axis=2)
+
+    return {
+        "months": np.array(all_months, dtype=str),
+        "vendors": np.array([key[0] for key in keys], dtype=str),
+        "tags": np.array([key[1] for key in keys], dtype=str),
+        "cumulative": cumulative,
+    }
+
+
+def update_spend_curves(full: bool = False) -> dict:
+    """
+    Brings the daily running totals up to date and returns them. Only the months with transactions, splits
+    or transfer pairs added since the last run are summed again, set full to True to sum every month.
+    Called by import_transactions after new transactions are saved
+    """
+    checked = anomalies.checked_ids()
+    curves = None if full else read_curves()
+    # Saved transactions changed vendor or lost their transfer pairs, start over
+    if curves is not None and int(curves.get("rewrite_version", -1)) != checked["rewrite_version"]:
+        curves = None
+    if curves is not None and all(int(curves[key]) == value for key, value in checked.items()):
+        return curves
+
+    if curves is None:
+        curves = add_months(None, anomalies.sum_spend(period_length=10), set())
+    else:
+        months = anomalies.touched_months({key: int(curves[key]) for key in checked})
+        curves = add_months(curves, anomalies.sum_spend(sorted(months), period_length=10), months)
+
+    curves.update({key: np.array(value) for key, value in checked.items()})
+    write_curves(curves)
+    return curves
+
+
+def category_curves(curves: dict, budget_plan: dict, months: list) -> tuple:
+    """
+    Adds the vendor/tag running totals of the months up into the plan's categories. Returns the category names and a
+    (month, day, category) array, months that aren't in the curves are all 0. Tags the plan doesn't have go under
+    "Failed to categorize", transfers are left out
+    """
+    from backend import graphs
+
+    tag_map = {vendor_uuid: queries.uuid_to_tag(vendor_uuid) for vendor_uuid in np.unique(curves["vendors"])}
+    # A split child keeps the tag it was given, everything else gets its vendor's newest tag
+    key_tags = [tag or tag_map[vendor_uuid] for vendor_uuid, tag in zip(curves["vendors"], curves["tags"])]
+
+    tag_categories = graphs.category_map(budget_plan)
+    categories = list(budget_plan) + ["Failed to categorize"]
+    membership = np.zeros((len(key_tags), len(categories)))
+    for position, tag in enumerate(key_tags):
+        if tag != "Internal Transfer":
+            membership[position, categories.index(tag_categories.get(tag, "Failed to categorize"))] = 1
+
+    # Only the months asked for are added up
+    saved_months = {month: position for position, month in enumerate(curves["months"])}
+    cumulative = np.zeros((len(months),) + curves["cumulative"].shape[1:])
+    found = [position for position, month in enumerate(months) if month in saved_months]
+    cumulative[found] = curves["cumulative"][[saved_months[months[position]] for position in found]]
+    return categories, np.einsum("mkd,kc->mdc", cumulative, membership)
+
+
+def project_month(
+    Salary: int,
+    budget_plan: str,
+    month: str | None = None,
+    day: int | None = None,
+    history: int = 6,
+    min_history: int = 3,
+    budget_plans_path: str = "budget_plans.yml",
+) -> "pd.DataFrame | None":
+    """
+    Projects each category's spending at the end of month (like "2022-07", the newest one by default) as of day,
+    which defaults to today for the current month and the last day with spending for any other. The usual shape of
+    a month comes from the median of the history months before it, and needs min_history of them.
+    Amounts are positive dollars spent, the monthly limit is the category's share of Salary over 12 like graph_three.
+    hard_limit categories projected over their limit are printed as a warning
+    """
+    import pandas as pd
+    from backend import graphs
+
+    budget_plans = persistence.load_yaml(budget_plans_path)
+    if budget_plan not in budget_plans:
+        print(f"{budget_plan} isn't in {budget_plans_path}")
+        return None
+    plan = budget_plans[budget_plan]
+
+    curves = update_spend_curves()
+    months = list(curves["months"])
+    if not months:
+        print("There's no spending to project from")
+        return None
+    month = month or months[-1]
+    year_number, month_number = (int(part) for part in month.split("-"))
+    days_in_month = calendar.monthrange(year_number, month_number)[1]
+
+    # The history months before this one, from the first month with spending. Months with none count as 0
+    history_months = pd.period_range(end=pd.Period(month, freq="M") - 1, periods=history, freq="M").strftime("%Y-%m")
+    history_months = [history_month for history_month in history_months if history_month >= months[0]]
+    categories, totals = category_curves(curves, plan, history_months + [month])
+    past, current = totals[:-1], totals[-1]
+
+    if day is None:
+        today = datetime.date.today()
+        if (today.year, today.month) == (year_number, month_number):
+            day = today.day
+        else:
+            # The last day the running total went up
+            spending_days = np.flatnonzero(np.diff(current.sum(axis=1), prepend=0) > 0)
+            day = int(spending_days[-1]) + 1 if spending_days.size else days_in_month
+    day = min(max(day, 1), days_in_month)
+
+    spent = current[day - 1]
+    burn_projection = spent / day * days_in_month
+    if len(history_months) >= min_history:
+        usual_by_today = np.median(past[:, day - 1], axis=0)
+        # What came after the day in each past month, scaled to the days this month has left so the 31st of
+        # a long month isn't still coming on the last day of a short one
+        past_days = np.array([calendar.monthrange(*(int(part) for part in past_month.split("-")))[1] for past_month in history_months])
+        days_left = np.maximum(past_days - day, 0)
+        left_share = np.divide(days_in_month - day, days_left, out=np.zeros(len(past_days)), where=days_left > 0)
+        usual_rest = np.median((past[:, -1] - past[:, day - 1]) * left_share[:, None], axis=0)
+        # Ahead of the usual pace means more of the same is coming, the pace is kept in bounds so one big purchase
+        # early in the month doesn't double everything after it
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            pace = np.where(usual_by_today > 0, np.clip(spent / usual_by_today, min_pace, max_pace), 1.0)
+        projected = spent + usual_rest * pace
+    else:
+        usual_by_today = np.full(len(categories), np.nan)
+        projected = burn_projection
+
+    max_spend = graphs.category_max_spend(plan, Salary)
+    limits = np.array([max_spend[category]["max spend"] / 12 if category in max_spend else np.nan for category in categories])
+    types = [plan[category].get("type") if category in plan else None for category in categories]
+    likely_over = np.array([category_type == "hard_limit" for category_type in types]) & (projected > limits)
+
+    projection_table = pd.DataFrame(
+        {
+            "Category": categories,
+            "Type": types,
+            "Spent": spent.round(2),
+            "Usual By Today": usual_by_today.round(2),
+            "Projected": projected.round(2),
+            "Burn Rate Projection": burn_projection.round(2),
+            "Monthly Limit": limits.round(2),
+            "Projected Left": (limits - projected).round(2),
+            "Likely Over": likely_over,
+        }
+    )
+    # Categories with nothing spent and nothing coming aren't worth a row, unless they have a limit
+    projection_table = projection_table[(projection_table["Projected"] > 0) | projection_table["Monthly Limit"].notna()]
+
+    if len(history_months) >= min_history:
+        print(f"Projecting {month} as of day {day} of {days_in_month}, from the {len(history_months)} months before it")
+    else:
+        print(f"Projecting {month} as of day {day} of {days_in_month} from the burn rate, there isn't enough history yet")
+    for _, row in projection_table[projection_table["Likely Over"]].iterrows():
+        print(f"{row['Category']} is on track to spend {row['Projected']} against its hard limit of {row['Monthly Limit']}")
+    return projection_table.reset_index(drop=True)
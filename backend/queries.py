@@ -1,7 +1,7 @@
 import re
 
-import pandas as pd
 from sqlalchemy import select
+from sqlalchemy import func
 
 from backend import database as db
 
@@ -15,8 +15,7 @@ def amount_check(rows: list, id: int) -> bool | str:
     with db.engine.connect() as conn:
         # Get the amount of the parent transaction
         parent_query_amount = (select(db.Transactions.Amount)).where(db.Transactions.id == id)
-        parent_amount = pd.read_sql(parent_query_amount, conn)
-        absolute_parent_amount = float(parent_amount["Amount"].values[0])
+        absolute_parent_amount = float(conn.execute(parent_query_amount).scalar())
 
         # Get the amounts of the child transactions from the given rows
         child_list_amounts = [float(row[0]) for row in rows]
@@ -46,8 +45,7 @@ def tag_check(rows: list) -> bool | str:
     with db.engine.connect() as conn:
         # Get the official list of tags from the Vendors table
         tags_query_tag = select(db.Vendors.Tag)
-        raw_tags_tag = pd.read_sql(tags_query_tag, conn)
-        tags_tag = raw_tags_tag["Tag"].to_list()
+        tags_tag = {row[0] for row in conn.execute(tags_query_tag)}
 
         # Get the tags from the given rows
         child_tags = [row[2] for row in rows]
@@ -62,11 +60,21 @@ def tag_check(rows: list) -> bool | str:
         return True
     
 
-def vendorizer(name: str) -> str:
+def vendor_table_version() -> str:
     """
-    Return the vendor UUID associated with the given expense name.
-    If no vendor is found, return "No Vendor Found".
-    This is used on import so that we can assign a vendor UUID based on what regex pattern we've assigned in the database
+    Cheap stamp that changes whenever a vendor is added to the Vendors table.
+    Used to know when results that depend on the vendors, like the budget plan checks, need to be redone
+    """
+    version_query = select(func.count(db.Vendors.id), func.max(db.Vendors.id), func.max(db.Vendors.Initialized))
+    with db.engine.connect() as conn:
+        count, max_id, last_initialized = conn.execute(version_query).fetchone()
+    return f"{count}-{max_id}-{last_initialized}"
+
+
+def vendor_patterns() -> list:
+    """
+    Return a list of (vendor UUID, compiled pattern) tuples in the order vendorizer tries them.
+    Load this once when you need to match a lot of names so the Vendors table isn't queried for every name
     """
     # Query the Vendors table for the vendor UUID and their corresponding patterns
     vendor_query = select(db.Vendors.UUID, db.Vendors.Pattern)
@@ -76,28 +84,38 @@ def vendorizer(name: str) -> str:
         # Fetch the results of the query as a list of tuples
         updated_vendor_list = conn.execute(vendor_query).fetchall()
 
-        # Convert the list of tuples to a dictionary
-        dict_vendor_pattern = {}
+    # Convert the list of tuples to a dictionary, a rebranded vendor keeps its spot but uses its newest pattern
+    dict_vendor_pattern = {}
 
-        # Iterate over the updated_vendor_list
-        for vendor in updated_vendor_list:
-            # Get the vendor UUID and pattern from the current element
-            vendor_uuid = vendor["UUID"]
-            vendor_pattern = vendor["Pattern"]
+    # Iterate over the updated_vendor_list
+    for vendor in updated_vendor_list:
+        # Add the vendor UUID and pattern to the dictionary
+        dict_vendor_pattern[vendor["UUID"]] = vendor["Pattern"]
 
-            # Add the vendor UUID and pattern to the dictionary
-            dict_vendor_pattern[vendor_uuid] = {
-                "Pattern": vendor_pattern,
-            }
+    return [(vendor_uuid, re.compile(pattern)) for vendor_uuid, pattern in dict_vendor_pattern.items()]
 
-        # Iterate over the dictionary
-        for vendor in dict_vendor_pattern:
-            # If the expense name matches the pattern of the current vendor, return the vendor UUID
-            if re.search(dict_vendor_pattern[vendor]["Pattern"], name):
-                return vendor
 
-        # If no vendor is found, return "No Vendor Found"
-        return "No Vendor Found"
+def match_vendor(name: str, patterns: list) -> str:
+    """
+    Return the UUID of the first vendor in patterns (from vendor_patterns) that matches the given expense name.
+    If no vendor is found, return "No Vendor Found".
+    """
+    for vendor_uuid, pattern in patterns:
+        # If the expense name matches the pattern of the current vendor, return the vendor UUID
+        if pattern.search(name):
+            return vendor_uuid
+
+    # If no vendor is found, return "No Vendor Found"
+    return "No Vendor Found"
+
+
+def vendorizer(name: str) -> str:
+    """
+    Return the vendor UUID associated with the given expense name.
+    If no vendor is found, return "No Vendor Found".
+    This is used on import so that we can assign a vendor UUID based on what regex pattern we've assigned in the database
+    """
+    return match_vendor(name, vendor_patterns())
     
 
 def uuid_to_tag(UUID: str) -> str:
@@ -175,4 +193,47 @@ def vendor_to_uuid(vendor: str) -> str:
         if not result:
             return "Vendor did not match to any in database"
         else:
-            return result
\ No newline at end of file
+            return result
+
+# Every vendor's newest name and tag, for joining onto ledger_query's rows as v
+latest_vendors_query = """
+    SELECT UUID, Vendor, Tag FROM (
+        SELECT UUID, Vendor, Tag, ROW_NUMBER() OVER (PARTITION BY UUID ORDER BY Initialized DESC) AS newest
+        FROM Vendors
+    )
+    WHERE newest = 1
+"""
+
+# The ledger everything that adds up spending counts from, the graphs, pt_one, the export, anomalies, recurring charges
+# and projections. Split parents are swapped for their children, and Tag is the tag a child was given, NULL for
+# everything else. Transfer is 1 for both sides of a transfer between accounts
+ledger_rows_query = """
+    SELECT t.id, NULL AS Parent_id, t.Date, t."Transaction", t.Name, t.Memo, t.Amount, t.VendorUUID, NULL AS Tag,
+        t.Source, EXISTS (SELECT 1 FROM "Transfer Pairs" p WHERE p.Debit_id = t.id OR p.Credit_id = t.id) AS Transfer
+    FROM "{transactions_table}" t
+    WHERE t."Has Child" IS NULL {transaction_filter}
+    UNION ALL
+    SELECT c.id, c.Parent_id, c.Date, c."Transaction", c.Name, c.Memo, c.Amount, c.VendorUUID, NULLIF(c.Tag, ''),
+        p.Source, 0
+    FROM "{children_table}" c
+    LEFT JOIN "{transactions_table}" p ON p.id = c.Parent_id
+    WHERE 1 = 1 {child_filter}
+"""
+
+# A ledger row's tag, with the row as l and its vendor from latest_vendors_query as v. Transfers are always
+# "Internal Transfer", a split child keeps the tag it was given, everything else gets its vendor's newest tag
+ledger_tag = "CASE WHEN l.Transfer THEN 'Internal Transfer' ELSE COALESCE(l.Tag, v.Tag, 'No Vendor Found') END"
+
+
+def ledger_query(transactions_table: str, children_table: str, row_filter: str = "") -> str:
+    """
+    Returns ledger_rows_query for the given tables, like the ones archive.attach_archives returns.
+    row_filter is added to both halves with {row} standing in for the table, like "AND {row}.Date >= :start",
+    so the Date index is still used
+    """
+    return ledger_rows_query.format(
+        transactions_table=transactions_table,
+        children_table=children_table,
+        transaction_filter=row_filter.format(row="t"),
+        child_filter=row_filter.format(row="c"),
+    )
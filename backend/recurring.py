@@ -0,0 +1,303 @@
+"""
+Finds subscriptions and recurring bills in the whole history: how much, how often, when the last charge was,
+when the next one should be, and when the price changed.
+
+Charges are grouped by their cleaned up Name (see suggest.normalize_name), so store numbers and cities don't split
+a series. Each group is checked for a weekly, biweekly, monthly, quarterly or yearly rhythm. If a group mixes a
+subscription with one off purchases, like Amazon Prime and Amazon orders, it's split by amount and each part is checked.
+
+Results are cached in the Data State table, and after an import only the groups with new charges are redone.
+Splitting a charge redoes its group, and moving saved charges to another vendor redoes everything.
+
+Example use:
+    recurring.recurring_charges()
+    graphs.graph_recurring(width=1200, height=500)
+"""
+import json
+import datetime
+from collections import defaultdict
+from typing import TYPE_CHECKING
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy import select
+from sqlalchemy import bindparam
+from sqlalchemy import func
+
+from backend import archive
+from backend import database as db
+from backend import queries
+from backend import anomalies
+from backend import suggest
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# How many names go in one query, older SQLite builds only allow 999 bound variables in a statement and the names
+# are bound twice, once for each half of the ledger
+names_per_query = 400
+
+# Cadence name to (days between charges, how many days off a charge can be)
+cadences = {
+    "Weekly": (7.0, 2.0),
+    "Biweekly": (14.0, 3.0),
+    "Monthly": (30.4, 4.0),
+    "Quarterly": (91.3, 10.0),
+    "Yearly": (365.2, 20.0),
+}
+
+
+def find_cadence(intervals: np.ndarray) -> str | None:
+    median_interval = np.median(intervals)
+    for cadence, (period, tolerance) in cadences.items():
+        if abs(median_interval - period) <= tolerance:
+            return cadence
+    return None
+
+
+def detect_series(
+    days: np.ndarray, amounts: np.ndarray, amount_tolerance: float = 0.2, regularity: float = 0.75, extra_charges: int = 0
+) -> dict | None:
+    """
+    Checks if charges (days as ordinals and amounts, sorted by day) happen on a rhythm.
+    Most of the gaps between charges have to be within the cadence's tolerance, and most charges have to be
+    within amount_tolerance of the one before. extra_charges raises how many charges it takes to count.
+    Returns the series details, or None if it isn't recurring
+    """
+    if len(days) < 2:
+        return None
+    intervals = np.diff(days)
+    cadence = find_cadence(intervals)
+    if cadence is None:
+        return None
+    period, tolerance = cadences[cadence]
+    # Two yearly charges are enough, anything more often needs three
+    if len(days) < (2 if cadence == "Yearly" else 3) + extra_charges:
+        return None
+    if np.mean(np.abs(intervals - period) <= tolerance) < regularity:
+        return None
+
+    amount_steps = np.abs(np.diff(amounts)) / np.maximum(np.abs(amounts[:-1]), 0.01)
+    if np.mean(amount_steps <= amount_tolerance) < regularity:
+        return None
+
+    # A price change is a new amount that sticks, a one off bump that goes back to the old amount isn't one
+    cents = np.round(amounts * 100)
+    changed = np.concatenate([[False], cents[1:] != cents[:-1]])
+    sticks = np.concatenate([cents[1:] == cents[:-1], [True]])
+    returns = np.concatenate([[False, False], cents[2:] == cents[:-2]])
+    changes = np.flatnonzero(changed & sticks & ~returns)
+    return {
+        "Cadence": cadence,
+        "Period Days": period,
+        "Charges": int(len(days)),
+        "Amount": round(float(amounts[-1]), 2),
+        "Average Amount": round(float(np.mean(amounts)), 2),
+        "First Charge": datetime.date.fromordinal(int(days[0])).isoformat(),
+        "Last Charge": datetime.date.fromordinal(int(days[-1])).isoformat(),
+        "Next Expected": datetime.date.fromordinal(int(round(days[-1] + period))).isoformat(),
+        "Price Changes": [
+            f"{datetime.date.fromordinal(int(days[i])).isoformat()}: {round(float(amounts[i - 1]), 2)} -> {round(float(amounts[i]), 2)}"
+            for i in changes
+        ],
+        "Annual Cost": round(float(amounts[-1]) * 365.2 / period, 2),
+    }
+
+
+def split_by_amount(amounts: np.ndarray, amount_tolerance: float) -> list:
+    """
+    Returns index arrays of the charges to try as their own series. Every amount charged more than once is one,
+    since a subscription hidden in a busy group usually charges the exact same amount. Then the sorted amounts are
+    cut wherever the next one is more than amount_tolerance away, for bills that change a little every time
+    """
+    cents = np.round(amounts * 100)
+    values, counts = np.unique(cents, return_counts=True)
+    parts = [np.flatnonzero(cents == value) for value in values[counts > 1]]
+
+    order = np.argsort(amounts, kind="stable")
+    sorted_amounts = amounts[order]
+    gaps = np.abs(np.diff(sorted_amounts)) / np.maximum(np.abs(sorted_amounts[:-1]), 0.01)
+    cuts = np.flatnonzero(gaps > amount_tolerance) + 1
+    exact_parts = {part.tobytes() for part in parts}
+    parts += [part for part in (np.sort(part) for part in np.split(order, cuts)) if part.tobytes() not in exact_parts]
+    return parts
+
+
+def detect_group(days: np.ndarray, amounts: np.ndarray, amount_tolerance: float = 0.2) -> list:
+    """
+    Returns every recurring series in one group of charges sorted by day. The whole group is tried first,
+    then each amount range on its own. Amount ranges with the same cadence that follow each other, like a
+    subscription before and after a big price increase, are joined back into one series
+    """
+    series = detect_series(days, amounts, amount_tolerance)
+    if series is not None:
+        return [series]
+
+    parts = []
+    claimed = set()
+    # Bigger parts first, so a bill found as a whole amount range isn't found again as one of its exact amounts
+    for part in sorted(split_by_amount(amounts, amount_tolerance), key=len, reverse=True):
+        if claimed.intersection(part.tolist()):
+            continue
+        # Lots of one off purchases will land on the same amount now and then, so parts need an extra charge to count
+        part_series = detect_series(days[part], amounts[part], amount_tolerance, extra_charges=1)
+        if part_series is not None:
+            parts.append((part, part_series))
+            claimed.update(part.tolist())
+
+    # Join a part onto the one before when it picks up about where that one stopped
+    parts.sort(key=lambda item: days[item[0][0]])
+    joined = []
+    for part, part_series in parts:
+        if joined:
+            last_part, last_series = joined[-1]
+            period, tolerance = cadences[part_series["Cadence"]]
+            gap = days[part[0]] - days[last_part[-1]]
+            if last_series["Cadence"] == part_series["Cadence"] and period - tolerance <= gap <= period * 1.5:
+                combined = np.concatenate([last_part, part])
+                # Past amount_tolerance on purpose, the jump between the parts is the price change
+                combined_series = detect_series(days[combined], amounts[combined], amount_tolerance=np.inf)
+                if combined_series is not None:
+                    joined[-1] = (combined, combined_series)
+                    continue
+        joined.append((part, part_series))
+    return [part_series for _, part_series in joined]
+
+
+def load_charges(keys: set | None = None) -> dict:
+    """
+    Returns the expense charges grouped by cleaned up Name, as key to a list of (day, amount, Name, VendorUUID).
+    Pass keys to only load those groups. Charges come from the same ledger as the graphs, split parents are swapped
+    for their children, and transfers between accounts are left out.
+    Archived years are read too, a series doesn't lose its history when its early years are archived
+    """
+    with db.engine.connect() as conn:
+        transactions_table, children_table = archive.attach_archives(conn)
+        charge_query = """
+            SELECT l.id, l.Date, l.Amount, l.Name, l.VendorUUID FROM ({ledger}) l
+            WHERE l.Amount < 0 AND NOT l.Transfer
+            """
+        if keys is None:
+            ledger = queries.ledger_query(transactions_table, children_table)
+            rows = conn.execute(text(f"{charge_query.format(ledger=ledger)} ORDER BY l.Date, l.id")).fetchall()
+        else:
+            # Find the raw names behind the keys from the distinct names, which the Name index makes quick
+            name_query = text(f'SELECT DISTINCT Name FROM "{transactions_table}"')
+            all_names = [row[0] for row in conn.execute(name_query) if row[0] is not None]
+            names = [name for name in all_names if " ".join(suggest.normalize_name(name)) in keys]
+            ledger = queries.ledger_query(transactions_table, children_table, "AND {row}.Name IN :names")
+            name_query = text(charge_query.format(ledger=ledger)).bindparams(bindparam("names", expanding=True))
+            rows = []
+            for start in range(0, len(names), names_per_query):
+                rows.extend(conn.execute(name_query, {"names": names[start : start + names_per_query]}))
+            # A group's names can be spread over the batches, put its charges back in order
+            rows.sort(key=lambda row: (row[1], row[0]))
+
+        groups = defaultdict(list)
+        for transaction_id, date, amount, name, vendor_uuid in rows:
+            key = " ".join(suggest.normalize_name(name))
+            day = datetime.date.fromisoformat(date[:10]).toordinal()
+            groups[key].append((day, -amount, name, vendor_uuid))
+    return groups
+
+
+def detect_groups(groups: dict, amount_tolerance: float) -> dict:
+    # Key to the list of series found in that group, with the name and vendor of its latest charge
+    results = {}
+    for key, charges in groups.items():
+        days = np.array([charge[0] for charge in charges], dtype=float)
+        amounts = np.array([charge[1] for charge in charges], dtype=float)
+        found = detect_group(days, amounts, amount_tolerance)
+        for series in found:
+            series["Name"] = charges[-1][2]
+            series["VendorUUID"] = charges[-1][3]
+        results[key] = found
+    return results
+
+
+def update_recurring(amount_tolerance: float = 0.2, full: bool = False) -> dict:
+    """
+    Brings the cached recurring series up to date and returns them as key to list of series.
+    Only the groups with charges imported, split or newly paired as transfers since the last run are redone,
+    set full to True to redo every group. Revendorizing or unpairing transfers redoes every group
+    """
+    checked = anomalies.checked_ids()
+    cached = db.get_state("recurring_charges")
+    cached = json.loads(cached) if cached is not None else None
+    if (
+        full
+        or cached is None
+        or cached["amount_tolerance"] != amount_tolerance
+        # Saved charges moved to another vendor or lost their transfer pairs, which the ids can't point to
+        or cached.get("rewrite_version") != checked["rewrite_version"]
+    ):
+        results = detect_groups(load_charges(), amount_tolerance)
+    elif all(cached.get(key) == value for key, value in checked.items()):
+        return cached["series"]
+    else:
+        # The groups the new charges, new splits and new transfer pairs belong to
+        transactions = db.Transactions
+        with db.engine.connect() as conn:
+            touched_names = {
+                row[0] for row in conn.execute(select(transactions.Name).where(transactions.id > cached["checked_id"]))
+            }
+            pair_query = select(db.TransferPairs.Debit_id, db.TransferPairs.Credit_id).where(
+                db.TransferPairs.id > cached["checked_pair_id"]
+            )
+            pair_ids = [transaction_id for pair in conn.execute(pair_query) for transaction_id in pair]
+            # A split parent drops out of its group, its children aren't charges of their own
+            parent_query = select(db.ChildTransactions.Parent_id).where(
+                db.ChildTransactions.id > cached.get("checked_child_id", 0)
+            )
+            pair_ids += [row[0] for row in conn.execute(parent_query)]
+            if pair_ids:
+                touched_names |= {
+                    row[0] for row in conn.execute(select(transactions.Name).where(transactions.id.in_(pair_ids)))
+                }
+        touched_keys = {" ".join(suggest.normalize_name(name)) for name in touched_names}
+        results = {key: series for key, series in cached["series"].items() if key not in touched_keys}
+        results.update(detect_groups(load_charges(touched_keys), amount_tolerance))
+
+    # Groups with nothing recurring aren't worth keeping
+    results = {key: series for key, series in results.items() if series}
+    db.set_state(
+        "recurring_charges",
+        json.dumps(dict(checked, amount_tolerance=amount_tolerance, series=results)),
+    )
+    return results
+
+
+def recurring_charges(active_only: bool = False, amount_tolerance: float = 0.2, full: bool = False) -> "pd.DataFrame | None":
+    """
+    Returns every recurring series as a DataFrame, one row per series with its Vendor, Cadence, latest Amount
+    (positive), Last Charge, Next Expected charge, Price Changes and Annual Cost, most expensive first.
+    A series is Active if its next charge isn't overdue compared to the newest transaction in the ledger,
+    set active_only to True to leave the cancelled ones out
+    """
+    import pandas as pd
+
+    results = update_recurring(amount_tolerance, full)
+    rows = [dict(series, Series=key) for key, key_series in results.items() for series in key_series]
+    if not rows:
+        print("No recurring charges found")
+        return None
+
+    recurring_table = pd.DataFrame(rows)
+    vendor_map = {vendor_uuid: queries.uuid_to_vendor(vendor_uuid) for vendor_uuid in recurring_table["VendorUUID"].unique()}
+    recurring_table["Vendor"] = recurring_table["VendorUUID"].map(vendor_map)
+
+    # Overdue by more than the cadence's tolerance means it probably got cancelled
+    with db.engine.connect() as conn:
+        newest_date = conn.execute(select(func.max(db.Transactions.Date))).scalar()
+    newest_day = datetime.date.fromisoformat(newest_date[:10]).toordinal()
+    grace_days = recurring_table["Cadence"].map(lambda cadence: cadences[cadence][1])
+    next_days = recurring_table["Next Expected"].map(lambda date: datetime.date.fromisoformat(date).toordinal())
+    recurring_table["Active"] = next_days + grace_days >= newest_day
+    if active_only:
+        recurring_table = recurring_table[recurring_table["Active"]]
+
+    columns = [
+        "Series", "Vendor", "Name", "Cadence", "Amount", "Average Amount", "Charges", "First Charge", "Last Charge",
+        "Next Expected", "Active", "Price Changes", "Annual Cost", "VendorUUID",
+    ]
+    return recurring_table[columns].sort_values(by="Annual Cost", ascending=False).reset_index(drop=True)
@@ -0,0 +1,159 @@
+"""
+Runs the graphs and pivot tables of a check-in together. Calling graph_one through graph_five and pt_one one after
+another filters tran_table, looks up vendor names and groups the same rows again for every one of them. Here the
+expenses from the start of the period are filtered and given their vendor names once, and every view is worked out
+from that much smaller table.
+
+Example use:
+    reports.check_in(reports.periodic_views, filter_year="2023", filter_month="02", budget_plan="60/25/15_rule", Salary=Salary)
+    results = reports.run_reports(["graph_four", "graph_five"], filter_year="2022", filter_month="01", invert=True)
+    results["graph_four"]["data"]
+"""
+import io
+import contextlib
+
+import yaml
+import pandas as pd
+
+from backend import graphs
+
+all_views = ("graph_one", "graph_two", "graph_three", "graph_four", "graph_five", "pt_one")
+# What the notebook's "Periodic Check-in" and "Yearly Check-in" sections look at
+periodic_views = ("graph_one", "graph_two", "graph_three", "pt_one")
+yearly_views = ("graph_four", "graph_five")
+
+
+# The columns any of the views use, the rest aren't copied into the base
+base_columns = ["id", "Date", "Name", "Amount", "VendorUUID", "Tag", "Year", "Month", "Quarter"]
+
+
+def expense_base(table: pd.DataFrame, start: pd.Timestamp) -> pd.DataFrame:
+    """The expenses from start on that every graph view starts from, with their vendor names looked up once"""
+    tran_table_filter = graphs.expense_filter(table, start.strftime("%Y-%m-%d"))
+    return graphs.add_vendor_names(table.loc[tran_table_filter, base_columns])
+
+
+def pt_one_data(base: pd.DataFrame, filter_tag: str, filter_month: str, head: int | None = 15) -> pd.DataFrame | None:
+    """Same rows and shape as graphs.pt_one, from a base that covers filter_month"""
+    month_rows = base[(base["Month"] == filter_month) & (base["Tag"] == filter_tag)]
+    if month_rows.empty:
+        return None
+    month_rows = month_rows.sort_values(by=["Amount", "Vendor", "Name", "id"])
+    if head is not None:
+        month_rows = month_rows.head(head)
+    return month_rows[["Vendor", "Name", "id", "Date", "Amount", "Year"]].set_index(["Vendor", "Name", "id", "Date"])
+
+
+def run_reports(
+    views: list | tuple,
+    filter_year: str,
+    filter_month: str,
+    group_by: str = "Month",
+    budget_plan: str | None = None,
+    Salary: int | None = None,
+    filter_tag: str = "Vendor w/o default Tag",
+    pt_month: str | None = None,
+    head: int | None = 15,
+    invert: bool = False,
+    top: int | None = 15,
+    width: int = 1200,
+    height: int = 500,
+    figures: bool = True,
+    table: pd.DataFrame | None = None,
+) -> dict:
+    """
+    Works out each of the views (names from reports.all_views) for the period starting at filter_year and filter_month
+    and returns a dictionary of view name to its results, {"graph_one": {"data": ..., "figure": ...}, ...}.
+    graph_three also has "transactions" and the "summary" it would have printed, and needs budget_plan and Salary.
+    pt_one looks at filter_tag in pt_month, which defaults to the period's first month.
+    Views with nothing to show get None for their data. Set figures to False to skip drawing
+    """
+    unknown = [view for view in views if view not in all_views]
+    if unknown:
+        print(f"Unknown views: {', '.join(unknown)}. Pick from {', '.join(all_views)}")
+        return {}
+
+    start = pd.Timestamp(year=int(filter_year), month=int(filter_month), day=1)
+    # Filtered and vendor named once, everything below works off this
+    if table is None:
+        table = graphs.get_tran_table(base_columns)
+    base = expense_base(table, start)
+
+    results = {}
+    if "graph_one" in views:
+        data = graphs.graph_one_data(group_by, filter_year, filter_month, invert, table=base)
+        results["graph_one"] = {"data": data}
+        if figures and data is not None:
+            results["graph_one"]["figure"] = graphs.graph_one_figure(data, group_by, width, height)
+
+    if "graph_two" in views:
+        data = graphs.graph_two_data(group_by, filter_year, filter_month, invert, top, table=base)
+        results["graph_two"] = {"data": data}
+        if figures and data is not None:
+            results["graph_two"]["figure"] = graphs.graph_two_figure(data, group_by, width, height)
+
+    if "graph_three" in views:
+        if budget_plan is None or Salary is None:
+            print("graph_three needs a budget_plan and Salary, skipping it")
+        else:
+            with open("budget_plans.yml", "r") as budp:
+                budget_plans = yaml.safe_load(budp)
+            three_data = graphs.graph_three_data(filter_year, filter_month, budget_plan, budget_plans, table=base)
+            results["graph_three"] = {"data": None}
+            if three_data is not None:
+                # Keep what graph_three prints, check_in prints it above the figure
+                summary = io.StringIO()
+                with contextlib.redirect_stdout(summary):
+                    graphs.graph_three_summary(three_data, budget_plans, budget_plan, Salary)
+                results["graph_three"] = {
+                    "data": three_data[1],
+                    "transactions": three_data[0],
+                    "summary": summary.getvalue(),
+                }
+                if figures:
+                    results["graph_three"]["figure"] = graphs.graph_three_figure(
+                        three_data[1], budget_plan, width, height, invert
+                    )
+
+    if "graph_four" in views:
+        data = graphs.graph_four_data(filter_year, filter_month, invert, top, table=base)
+        results["graph_four"] = {"data": data}
+        if figures and data is not None:
+            results["graph_four"]["figure"] = graphs.graph_four_figure(data, width, height)
+
+    if "graph_five" in views:
+        data = graphs.graph_five_data(filter_year, filter_month, invert, top, table=base)
+        results["graph_five"] = {"data": data}
+        if figures and data is not None:
+            results["graph_five"]["figure"] = graphs.graph_five_figure(data, width, height)
+
+    if "pt_one" in views:
+        pt_month = pt_month or start.strftime("%Y-%m")
+        if filter_tag == "Internal Transfer" or pd.Timestamp(f"{pt_month}-01") < start:
+            # The base doesn't have these rows, the query in pt_one is quick anyway
+            with contextlib.redirect_stdout(io.StringIO()):
+                results["pt_one"] = {"data": graphs.pt_one(filter_tag, pt_month, head)}
+        else:
+            results["pt_one"] = {"data": pt_one_data(base, filter_tag, pt_month, head)}
+
+    return results
+
+
+def check_in(views: list | tuple = all_views, **kwargs) -> dict:
+    """
+    Runs run_reports and shows everything in order, the way calling each graph function would.
+    Takes the same arguments as run_reports, and returns its results so the tables can still be looked at
+    """
+    results = run_reports(views, **kwargs)
+    for view, result in results.items():
+        print(f"{view}:")
+        if result["data"] is None:
+            print("The dataframe is empty. Nothing to show")
+            continue
+        if "summary" in result:
+            print(result["summary"], end="")
+        if "figure" in result:
+            result["figure"].show()
+        else:
+            print(result["data"].to_string())
+    return results
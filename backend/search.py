@@ -0,0 +1,121 @@
+"""
+Full text search over transaction names and memos, for finding "all the transactions that look like X"
+when writing a new vendor pattern, and for trying a pattern out before add_vendor saves it.
+
+Example use:
+    search.search("amazon prime")
+    search.preview_pattern("^AMZN|AMAZON")
+"""
+import re
+
+import pandas as pd
+from sqlalchemy import text
+
+from backend import checks
+from backend import queries
+from backend import database as db
+
+search_query = text(
+    f"""
+    SELECT
+        s.rowid AS "Search id",
+        CASE WHEN s.rowid > 0 THEN 'Transactions' ELSE 'Child Transactions' END AS "Table",
+        COALESCE(t.id, c.id) AS id,
+        COALESCE(t.Date, c.Date) AS Date,
+        COALESCE(t.Name, c.Name) AS Name,
+        COALESCE(t.Memo, c.Memo) AS Memo,
+        COALESCE(t.Amount, c.Amount) AS Amount,
+        COALESCE(t.VendorUUID, c.VendorUUID) AS VendorUUID,
+        bm25("{db.search_table}") AS Rank
+    FROM "{db.search_table}" s
+    LEFT JOIN Transactions t ON s.rowid > 0 AND t.id = s.rowid
+    LEFT JOIN "Child Transactions" c ON s.rowid < 0 AND c.id = -s.rowid
+    WHERE "{db.search_table}" MATCH :query
+    ORDER BY Rank
+    LIMIT :limit
+    """
+)
+
+# Distinct names are grouped first so the regex only runs once per name, not once per transaction
+preview_query = text(
+    """
+    SELECT Name, VendorUUID, Transactions, Amount, "First Date", "Last Date"
+    FROM (
+        SELECT Name, VendorUUID, COUNT(*) AS Transactions, SUM(Amount) AS Amount,
+               MIN(Date) AS "First Date", MAX(Date) AS "Last Date"
+        FROM Transactions
+        GROUP BY Name, VendorUUID
+    )
+    WHERE Name REGEXP :pattern
+    ORDER BY Amount
+    """
+)
+
+
+def to_match_query(query: str) -> str:
+    """
+    Turns plain words into an FTS5 query where every word has to show up, matching on the start of words,
+    so "amazon prime" finds "AMAZON PRIME*MK12". Punctuation that FTS5 would choke on is dropped
+    """
+    words = re.findall(r"\w+", query)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def add_vendor_names(table: pd.DataFrame) -> pd.DataFrame:
+    # Look up each vendor once, instead of once per row
+    vendor_map = {vendor_uuid: queries.uuid_to_vendor(vendor_uuid) for vendor_uuid in table["VendorUUID"].unique()}
+    table["Vendor"] = table["VendorUUID"].map(vendor_map)
+    return table
+
+
+def search(query: str, limit: int = 50, raw: bool = False) -> pd.DataFrame | None:
+    """
+    Returns the transactions whose Name or Memo best match the query, best match first, with their amounts and current vendor.
+    Plain words are used by default, set raw to True to use FTS5 query syntax directly, like 'uber NOT eats'
+    """
+    match_query = query if raw else to_match_query(query)
+    if not match_query:
+        print("Nothing to search for")
+        return None
+
+    with db.engine.connect() as conn:
+        results = pd.read_sql(search_query, conn, params={"query": match_query, "limit": limit})
+
+    if results.empty:
+        print(f"No transactions look like {query}")
+        return None
+
+    return add_vendor_names(results)
+
+
+def preview_pattern(pattern: str) -> pd.DataFrame | None:
+    """
+    Try a vendor pattern out before add_vendor saves it. Shows every distinct name the pattern matches with how many
+    transactions and how much money that is, and whether the name would move to the new vendor. Only "No Vendor Found"
+    names would move, ones that already have a vendor keep it since that vendor's pattern is tried first
+    """
+    pattern_ok = checks.pattern_check(pattern)
+    if pattern_ok != True:
+        print(pattern_ok)
+        return None
+    regex = re.compile(pattern)
+
+    with db.engine.connect() as conn:
+        # SQLite doesn't come with a REGEXP function, so give it python's
+        conn.connection.create_function(
+            "REGEXP", 2, lambda value, item: item is not None and regex.search(item) is not None, deterministic=True
+        )
+        results = pd.read_sql(preview_query, conn, params={"pattern": pattern})
+
+    if results.empty:
+        print(f"{pattern} doesn't match any transactions")
+        return None
+
+    results = add_vendor_names(results)
+    results["Would Change"] = results["VendorUUID"] == "No Vendor Found"
+    changing = results[results["Would Change"]]
+    print(
+        f"{pattern} would capture {changing['Transactions'].sum()} unmatched transactions across {len(changing)} names, "
+        f"totaling {round(changing['Amount'].sum(), 2)}. {(~results['Would Change']).sum()} matching names already have a vendor"
+    )
+    return results.sort_values(by=["Would Change", "Amount"], ascending=[False, True])
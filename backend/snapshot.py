@@ -0,0 +1,127 @@
+"""
+Keeps a copy of the graphs' tran_table on disk as one NumPy .npy file per column, so opening the notebook doesn't
+have to rebuild it from SQLite. The files are memory mapped when loaded, so only the columns a graph asks for are read,
+and the numbers and dates are copied out of the map so the graphs can change them like any other DataFrame.
+
+Text columns are saved as integer codes plus the list of distinct values. The snapshot is stamped with the data
+version and the Vendors table version it was built from, and is never used once either has moved on.
+
+It lives in a folder next to the database, like budget_snapshot/, and is rewritten after imports and revendorize_all.
+Smaller writes leave it stale until the graphs next need it. Delete the folder any time, it gets rebuilt then too.
+"""
+import os
+import json
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from backend import database as db
+from backend import queries
+
+
+def snapshot_folder() -> str:
+    return f"{os.path.splitext(db.db_path)[0]}_snapshot"
+
+
+def current_stamp() -> str:
+    # Tags come from the vendors, so a vendor's tag changing makes the snapshot stale too
+    return f"{db.data_version()}:{queries.vendor_table_version()}"
+
+
+def read_meta() -> dict | None:
+    try:
+        with open(os.path.join(snapshot_folder(), "meta.json")) as meta_file:
+            return json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(tran_table: pd.DataFrame, stamp: str) -> None:
+    """
+    Saves each column of tran_table as its own .npy file. Everything is written to a new folder
+    that replaces the old one at the end, so a half written snapshot is never read
+    """
+    folder = snapshot_folder()
+    parent = os.path.dirname(os.path.abspath(folder))
+    new_folder = tempfile.mkdtemp(prefix=".snapshot_", dir=parent)
+
+    columns = []
+    for position, column in enumerate(tran_table.columns):
+        values = tran_table[column]
+        file_name = f"{position}.npy"
+        if pd.api.types.is_datetime64_dtype(values):
+            kind = "datetime"
+            np.save(os.path.join(new_folder, file_name), values.to_numpy().view("int64"))
+        elif values.dtype == object:
+            # Codes plus the distinct values, missing values get the code -1
+            kind = "text"
+            # Factorizing the array rather than the Series skips building an Index, which warns on mixed columns
+            codes, categories = pd.factorize(values.to_numpy())
+            np.save(os.path.join(new_folder, file_name), codes.astype(np.int32))
+            with open(os.path.join(new_folder, f"{position}.json"), "w") as categories_file:
+                json.dump(categories.tolist(), categories_file)
+        else:
+            kind = "number"
+            np.save(os.path.join(new_folder, file_name), values.to_numpy())
+        columns.append({"name": column, "kind": kind, "file": file_name})
+
+    with open(os.path.join(new_folder, "meta.json"), "w") as meta_file:
+        json.dump({"stamp": stamp, "rows": len(tran_table), "columns": columns}, meta_file)
+
+    # Swap the new folder in, then clean up the old one
+    old_folder = None
+    if os.path.exists(folder):
+        old_folder = tempfile.mkdtemp(prefix=".snapshot_old_", dir=parent)
+        os.replace(folder, os.path.join(old_folder, "snapshot"))
+    os.replace(new_folder, folder)
+    if old_folder is not None:
+        shutil.rmtree(old_folder, ignore_errors=True)
+
+
+def load_snapshot(columns: list | None = None) -> pd.DataFrame | None:
+    """
+    Returns the snapshot as a DataFrame, or None if there isn't one or it's out of date.
+    Pass columns to only read those, the other files aren't touched. Number and date columns are copies,
+    a memory mapped column is read only and setting values on it would raise
+    """
+    meta = read_meta()
+    if meta is None or meta["stamp"] != current_stamp():
+        return None
+
+    folder = snapshot_folder()
+    data = {}
+    try:
+        for column in meta["columns"]:
+            if columns is not None and column["name"] not in columns:
+                continue
+            values = np.load(os.path.join(folder, column["file"]), mmap_mode="r")
+            if column["kind"] == "datetime":
+                data[column["name"]] = np.array(values.view("datetime64[ns]"))
+            elif column["kind"] == "text":
+                with open(os.path.join(folder, column["file"].replace(".npy", ".json"))) as categories_file:
+                    categories = np.array(json.load(categories_file) + [None], dtype=object)
+                # Code -1 picks the None on the end
+                data[column["name"]] = categories.take(values)
+            else:
+                data[column["name"]] = np.array(values)
+    except (OSError, ValueError):
+        return None
+    return pd.DataFrame(data, copy=False)
+
+
+def update_snapshot() -> bool:
+    """
+    Rebuilds the snapshot if the transactions or vendors changed since it was written.
+    Called after imports and revendorize_all, returns True if it had to rebuild
+    """
+    stamp = current_stamp()
+    meta = read_meta()
+    if meta is not None and meta["stamp"] == stamp:
+        return False
+
+    from backend import graphs
+
+    write_snapshot(graphs.build_tran_table(), stamp)
+    return True
@@ -0,0 +1,208 @@
+"""
+Suggests vendors for the "No Vendor Found" transactions, so figuring out what's normal doesn't mean writing
+patterns one name at a time. Names are cleaned up (store numbers, dates, states), grouped with names that start
+the same way, and each group gets a vendor name, an anchored pattern and how much money it would cover.
+
+Example use:
+    suggest.suggest_vendors().head(20)
+    search.preview_pattern("^BLUE BOTTLE")  # then add_vendor if it looks right
+"""
+import os
+import re
+from collections import Counter
+from collections import defaultdict
+from typing import TYPE_CHECKING
+
+from sqlalchemy import text
+
+from backend import archive
+from backend import checks
+from backend import database as db
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Payment processors and card terminals put these in front of the real store name
+name_prefixes = {"SQ", "TST", "SP", "PP", "PAYPAL", "POS", "DEBIT", "PURCHASE", "CHECKCARD", "ACH", "THE"}
+
+# A state at the end of a name is almost always "CITY ST", which splits one store into many names
+state_codes = set(
+    "AL AK AZ AR CA CO CT DE FL GA HI ID IL IN IA KS KY LA ME MD MA MI MN MS MO MT NE NV NH NJ NM NY NC ND OH OK OR "
+    "PA RI SC SD TN TX UT VT VA WA WV WI WY DC".split()
+)
+
+date_shape = re.compile(r"\b\d{1,2}[/-]\d{1,2}(?:[/-]\d{2,4})?\b")
+number_shape = re.compile(r"[#*]?\s*\b\w*\d\w*\b")
+word_shape = re.compile(r"[A-Z&']+")
+
+
+def normalize_name(name: str) -> tuple:
+    """
+    Returns the words of a transaction name without the parts that change from one purchase to the next,
+    so "STARBUCKS #1234 DALLAS TX 01/02" and "STARBUCKS #88 AUSTIN TX" both start with STARBUCKS
+    """
+    name = date_shape.sub(" ", name.upper())
+    name = number_shape.sub(" ", name)
+    words = word_shape.findall(name)
+    # Drop the city and state off the end
+    if len(words) > 2 and words[-1] in state_codes:
+        words = words[:-2]
+    # Drop payment processor prefixes, as long as there's something left
+    while len(words) > 1 and words[0] in name_prefixes:
+        words = words[1:]
+    return tuple(words)
+
+
+def trigrams(word: str) -> set:
+    padded = f" {word} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def unmatched_names() -> list:
+    """Returns (Name, transactions, amount) for every distinct name that has no vendor, archived years included"""
+    with db.engine.connect() as conn:
+        transactions_table, _ = archive.attach_archives(conn)
+        name_query = text(
+            f"""
+            SELECT Name, COUNT(id), SUM(Amount) FROM "{transactions_table}"
+            WHERE VendorUUID = 'No Vendor Found'
+            GROUP BY Name
+            """
+        )
+        return conn.execute(name_query).fetchall()
+
+
+def cluster_names(keys: list, similarity: float = 0.6, max_block_size: int = 500) -> list:
+    """
+    Groups normalized names whose first words look alike, returns a list of clusters (lists of indexes into keys).
+    Names are only compared when they share a trigram of their first word, using an inverted index,
+    so this stays quick with tens of thousands of names. Trigrams shared by more than max_block_size names
+    say nothing about the vendor and are skipped
+    """
+    heads = [key[0] if key else "" for key in keys]
+    head_grams = [trigrams(head) for head in heads]
+
+    # Inverted index of trigram to the names whose first word has it
+    gram_index = defaultdict(list)
+    for i, grams in enumerate(head_grams):
+        for gram in grams:
+            gram_index[gram].append(i)
+
+    # Union find, every name starts in its own cluster
+    parents = list(range(len(keys)))
+
+    def find(i: int) -> int:
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for i, grams in enumerate(head_grams):
+        # Count shared trigrams with the names after this one, which is all a Jaccard similarity needs
+        shared = Counter()
+        for gram in grams:
+            postings = gram_index[gram]
+            if len(postings) > max_block_size:
+                continue
+            shared.update(j for j in postings if j > i)
+        for j, overlap in shared.items():
+            if overlap / (len(grams) + len(head_grams[j]) - overlap) >= similarity:
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parents[root_j] = root_i
+
+    clusters = defaultdict(list)
+    for i in range(len(keys)):
+        clusters[find(i)].append(i)
+    return list(clusters.values())
+
+
+def common_words(keys: list) -> tuple:
+    # The words every name in the cluster starts with
+    words = []
+    for column in zip(*keys):
+        if len(set(column)) > 1:
+            break
+        words.append(column[0])
+    return tuple(words)
+
+
+def escape(text: str) -> str:
+    # re.escape also escapes spaces, which makes patterns in vendors.yml hard to read
+    return re.escape(text).replace("\\ ", " ")
+
+
+def propose_pattern(names: list, vendor_words: tuple) -> str:
+    """
+    Anchors on the start all the raw names share when that's long enough to mean something,
+    otherwise looks for the vendor's words anywhere in the name
+    """
+    prefix = os.path.commonprefix(names).rstrip(" #*-.0123456789")
+    if len(prefix) >= 3:
+        return "^" + escape(prefix)
+    return escape(" ".join(vendor_words))
+
+
+def suggest_vendors(min_transactions: int = 1, similarity: float = 0.6) -> "pd.DataFrame | None":
+    """
+    Returns one suggested vendor per group of similar unmatched names, with the pattern it would use,
+    how many names and transactions the pattern covers, and their total Amount.
+    Sorted by the dollars covered so the vendors worth adding come first. Check a suggestion with
+    search.preview_pattern before passing it to add_vendor, the tag is still up to you
+    """
+    import pandas as pd
+
+    rows = unmatched_names()
+    if not rows:
+        print("Every transaction has a vendor")
+        return None
+
+    # Names that clean up the same are combined before clustering, there are usually far fewer of those
+    key_names = defaultdict(list)
+    name_totals = {}
+    for name, transactions, amount in rows:
+        key_names[normalize_name(name)].append(name)
+        name_totals[name] = (transactions, amount)
+    keys = list(key_names)
+
+    suggestions = []
+    for cluster in cluster_names(keys, similarity=similarity):
+        cluster_keys = [keys[i] for i in cluster]
+        names = [name for key in cluster_keys for name in key_names[key]]
+        vendor_words = common_words(cluster_keys) or max(cluster_keys, key=len)[:1]
+        if not vendor_words:
+            continue
+        pattern = propose_pattern(names, vendor_words)
+        if checks.pattern_check(pattern) != True:
+            continue
+
+        # Only count the names in the cluster the pattern really matches
+        regex = re.compile(pattern)
+        covered = [name_totals[name] for name in names if regex.search(name)]
+        transactions = sum(row[0] for row in covered)
+        if transactions < min_transactions:
+            continue
+        suggestions.append(
+            {
+                "Vendor": " ".join(vendor_words).title(),
+                "Pattern": pattern,
+                "Names": len(covered),
+                "Transactions": transactions,
+                "Amount": round(sum(row[1] for row in covered), 2),
+                "Examples": ", ".join(sorted(names)[:3]),
+            }
+        )
+
+    if not suggestions:
+        print("No vendor suggestions")
+        return None
+
+    suggestion_table = pd.DataFrame(suggestions).drop_duplicates(subset="Pattern")
+    suggestion_table = suggestion_table.reindex(
+        suggestion_table["Amount"].abs().sort_values(ascending=False).index
+    ).reset_index(drop=True)
+    print(
+        f"{len(suggestion_table)} suggested vendors for {len(rows)} unmatched names, "
+        f"the top 10 cover {round(suggestion_table['Amount'].head(10).sum(), 2)}"
+    )
+    return suggestion_table
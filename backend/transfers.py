@@ -0,0 +1,167 @@
+"""
+Pairs up money moving between your own accounts, like a credit card payment that shows up as a payment in the card's
+export and as a withdrawal in the checking export. The two sides have different Names so hash_transaction can't
+tell they're the same money, and without a vendor tagged "Internal Transfer" both would count in the graphs.
+
+A pair is a negative and a positive transaction with the same amount, from different accounts, within a few days
+of each other. Paired transactions get the "Internal Transfer" tag in the graphs' tran_table.
+
+The account is worked out from the export's file name with the dates and times taken out, so this month's and last
+month's checking exports count as the same account and a refund can't pair with a purchase from the month before.
+"""
+import os
+import re
+import logging
+import datetime
+from itertools import groupby
+
+from sqlalchemy import text
+from sqlalchemy import insert
+from sqlalchemy import select
+from sqlalchemy import func
+from sqlalchemy.engine.base import Engine
+
+from backend import database as db
+
+logger = logging.getLogger(__name__)
+
+# Sorted by amount in cents then date, so one pass can merge the two sides of every amount.
+# Split parents aren't paired, their children are what the graphs use
+candidates_query = text(
+    """
+    SELECT t.id, t.Date, t.Amount, t.Source, CAST(ROUND(ABS(t.Amount) * 100) AS INTEGER) AS Cents
+    FROM Transactions t
+    LEFT JOIN "Transfer Pairs" d ON d.Debit_id = t.id
+    LEFT JOIN "Transfer Pairs" c ON c.Credit_id = t.id
+    WHERE d.id IS NULL AND c.id IS NULL
+        AND t.Amount != 0
+        AND t."Has Child" IS NULL
+        AND t.Date >= :start_date
+    ORDER BY Cents, t.Date
+    """
+)
+
+
+# Dates and times in export file names, like 2022-07-01, 20220701, 07-01-2022 or 05-59-02,
+# and the markers for copies and exports split into parts, like (1) or part 2
+file_name_dates = re.compile(
+    r"\d{4}[-_.]?\d{1,2}[-_.]?\d{1,2}|\d{1,2}[-_.]\d{1,2}[-_.]\d{2,4}|\(\d+\)|\bpart[\s_-]*\d+\b",
+    re.IGNORECASE,
+)
+
+
+def account_key(source: str | None) -> str | None:
+    """
+    The account an export came from, its file name without the dates, times or extension.
+    "US Bank Checking - 2022-07-01 05-59-02.csv" and "US Bank Checking - 2022-08-01 06-00-00.csv" are the same account
+    """
+    if source is None:
+        return None
+    account = file_name_dates.sub(" ", os.path.splitext(source)[0])
+    return re.sub(r"[\s_.-]+", " ", account).strip().lower()
+
+
+def day_number(date: str) -> int:
+    return datetime.date.fromisoformat(date[:10]).toordinal()
+
+
+def match_amount_group(rows: list, window_days: int) -> list:
+    """
+    Pairs the debits and credits of one amount, both already in date order. Each debit takes the earliest credit
+    from another account within window_days, the credit pointer only moves forward so this is a merge, not a nested loop.
+    The fourth item of each row is its account, see account_key
+    """
+    debits = [row for row in rows if row[2] < 0]
+    credits = [row for row in rows if row[2] > 0]
+    if not debits or not credits:
+        return []
+
+    credit_days = [day_number(row[1]) for row in credits]
+    used = [False] * len(credits)
+    pairs = []
+    start = 0
+    for debit in debits:
+        debit_day = day_number(debit[1])
+        # Credits too old for this debit are too old for every later one too
+        while start < len(credits) and credit_days[start] < debit_day - window_days:
+            start += 1
+        j = start
+        while j < len(credits) and credit_days[j] <= debit_day + window_days:
+            # Same account means something like a refund, not a transfer
+            if not used[j] and credits[j][3] != debit[3]:
+                used[j] = True
+                pairs.append((debit, credits[j], abs(credit_days[j] - debit_day)))
+                break
+            j += 1
+    return pairs
+
+
+@db.writes_database
+def pair_transfers(engine: Engine, window_days: int = 3, full: bool = False) -> int:
+    """
+    Finds and saves transfer pairs among the transactions that aren't paired yet, returns how many pairs were added.
+    Only looks around the transactions imported since it last ran, set full to True to look through everything.
+    Transactions imported before sources were recorded have no Source, and are only paired with ones that do
+    """
+    last_checked_id = 0 if full else int(db.get_state("transfer_pairs_checked_id", "0"))
+    with engine.connect() as conn:
+        first_new_date, max_id = conn.execute(
+            select(func.min(db.Transactions.Date), func.max(db.Transactions.id)).where(db.Transactions.id > last_checked_id)
+        ).fetchone()
+    if max_id is None:
+        return 0
+
+    # New transactions can pair with older ones up to window_days before them
+    start_date = datetime.date.fromordinal(day_number(first_new_date) - window_days).isoformat()
+    with engine.connect() as conn:
+        rows = conn.execute(candidates_query, {"start_date": start_date}).fetchall()
+
+    # Sources are file names, each one is turned into its account once
+    accounts = {}
+    rows = [
+        (row[0], row[1], row[2], accounts.setdefault(row[3], account_key(row[3])), row[4]) for row in rows
+    ]
+
+    pairs = []
+    for _, amount_rows in groupby(rows, key=lambda row: row[4]):
+        pairs.extend(match_amount_group(list(amount_rows), window_days))
+
+    if pairs:
+        current_time = datetime.datetime.now().isoformat()
+        with engine.begin() as conn:
+            conn.execute(
+                insert(db.TransferPairs),
+                [
+                    {
+                        "Debit_id": debit[0],
+                        "Credit_id": credit[0],
+                        "Amount": abs(debit[2]),
+                        "Days_Apart": days_apart,
+                        "Initialized": current_time,
+                    }
+                    for debit, credit, days_apart in pairs
+                ],
+            )
+        db.bump_data_version()
+        logger.debug(f"Paired {len(pairs)} transfers between accounts")
+
+    db.set_state("transfer_pairs_checked_id", str(max_id))
+    return len(pairs)
+
+
+def transfer_ids(engine: Engine | None = None) -> set:
+    """Returns the ids of every transaction that's half of a transfer pair"""
+    engine = engine or db.engine
+    with engine.connect() as conn:
+        pair_rows = conn.execute(select(db.TransferPairs.Debit_id, db.TransferPairs.Credit_id)).fetchall()
+    return {transaction_id for pair in pair_rows for transaction_id in pair}
+
+
+@db.writes_database
+def unpair_all(engine: Engine) -> None:
+    """Throws away every pair, run pair_transfers with full=True after to start over, like with a different window"""
+    with engine.begin() as conn:
+        conn.execute(db.TransferPairs.__table__.delete())
+    db.set_state("transfer_pairs_checked_id", "0")
+    db.bump_data_version()
+    db.bump_rewrite_version()
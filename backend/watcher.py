@@ -0,0 +1,167 @@
+"""
+Opt-in watcher for the banking_csvs folder, imports new csvs (or csvs that grew) in the background
+so the notebook doesn't block on an import. It polls the folder with os.stat, no extra services needed.
+
+Example use in the notebook:
+    from backend import watcher
+    folder_watcher = watcher.FolderWatcher()
+    folder_watcher.start()
+    folder_watcher.status()                   # poll how it's doing
+    report = await folder_watcher.next_import()  # or wait for the next import without blocking the kernel
+    folder_watcher.stop()
+"""
+import os
+import asyncio
+import logging
+import datetime
+import threading
+from pathlib import Path
+
+from backend import crud
+from backend import database as db
+from backend import persistence
+
+logger = logging.getLogger(__name__)
+
+
+def scan_folder(folder_path: str) -> dict:
+    """Returns a dictionary of csv path to its (size, modified time), without opening any of the files"""
+    stats = {}
+    for file_path in Path(folder_path).glob("*.[cC][sS][vV]"):
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        stats[str(file_path)] = (stat.st_size, stat.st_mtime_ns)
+    return stats
+
+
+class FolderWatcher:
+    """
+    Polls folder_path every interval seconds. A csv is imported once its size and modified time stop changing
+    between two polls, so a file that's still being written isn't imported half way.
+    Files that were imported before only get imported again if they grow, the duplicate rows are skipped by their hash.
+    """
+
+    def __init__(
+        self,
+        folder_path: str = crud.folder_path,
+        interval: float = 5.0,
+        bank_profiles_path: str = "bank_profiles.yml",
+        yml_file_path: str = crud.yml_file_path,
+    ):
+        self.folder_path = folder_path
+        self.interval = interval
+        self.bank_profiles_path = bank_profiles_path
+        self.yml_file_path = yml_file_path
+        self.reports = []
+        self.errors = []
+        self.last_scan = None
+        self.importing = False
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.waiters = []
+        self.waiters_lock = threading.Lock()
+
+        # What each file looked like when it was last imported, and on the last poll
+        self.imported = {}
+        self.pending = {}
+
+    def start(self) -> None:
+        """Starts watching on a background thread"""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        crud.get_session()
+
+        # Files already in the database count as imported the way they are right now
+        known_files = set(crud.get_all_export_names(self.folder_path)) - {
+            path.rsplit("/", maxsplit=1)[-1] for path in crud.get_latest_export_paths(self.folder_path)
+        }
+        for file_path, stat in scan_folder(self.folder_path).items():
+            if file_path.rsplit("/", maxsplit=1)[-1] in known_files:
+                self.imported[file_path] = stat
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="FolderWatcher", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Stops watching, waiting for an import that's already going to finish"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                logger.exception("Folder watcher failed to import")
+                self.errors.append((datetime.datetime.now().isoformat(), repr(e)))
+            self.stop_event.wait(self.interval)
+
+    def poll(self):
+        """Checks the folder once, and imports any file that's new or grew and has stopped changing"""
+        stats = scan_folder(self.folder_path)
+        self.last_scan = datetime.datetime.now().isoformat()
+
+        ready = []
+        for file_path, stat in stats.items():
+            if self.imported.get(file_path) == stat:
+                continue
+            # Wait for the file to look the same on two polls in a row before importing it
+            if self.pending.get(file_path) == stat:
+                ready.append(file_path)
+                del self.pending[file_path]
+            else:
+                self.pending[file_path] = stat
+
+        if not ready:
+            return None
+
+        self.importing = True
+        try:
+            # Waits for anything the notebook is writing, the crud functions take the same lock
+            with db.write_lock:
+                bank_profiles = persistence.load_yaml(self.bank_profiles_path)
+                crud.load_vendors(self.yml_file_path)
+                report = crud.import_transactions(
+                    self.folder_path, bank_profiles, db.engine, file_paths=sorted(ready)
+                )
+        finally:
+            self.importing = False
+
+        for file_path in ready:
+            self.imported[file_path] = stats[file_path]
+        self.reports.append(report)
+        self.notify(report)
+        return report
+
+    def notify(self, report) -> None:
+        """Hands the report to anything awaiting next_import, on their own event loop"""
+        with self.waiters_lock:
+            waiters, self.waiters = self.waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(lambda future=future: future.done() or future.set_result(report))
+
+    async def next_import(self):
+        """Waits for the next import to finish without blocking the notebook, and returns its ImportReport"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.waiters_lock:
+            self.waiters.append((loop, future))
+        return await future
+
+    def status(self) -> dict:
+        """How the watcher is doing, safe to call any time from the notebook"""
+        last_report = self.reports[-1] if self.reports else None
+        return {
+            "running": self.thread is not None and self.thread.is_alive(),
+            "importing": self.importing,
+            "last scan": self.last_scan,
+            "imports": len(self.reports),
+            "waiting on": sorted(self.pending),
+            "last import": last_report.summary() if last_report else None,
+            "errors": self.errors[-5:],
+            "data version": db.data_version(),
+        }
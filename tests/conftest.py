@@ -0,0 +1,80 @@
+"""
+Each test gets its own budget.db in a temp folder, with a handful of vendors loaded and helpers to import
+US Bank style exports into it, so nothing touches the real budget.db or vendors.yml.
+"""
+import os
+import csv
+
+import pytest
+
+from backend import database as db
+from backend import crud
+from backend import graphs
+from backend import dashboard
+from backend import persistence
+
+repo_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+test_vendors = [
+    {"UUID": "costco-uuid", "Vendor": "Costco", "Pattern": "^COSTCO", "Tag": "Groceries"},
+    {"UUID": "nandos-uuid", "Vendor": "Nandos", "Pattern": "^NANDOS", "Tag": "Eating out"},
+    {"UUID": "netflix-uuid", "Vendor": "Netflix", "Pattern": "^NETFLIX", "Tag": "Subscriptions"},
+    {"UUID": "amazon-uuid", "Vendor": "Amazon", "Pattern": "^AMAZON", "Tag": "Vendor w/o default Tag"},
+    {"UUID": "card-uuid", "Vendor": "Card Payment", "Pattern": "^CARD PAYMENT|^PAYMENT THANK YOU", "Tag": "Payments"},
+]
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    """Points the backend at an empty budget.db in tmp_path with test_vendors loaded, returns its folder"""
+    monkeypatch.setattr(db, "db_path", db.db_path)
+    monkeypatch.setattr(db, "engine", db.engine)
+    monkeypatch.chdir(tmp_path)
+    session = db.use_database(str(tmp_path / "budget.db"))
+    crud.sessions[db.engine] = session
+    # The module level caches are keyed by data version, which starts over in every new database
+    graphs.tables.clear()
+    graphs.figures.clear()
+    dashboard.aggregates.clear()
+
+    vendors = [dict(vendor, Initialized="2022-01-01T00:00:00") for vendor in test_vendors]
+    persistence.dump_yaml(vendors, str(tmp_path / "vendors.yml"))
+    crud.load_vendors(str(tmp_path / "vendors.yml"))
+    yield tmp_path
+    session.close()
+    crud.sessions.pop(db.engine, None)
+    db.engine.dispose()
+
+
+@pytest.fixture
+def bank_profiles():
+    return persistence.load_yaml(os.path.join(repo_folder, "bank_profiles.yml"))
+
+
+@pytest.fixture
+def write_export(ledger):
+    """Writes a US Bank export of (Date, Name, Amount) rows to the ledger's exports folder, returns its path"""
+
+    def write(file_name: str, rows: list) -> str:
+        folder = ledger / "exports"
+        folder.mkdir(exist_ok=True)
+        path = str(folder / file_name)
+        with open(path, "w", newline="") as export_file:
+            writer = csv.writer(export_file)
+            writer.writerow(["Date", "Transaction", "Name", "Memo", "Amount"])
+            for date, name, amount in rows:
+                writer.writerow([date, "DEBIT" if amount < 0 else "CREDIT", name, "", f"{amount:.2f}"])
+        return path
+
+    return write
+
+
+@pytest.fixture
+def import_export(write_export, bank_profiles):
+    """Writes an export like write_export and imports it, returns the ImportReport"""
+
+    def import_rows(file_name: str, rows: list, **kwargs):
+        path = write_export(file_name, rows)
+        return crud.import_transactions(os.path.dirname(path) + "/", bank_profiles, db.engine, file_paths=[path], **kwargs)
+
+    return import_rows
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+from backend import crud
+from backend import anomalies
+from backend import transfers
+from backend import database as db
+
+
+def monthly_spend(columns: dict, first_month: str = "2022-01") -> pd.DataFrame:
+    length = max(len(values) for values in columns.values())
+    months = pd.period_range(first_month, periods=length, freq="M").strftime("%Y-%m")
+    return pd.DataFrame({name: values + [np.nan] * (length - len(values)) for name, values in columns.items()}, index=months)
+
+
+def score(spend: pd.DataFrame, period: str) -> pd.DataFrame:
+    return anomalies.score_period(spend, period, window=12, min_months=4, threshold=3.5, min_change=20.0)
+
+
+def test_a_spike_is_flagged_and_steady_spending_is_not():
+    spend = monthly_spend({"Electric": [80, 85, 90, 82, 88, 84, 190], "Groceries": [400, 380, 420, 410, 395, 405, 415]})
+
+    flagged = score(spend, "2022-07")
+    assert list(flagged["Name"]) == ["Electric"]
+    row = flagged.iloc[0]
+    assert row["Usual"] == 84.5
+    assert row["Change"] == 105.5
+    assert row["Months of History"] == 6
+    # The scaled MAD is under a tenth of the median, so the median sets the scale
+    assert row["Score"] == round(105.5 / 8.45, 1)
+
+
+def test_a_bill_that_never_changed_isnt_flagged_for_cents():
+    spend = monthly_spend({"Phone": [45.0] * 6 + [45.5]})
+    assert score(spend, "2022-07").empty
+
+
+def test_missing_months_count_as_nothing_spent_once_a_name_shows_up():
+    # Months with no row for Gym are 0, so a normal month after a gap isn't a surprise
+    spend = monthly_spend({"Gym": [np.nan, 50, np.nan, 50, np.nan, 50, 50], "Rent": [1000] * 7})
+    spend = spend.dropna(how="all")
+
+    assert score(spend, "2022-07").empty
+    flagged = score(spend.assign(Gym=spend["Gym"].where(spend.index != "2022-07", 400)), "2022-07")
+    assert list(flagged["Name"]) == ["Gym"]
+    assert list(flagged["Months of History"]) == [5]
+
+
+def test_names_without_enough_history_are_skipped():
+    spend = monthly_spend({"New Hobby": [np.nan] * 4 + [20, 25, 900], "Rent": [1000] * 7})
+    assert score(spend, "2022-07").empty
+
+
+def test_find_anomalies_flags_the_tag_and_the_vendor(ledger, import_export):
+    rows = [(f"2022-{month:02d}-10", "COSTCO #12", -100.0 - month) for month in range(1, 7)]
+    rows += [(f"2022-{month:02d}-12", "NETFLIX.COM", -15.49) for month in range(1, 8)]
+    import_export("US Bank Checking - 2022-07-31.csv", rows + [("2022-07-10", "COSTCO #12", -450.0)])
+
+    anomaly_table = anomalies.find_anomalies(period="2022-07")
+    assert list(zip(anomaly_table["Kind"], anomaly_table["Name"])) == [("Tag", "Groceries"), ("Vendor", "Costco")]
+    assert set(anomaly_table["Month"]) == {"2022-07"}
+    assert set(anomaly_table["Amount"]) == {450.0}
+    assert anomalies.find_anomalies(period="2022-05") is None
+
+
+def test_incremental_sums_match_a_full_sum(ledger, import_export):
+    def sums_match() -> bool:
+        return sorted(anomalies.update_monthly_spend()) == sorted(anomalies.sum_spend())
+
+    import_export("US Bank Checking - 2022-02-28.csv", [("2022-01-10", "COSTCO #12", -100.0), ("2022-02-10", "NANDOS 1", -30.0)])
+    assert sums_match()
+
+    # New months, a split and a transfer pair are summed again on their own
+    import_export(
+        "US Bank Checking - 2022-03-31.csv",
+        [("2022-03-02", "AMAZON MKTPL", -60.0), ("2022-03-05", "CARD PAYMENT", -500.0), ("2022-02-20", "COSTCO #12", -40.0)],
+    )
+    import_export("US Bank Credit - 2022-03-31.csv", [("2022-03-06", "PAYMENT THANK YOU", 500.0)])
+    crud.make_children(db.engine, 3, [(-35.0, "Amazon", "Groceries", "food"), (-25.0, "Amazon", "Subscriptions", "prime")])
+    assert sums_match()
+    assert not any(row[1] == "card-uuid" for row in anomalies.update_monthly_spend())
+
+    # Unpairing and moving rows to another vendor can't be traced by ids, they bump the rewrite version
+    transfers.unpair_all(db.engine)
+    assert sums_match()
+    crud.update_vendor(db.engine, crud.get_session(), str(ledger / "vendors.yml"), "costco-uuid", new_pattern="^COSTCO|^NANDOS")
+    assert sums_match()
+    assert not any(row[1] == "nandos-uuid" for row in anomalies.update_monthly_spend())
+
+
+def test_the_cached_sums_are_used_until_something_changes(ledger, import_export):
+    import_export("US Bank Checking - 2022-02-28.csv", [("2022-01-10", "COSTCO #12", -100.0)])
+    rows = anomalies.update_monthly_spend()
+
+    # Nothing new, so a cache that was tampered with comes back as is
+    db.set_state("monthly_spend", db.get_state("monthly_spend").replace("100.0", "1.0"))
+    assert anomalies.update_monthly_spend() != rows
+    assert anomalies.update_monthly_spend(full=True) == rows
+
+    db.set_state("monthly_spend", db.get_state("monthly_spend").replace("100.0", "1.0"))
+    db.bump_rewrite_version()
+    assert anomalies.update_monthly_spend() == rows
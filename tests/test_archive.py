@@ -0,0 +1,63 @@
+from sqlalchemy import text
+from sqlalchemy import delete
+
+from backend import crud
+from backend import graphs
+from backend import archive
+from backend import database as db
+
+
+def view_ids(view: int) -> list:
+    with db.engine.connect() as conn:
+        tables = archive.attach_archives(conn)
+        return [row[0] for row in conn.execute(text(f'SELECT id FROM "{tables[view]}"'))]
+
+
+def archive_newest_ids(import_export) -> None:
+    # 2023 goes in first, so the year being archived holds the biggest ids
+    import_export("US Bank Checking - 2023-01-31.csv", [("2023-01-05", "COSTCO #12", -50.0)])
+    import_export(
+        "US Bank Checking - 2022-12-31.csv",
+        [("2022-12-05", "NANDOS 1", -20.0), ("2022-12-06", "AMAZON MKTPL", -30.0)],
+    )
+    crud.make_children(db.engine, 3, [(-10.0, "Amazon", "Groceries", "snacks"), (-20.0, "Amazon", "Subscriptions", "prime")])
+    assert archive.archive_year(2022) == 2
+
+
+def test_new_rows_never_reuse_archived_ids(ledger, import_export):
+    archive_newest_ids(import_export)
+    import_export("US Bank Checking - 2023-02-28.csv", [("2023-02-05", "COSTCO #12", -60.0), ("2023-02-06", "NANDOS 1", -25.0)])
+
+    # The new rows start past the archived 2 and 3
+    assert sorted(view_ids(0)) == [1, 2, 3, 4, 5]
+
+
+def test_new_children_never_reuse_archived_ids(ledger, import_export):
+    archive_newest_ids(import_export)
+    crud.make_children(db.engine, 1, [(-25.0, "Costco", "Groceries", "food"), (-25.0, "Nandos", "Eating out", "lunch")])
+
+    assert sorted(view_ids(1)) == [1, 2, 3, 4]
+
+
+def test_archives_made_before_ids_were_remembered(ledger, import_export):
+    archive_newest_ids(import_export)
+    with db.engine.begin() as conn:
+        conn.execute(delete(db.DataState).where(db.DataState.Key.like("%archived id")))
+    import_export("US Bank Checking - 2023-02-28.csv", [("2023-02-05", "COSTCO #12", -60.0)])
+
+    ids = view_ids(0)
+    assert len(ids) == len(set(ids))
+
+
+def test_archived_years_still_show_and_stay_archived(ledger, import_export):
+    archive_newest_ids(import_export)
+    rewrite_version = db.get_state("rewrite_version")
+
+    tran_table = graphs.get_tran_table()
+    assert sorted(tran_table["Name"]) == ["AMAZON MKTPL", "AMAZON MKTPL", "COSTCO #12", "NANDOS 1"]
+    assert set(tran_table.loc[tran_table["Name"] == "AMAZON MKTPL", "Tag"]) == {"Groceries", "Subscriptions"}
+
+    # The same export again doesn't bring the archived rows back into budget.db
+    report = import_export("US Bank Checking - 2022-12-31 (1).csv", [("2022-12-05", "NANDOS 1", -20.0)])
+    assert report.inserted == 0 and report.duplicates == 1
+    assert db.get_state("rewrite_version") == rewrite_version
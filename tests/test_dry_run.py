@@ -0,0 +1,68 @@
+import os
+
+from sqlalchemy import func
+from sqlalchemy import select
+
+from backend import crud
+from backend import archive
+from backend import database as db
+
+
+def report_counts(report) -> list:
+    return [
+        (file_report.file_name, file_report.bank_name, file_report.inserted, file_report.duplicates,
+         file_report.unvendorized, file_report.errors, file_report.first_date, file_report.last_date)
+        for file_report in report.files
+    ]
+
+
+def row_count(table) -> int:
+    with db.engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(table)).scalar()
+
+
+def test_dry_run_matches_the_real_import(ledger, import_export, write_export, bank_profiles):
+    import_export(
+        "US Bank Checking - 2023-01-31.csv",
+        [("2022-12-05", "NANDOS 1", -20.0), ("2023-01-05", "COSTCO #12", -50.0), ("2023-01-06", "NANDOS 1", -21.0)],
+    )
+    archive.archive_year(2022)
+
+    paths = [
+        write_export(
+            "US Bank Checking - 2023-02-28.csv",
+            [
+                ("2022-12-05", "NANDOS 1", -20.0),  # archived
+                ("2023-01-05", "COSTCO #12", -50.0),  # already saved
+                ("2023-02-01", "COSTCO #12", -70.0),
+                ("2023-02-01", "COSTCO #12", -70.0),  # twice in the same file
+                ("2023-02-03", "CORNER STORE", -4.0),  # no vendor
+            ],
+        ),
+        write_export("US Bank Savings - 2023-02-28.csv", [("2023-02-01", "COSTCO #12", -70.0), ("2023-02-09", "NETFLIX", -15.0)]),
+    ]
+    # A file no bank profile matches
+    paths.append(str(ledger / "exports" / "notes.csv"))
+    with open(paths[-1], "w") as notes:
+        notes.write("not,a,bank\n")
+
+    folder = os.path.dirname(paths[0]) + "/"
+    transactions_before = row_count(db.Transactions)
+    preview = crud.import_transactions(folder, bank_profiles, db.engine, file_paths=paths, dry_run=True)
+    assert preview.dry_run
+    assert row_count(db.Transactions) == transactions_before
+    assert row_count(db.ExpenseImports) == 1
+
+    imported = crud.import_transactions(folder, bank_profiles, db.engine, file_paths=paths)
+    assert report_counts(preview) == report_counts(imported)
+    assert (preview.inserted, preview.duplicates, preview.unvendorized, preview.errors) == (3, 4, 1, 1)
+    assert row_count(db.Transactions) == transactions_before + 3
+
+
+def test_dry_run_of_an_imported_file_finds_only_duplicates(ledger, import_export, write_export, bank_profiles):
+    rows = [("2023-01-05", "COSTCO #12", -50.0), ("2023-01-06", "NANDOS 1", -21.0)]
+    import_export("US Bank Checking - 2023-01-31.csv", rows)
+    path = write_export("US Bank Checking - 2023-01-31 (1).csv", rows)
+
+    preview = crud.preview_import([path], bank_profiles, db.engine)
+    assert (preview.inserted, preview.duplicates) == (0, 2)
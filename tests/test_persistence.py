@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+from backend import persistence
+
+
+def vendor(UUID: str, name: str, initialized: str = "2022-01-01T00:00:00") -> dict:
+    return {"UUID": UUID, "Vendor": name, "Pattern": f"^{name.upper()}", "Tag": "Groceries", "Initialized": initialized}
+
+
+def test_journal_replays_on_top_of_the_file(tmp_path):
+    path = str(tmp_path / "vendors.yml")
+    persistence.dump_yaml([vendor("a", "Costco")], path)
+    persistence.append_journal(
+        path,
+        [
+            {"op": "add", "vendor": vendor("b", "Nandos")},
+            {"op": "update", "UUID": "a", "Pattern": "^COSTCO|^KIRKLAND"},
+        ],
+    )
+
+    vendors = persistence.read_vendor_file(path)
+    assert [entry["UUID"] for entry in vendors] == ["a", "b"]
+    assert vendors[0]["Pattern"] == "^COSTCO|^KIRKLAND"
+
+
+def test_replaying_an_add_twice_keeps_one_vendor(tmp_path):
+    path = str(tmp_path / "vendors.yml")
+    persistence.dump_yaml([vendor("a", "Costco")], path)
+    persistence.append_journal(path, [{"op": "add", "vendor": vendor("b", "Nandos")}])
+    # A crash after compacting but before the journal is removed leaves the add in both
+    persistence.dump_yaml(persistence.read_vendor_file(path), path)
+
+    vendors = persistence.read_vendor_file(path)
+    assert [entry["UUID"] for entry in vendors] == ["a", "b"]
+    assert persistence.apply_changes(list(vendors), persistence.read_journal(path)) == vendors
+
+
+def test_a_rebranded_vendor_added_again_is_kept(tmp_path):
+    path = str(tmp_path / "vendors.yml")
+    persistence.dump_yaml([vendor("a", "Costco")], path)
+    # Same UUID added later is a new row in the Vendors table, not a duplicate
+    persistence.append_journal(path, [{"op": "add", "vendor": vendor("a", "Costco Wholesale", "2023-01-01T00:00:00")}])
+    assert len(persistence.read_vendor_file(path)) == 2
+
+
+def test_half_written_journal_line_is_skipped(tmp_path):
+    path = str(tmp_path / "vendors.yml")
+    persistence.dump_yaml([vendor("a", "Costco")], path)
+    persistence.append_journal(path, [{"op": "add", "vendor": vendor("b", "Nandos")}])
+    with open(persistence.journal_path(path), "a") as journal:
+        journal.write('{"op": "add", "vendor": {"UUID": "c"')
+
+    assert [entry["UUID"] for entry in persistence.read_vendor_file(path)] == ["a", "b"]
+
+
+def test_journal_is_compacted_into_the_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "vendors.yml")
+    persistence.dump_yaml([], path)
+    monkeypatch.setattr(persistence, "compact_every", 3)
+    for number in range(3):
+        persistence.append_journal(path, [{"op": "add", "vendor": vendor(str(number), f"Vendor {number}")}])
+
+    assert not os.path.exists(persistence.journal_path(path))
+    assert [entry["UUID"] for entry in persistence.load_yaml(path)] == ["0", "1", "2"]
+
+
+def test_dump_yaml_keeps_the_file_mode(tmp_path):
+    path = str(tmp_path / "vendors.yml")
+    persistence.dump_yaml([vendor("a", "Costco")], path)
+    assert os.stat(path).st_mode & 0o777 == persistence.new_file_mode()
+
+    os.chmod(path, 0o640)
+    persistence.dump_yaml([vendor("b", "Nandos")], path)
+    assert os.stat(path).st_mode & 0o777 == 0o640
+
+
+def test_failed_dump_leaves_the_old_file(tmp_path):
+    path = str(tmp_path / "vendors.yml")
+    persistence.dump_yaml([vendor("a", "Costco")], path)
+
+    with pytest.raises(Exception):
+        # SafeDumper refuses arbitrary objects part way through writing
+        persistence.dump_yaml([vendor("b", "Nandos"), object()], path)
+
+    assert persistence.load_yaml(path) == [vendor("a", "Costco")]
+    assert os.listdir(tmp_path) == ["vendors.yml"]
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+from backend import crud
+from backend import transfers
+from backend import projection
+from backend import persistence
+from backend import database as db
+
+
+@pytest.fixture
+def budget_plans_path(ledger) -> str:
+    plans = {
+        "test_plan": {
+            "needs": {"percentage": 50, "required": True, "type": "hard_limit", "tags": ["Groceries", "Payments"]},
+            "wants": {"percentage": 50, "required": False, "type": "free_spend", "tags": ["Eating out", "Subscriptions"]},
+        }
+    }
+    path = str(ledger / "budget_plans.yml")
+    persistence.dump_yaml(plans, path)
+    return path
+
+
+def test_add_months_builds_running_totals_and_swaps_months():
+    rows = [["2022-01-03", "costco-uuid", "", 10.0], ["2022-01-03", "costco-uuid", "", 5.0], ["2022-01-20", "nandos-uuid", "", 7.0]]
+    curves = projection.add_months(None, rows, set())
+    assert list(curves["months"]) == ["2022-01"]
+    assert list(zip(curves["vendors"], curves["tags"])) == [("costco-uuid", ""), ("nandos-uuid", "")]
+    costco = curves["cumulative"][0, 0]
+    assert costco[1] == 0 and costco[2] == 15 and costco[-1] == 15
+    assert curves["cumulative"][0, 1, 18] == 0 and curves["cumulative"][0, 1, 19] == 7
+
+    # February is added, January is kept as it was
+    curves = projection.add_months(curves, [["2022-02-01", "costco-uuid", "Groceries", 4.0]], {"2022-02"})
+    assert list(curves["months"]) == ["2022-01", "2022-02"]
+    assert curves["cumulative"][0, 0, -1] == 15
+    assert curves["cumulative"][1, 2, -1] == 4
+
+    # Swapping January for no rows empties it
+    curves = projection.add_months(curves, [], {"2022-01"})
+    assert curves["cumulative"][0].sum() == 0
+    assert curves["cumulative"][1, 2, -1] == 4
+
+
+def test_burn_rate_without_enough_history(ledger, import_export, budget_plans_path):
+    import_export("US Bank Checking - 2022-01-31.csv", [("2022-01-02", "COSTCO #12", -60.0), ("2022-01-10", "NANDOS 1", -40.0)])
+
+    projection_table = projection.project_month(12000, "test_plan", month="2022-01", day=10, budget_plans_path=budget_plans_path)
+    rows = projection_table.set_index("Category")
+    assert rows.loc["needs", "Spent"] == 60.0
+    assert rows.loc["needs", "Projected"] == round(60.0 / 10 * 31, 2)
+    assert rows.loc["wants", "Projected"] == rows.loc["wants", "Burn Rate Projection"] == 124.0
+    assert np.isnan(rows.loc["needs", "Usual By Today"])
+    assert rows.loc["needs", "Monthly Limit"] == 500.0
+    assert not rows["Likely Over"].any()
+
+
+def test_projection_follows_the_usual_shape_of_a_month(ledger, import_export, budget_plans_path):
+    # Every month has 100 of groceries on the 1st and another 100 on the 20th
+    rows = [(f"2022-{month:02d}-{day:02d}", "COSTCO #12", -100.0) for month in (2, 3, 4) for day in (1, 20)]
+    import_export("US Bank Checking - 2022-05-31.csv", rows + [("2022-05-01", "COSTCO #12", -100.0)])
+
+    projection_table = projection.project_month(4000, "test_plan", month="2022-05", day=10, budget_plans_path=budget_plans_path)
+    needs = projection_table.set_index("Category").loc["needs"]
+    assert needs["Usual By Today"] == 100.0
+    # The rest of each month is scaled to May's 21 days left, 100 * 21/18, 100 * 21/21 and 100 * 21/20
+    assert needs["Projected"] == 205.0
+    assert needs["Burn Rate Projection"] == 310.0
+    # A hard_limit of 4000 * 50% / 12 a month
+    assert needs["Likely Over"]
+
+
+def test_pace_stretches_the_rest_of_the_month(ledger, import_export, budget_plans_path):
+    # 100 on the 1st and 20th of March, April and May
+    rows = [(f"2022-{month:02d}-{day:02d}", "COSTCO #12", -100.0) for month in (3, 4, 5) for day in (1, 20)]
+    rows += [("2022-06-01", "COSTCO #12", -300.0), ("2022-06-02", "NANDOS 1", -10.0)]
+    import_export("US Bank Checking - 2022-06-30.csv", rows)
+
+    projection_table = projection.project_month(12000, "test_plan", month="2022-06", day=10, budget_plans_path=budget_plans_path)
+    categories = projection_table.set_index("Category")
+    # Three times the usual pace is held to max_pace, the usual rest of the month is the 31 day months' 100 * 20/21
+    assert categories.loc["needs", "Projected"] == round(300.0 + 100.0 * 20 / 21 * projection.max_pace, 2)
+    # Nothing usually gets spent on wants, so there's no pace and nothing more coming
+    assert categories.loc["wants", "Projected"] == 10.0
+
+
+def curve_totals(curves: dict) -> dict:
+    """(month, vendor, tag) to its running totals, keys an incremental update left empty don't count"""
+    return {
+        (month, vendor_uuid, tag): list(curves["cumulative"][month_position, key_position])
+        for month_position, month in enumerate(curves["months"])
+        for key_position, (vendor_uuid, tag) in enumerate(zip(curves["vendors"], curves["tags"]))
+        if curves["cumulative"][month_position, key_position].any()
+    }
+
+
+def test_incremental_curves_match_full_ones(ledger, import_export):
+    def curves_match() -> bool:
+        incremental = projection.update_spend_curves()
+        return curve_totals(incremental) == curve_totals(projection.update_spend_curves(full=True))
+
+    import_export("US Bank Checking - 2022-02-28.csv", [("2022-01-10", "COSTCO #12", -100.0), ("2022-02-10", "NANDOS 1", -30.0)])
+    assert curves_match()
+
+    import_export(
+        "US Bank Checking - 2022-03-31.csv",
+        [("2022-03-02", "AMAZON MKTPL", -60.0), ("2022-03-05", "CARD PAYMENT", -500.0), ("2022-02-20", "COSTCO #12", -40.0)],
+    )
+    import_export("US Bank Credit - 2022-03-31.csv", [("2022-03-06", "PAYMENT THANK YOU", 500.0)])
+    crud.make_children(db.engine, 3, [(-35.0, "Amazon", "Groceries", "food"), (-25.0, "Amazon", "Subscriptions", "prime")])
+    assert curves_match()
+
+    transfers.unpair_all(db.engine)
+    assert curves_match()
+    crud.update_vendor(db.engine, crud.get_session(), str(ledger / "vendors.yml"), "costco-uuid", new_pattern="^COSTCO|^NANDOS")
+    assert curves_match()
+    assert not any(key[1] == "nandos-uuid" for key in curve_totals(projection.update_spend_curves()))
+
+
+def test_a_deleted_curves_file_is_rebuilt(ledger, import_export):
+    import_export("US Bank Checking - 2022-01-31.csv", [("2022-01-10", "COSTCO #12", -100.0)])
+    curves = projection.update_spend_curves()
+    ledger.joinpath("budget_spend_curves.npz").unlink()
+
+    rebuilt = projection.update_spend_curves()
+    assert np.array_equal(rebuilt["cumulative"], curves["cumulative"])
+    assert ledger.joinpath("budget_spend_curves.npz").exists()
@@ -0,0 +1,56 @@
+from sqlalchemy import select
+
+from backend import crud
+from backend import database as db
+
+
+def vendor_counts() -> dict:
+    with db.engine.connect() as conn:
+        rows = conn.execute(select(db.Transactions.Name, db.Transactions.VendorUUID)).fetchall()
+    counts = {}
+    for name, vendor_uuid in rows:
+        counts[(name, vendor_uuid)] = counts.get((name, vendor_uuid), 0) + 1
+    return counts
+
+
+def update_pattern(ledger, UUID: str, pattern: str) -> None:
+    crud.update_vendor(db.engine, crud.get_session(), str(ledger / "vendors.yml"), UUID, new_pattern=pattern)
+
+
+def test_widened_pattern_takes_rows_from_another_vendor(ledger, import_export):
+    import_export(
+        "US Bank Checking - 2023-01-31.csv",
+        [("2023-01-05", "COSTCO #12", -50.0), ("2023-01-06", "NANDOS 1", -20.0), ("2023-01-07", "NANDOS 1", -22.0)],
+    )
+
+    update_pattern(ledger, "costco-uuid", "^COSTCO|^NANDOS")
+    # Costco comes before Nandos in the patterns, so every NANDOS row is Costco's now, like vendorizer says
+    assert vendor_counts() == {("COSTCO #12", "costco-uuid"): 1, ("NANDOS 1", "costco-uuid"): 2}
+
+    update_pattern(ledger, "costco-uuid", "^COSTCO")
+    assert vendor_counts() == {("COSTCO #12", "costco-uuid"): 1, ("NANDOS 1", "nandos-uuid"): 2}
+
+
+def test_reclassify_reports_rows_gained_lost_and_moved(ledger, import_export):
+    import_export(
+        "US Bank Checking - 2023-01-31.csv",
+        [("2023-01-05", "COSTCO #12", -50.0), ("2023-01-06", "NANDOS 1", -20.0), ("2023-01-08", "TACO SHACK", -9.0)],
+    )
+
+    update_pattern(ledger, "costco-uuid", "^COSTCO|^NANDOS|^TACO")
+    delta = crud.reclassify_vendor(db.engine, "costco-uuid", "^COSTCO", "^COSTCO|^NANDOS|^TACO")
+    # Already applied by update_vendor, running it again changes nothing
+    assert delta["rows gained"] == 0 and delta["rows moved"] == {}
+
+    update_pattern(ledger, "costco-uuid", "^TACO")
+    counts = vendor_counts()
+    assert counts[("COSTCO #12", "No Vendor Found")] == 1
+    assert counts[("NANDOS 1", "nandos-uuid")] == 1
+    assert counts[("TACO SHACK", "costco-uuid")] == 1
+
+
+def test_names_neither_pattern_matches_are_left_alone(ledger, import_export):
+    import_export("US Bank Checking - 2023-01-31.csv", [("2023-01-05", "NETFLIX.COM", -15.0)])
+    delta = crud.reclassify_vendor(db.engine, "costco-uuid", "^COSTCO", "^COSTCO|^NANDOS")
+    assert delta["names affected"] == 0
+    assert vendor_counts() == {("NETFLIX.COM", "netflix-uuid"): 1}
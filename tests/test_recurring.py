@@ -0,0 +1,93 @@
+import datetime
+
+import numpy as np
+from sqlalchemy import select
+
+from backend import crud
+from backend import recurring
+from backend import transfers
+from backend import database as db
+
+
+def monthly_days(start: str, count: int) -> np.ndarray:
+    first = datetime.date.fromisoformat(start)
+    months = [first.month - 1 + i for i in range(count)]
+    return np.array([datetime.date(first.year + month // 12, month % 12 + 1, first.day).toordinal() for month in months], dtype=float)
+
+
+def test_monthly_series_with_a_price_change():
+    days = monthly_days("2022-01-15", 6)
+    amounts = np.array([15.49, 15.49, 15.49, 17.99, 17.99, 17.99])
+
+    (series,) = recurring.detect_group(days, amounts)
+    assert series["Cadence"] == "Monthly"
+    assert series["Charges"] == 6
+    assert series["Amount"] == 17.99
+    assert series["Last Charge"] == "2022-06-15"
+    assert series["Next Expected"] == "2022-07-15"
+    assert series["Price Changes"] == ["2022-04-15: 15.49 -> 17.99"]
+    assert series["Annual Cost"] == round(17.99 * 365.2 / 30.4, 2)
+
+
+def test_one_off_bump_is_not_a_price_change():
+    days = monthly_days("2022-01-03", 5)
+    amounts = np.array([60.0, 60.0, 64.0, 60.0, 60.0])
+
+    (series,) = recurring.detect_group(days, amounts)
+    assert series["Price Changes"] == []
+
+
+def test_subscription_found_among_one_off_purchases():
+    subscription_days = monthly_days("2022-01-10", 5)
+    purchase_days = np.array([datetime.date(2022, m, d).toordinal() for m, d in ((1, 2), (2, 21), (4, 4))], dtype=float)
+    days = np.concatenate([subscription_days, purchase_days])
+    amounts = np.concatenate([np.full(5, 14.99), [83.20, 7.45, 212.00]])
+    order = np.argsort(days, kind="stable")
+
+    (series,) = recurring.detect_group(days[order], amounts[order])
+    assert series["Cadence"] == "Monthly"
+    assert series["Amount"] == 14.99
+    assert series["Charges"] == 5
+
+
+def test_irregular_charges_are_not_recurring():
+    days = np.array([datetime.date(2022, 1, d).toordinal() for d in (1, 3, 12, 30)], dtype=float)
+    assert recurring.detect_group(days, np.array([10.0, 10.0, 10.0, 10.0])) == []
+
+
+def netflix_months(months: list) -> list:
+    return [(f"2022-{month:02d}-07", "NETFLIX.COM", -15.49) for month in months]
+
+
+def test_incremental_update_matches_a_full_one(ledger, import_export):
+    import_export("US Bank Checking - 2022-04-30.csv", netflix_months([1, 2, 3, 4]) + [("2022-03-02", "AMAZON MKTPL", -45.0)])
+    assert [series["Charges"] for series in recurring.update_recurring()["NETFLIX COM"]] == [4]
+
+    # New charges, a split and a transfer pair only redo their own groups
+    import_export(
+        "US Bank Checking - 2022-06-30.csv",
+        netflix_months([5, 6]) + [("2022-06-02", "AMAZON MKTPL", -30.0), ("2022-06-03", "CARD PAYMENT", -500.0)],
+    )
+    import_export("US Bank Credit - 2022-06-30.csv", [("2022-06-04", "PAYMENT THANK YOU", 500.0)])
+    with db.engine.connect() as conn:
+        amazon_id = conn.execute(select(db.Transactions.id).where(db.Transactions.Date.like("2022-06-02%"))).scalar()
+    crud.make_children(db.engine, amazon_id, [(-20.0, "Amazon", "Groceries", "food"), (-10.0, "Netflix", "Subscriptions", "gift card")])
+    incremental = recurring.update_recurring()
+    assert incremental == recurring.update_recurring(full=True)
+    assert [series["Charges"] for series in incremental["NETFLIX COM"]] == [6]
+
+    # Unpairing can't be traced to a group by ids, so everything is redone
+    transfers.unpair_all(db.engine)
+    assert recurring.update_recurring() == recurring.update_recurring(full=True)
+
+
+def test_recurring_charges_marks_overdue_series_inactive(ledger, import_export):
+    import_export(
+        "US Bank Checking - 2022-09-30.csv",
+        netflix_months([1, 2, 3, 4]) + [(f"2022-{month:02d}-20", "COSTCO #12", -60.0) for month in range(1, 10)],
+    )
+
+    recurring_table = recurring.recurring_charges()
+    assert list(recurring_table["Vendor"]) == ["Costco", "Netflix"]
+    assert list(recurring_table["Active"]) == [True, False]
+    assert len(recurring.recurring_charges(active_only=True)) == 1
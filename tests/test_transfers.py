@@ -0,0 +1,65 @@
+from sqlalchemy import select
+
+from backend import graphs
+from backend import transfers
+from backend import database as db
+
+
+def paired_names() -> set:
+    with db.engine.connect() as conn:
+        names = dict(conn.execute(select(db.Transactions.id, db.Transactions.Name)).fetchall())
+        pairs = conn.execute(select(db.TransferPairs.Debit_id, db.TransferPairs.Credit_id)).fetchall()
+    return {(names[debit_id], names[credit_id]) for debit_id, credit_id in pairs}
+
+
+def test_account_key_drops_dates_copies_and_parts():
+    key = transfers.account_key("US Bank Checking - 2022-07-01 05-59-02.csv")
+    assert key == "us bank checking"
+    assert transfers.account_key("US Bank Checking - 2022-08-01 06-00-00 (1).csv") == key
+    assert transfers.account_key("US_Bank_Checking_20220901 part 2.csv") == key
+    assert transfers.account_key("Apple Card - 2022-07-01.csv") != key
+
+
+def test_payment_between_accounts_is_paired(ledger, import_export):
+    import_export("US Bank Checking - 2023-01-31.csv", [("2023-01-10", "CARD PAYMENT", -500.0)])
+    report = import_export("Apple Card - 2023-01-31.csv", [("2023-01-12", "PAYMENT THANK YOU", 500.0)])
+
+    assert report.transfers_paired == 1
+    assert paired_names() == {("CARD PAYMENT", "PAYMENT THANK YOU")}
+    assert set(graphs.get_tran_table()["Tag"]) == {"Internal Transfer"}
+
+
+def test_refund_in_the_same_account_is_not_a_transfer(ledger, import_export):
+    import_export("US Bank Checking - 2023-01-31.csv", [("2023-01-30", "COSTCO #12", -80.0)])
+    # Next month's export of the same account, the refund comes back within the window
+    report = import_export("US Bank Checking - 2023-02-28.csv", [("2023-02-01", "COSTCO #12 REFUND", 80.0)])
+
+    assert report.transfers_paired == 0
+    assert paired_names() == set()
+
+
+def test_too_far_apart_is_not_a_transfer(ledger, import_export):
+    import_export("US Bank Checking - 2023-01-31.csv", [("2023-01-01", "CARD PAYMENT", -500.0)])
+    import_export("Apple Card - 2023-01-31.csv", [("2023-01-20", "PAYMENT THANK YOU", 500.0)])
+    assert paired_names() == set()
+
+
+def test_each_side_is_only_paired_once(ledger, import_export):
+    import_export(
+        "US Bank Checking - 2023-01-31.csv",
+        [("2023-01-10", "CARD PAYMENT", -100.0), ("2023-01-11", "CARD PAYMENT 2", -100.0)],
+    )
+    import_export("Apple Card - 2023-01-31.csv", [("2023-01-11", "PAYMENT THANK YOU", 100.0)])
+    assert len(paired_names()) == 1
+
+
+def test_unpair_all_and_pair_again(ledger, import_export):
+    import_export("US Bank Checking - 2023-01-31.csv", [("2023-01-10", "CARD PAYMENT", -500.0)])
+    import_export("Apple Card - 2023-01-31.csv", [("2023-01-12", "PAYMENT THANK YOU", 500.0)])
+
+    transfers.unpair_all(db.engine)
+    assert paired_names() == set()
+    assert "Internal Transfer" not in set(graphs.get_tran_table()["Tag"])
+
+    assert transfers.pair_transfers(db.engine) == 1
+    assert paired_names() == {("CARD PAYMENT", "PAYMENT THANK YOU")}